@@ -0,0 +1,159 @@
+"""
+Benchmark ponta a ponta do pipeline (main.main) sem gastar cota real: MIIA e LiteLLM são
+servidores HTTP locais (benchmarks/fakes.py), o banco é o PostgreSQL local semeado no schema
+miia_bench (benchmarks/seed.py) e a planilha fica em memória.
+
+Para cada tamanho de lote, semeia o banco, roda o pipeline e reporta questões/minuto,
+requisições feitas a cada serviço e p50/p95 por etapa (do relatório de src/metrics.py).
+Argumentos depois de `--` vão direto para main.main.
+
+Uso:
+    BENCH_DB_HOST=localhost BENCH_DB_PASSWORD=postgres python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --sizes 10,100 --job-latency 2 --poll-interval 1 -- --pipeline
+    python benchmarks/bench_e2e.py --sizes 1000 -o e2e.json -- --workers 32
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+# Sem rede: o litellm usa a tabela de custos local em vez de baixá-la no import
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import seed
+import fakes
+import db
+import main as pipeline_main
+import miia_api
+
+STAGES = ("stage.structure", "stage.generate", "stage.submit", "stage.collect", "stage.write", "question")
+
+
+def configure_env(miia, llm, workdir):
+    """Aponta os clientes para os servidores falsos; o .env do projeto não é usado para nada disso."""
+    os.environ.update({
+        "BASE_URL": miia.url,
+        "MIIA_API_TOKEN": "bench",
+        "LITELLM_API_BASE": f"{llm.url}/v1",
+        "LITELLM_API_KEY": "bench",
+        "LLM_DEFAULT_MODEL": "openai/bench-model",
+        "LLM_MAX_TOKENS": "2048",
+        "LLM_TIMEOUT": "60",
+        "LLM_CACHE": "0",
+        "STRUCTURE_CACHE": "0",
+        "GOOGLE_SHEET_ID": "bench",
+        "GOOGLE_SHEET_TAB": "resultados",
+        "GOOGLE_SHEET_TAB_LOG": "esteira_log",
+        "RESULTS_STORE_PATH": os.path.join(workdir, "results.sqlite3"),
+    })
+
+
+def run_batch(size, args, main_args, database, miia, llm):
+    integration_ids = seed.seed(database, size, args.criteria, 0)
+    with tempfile.TemporaryDirectory(prefix="bench_e2e_") as workdir:
+        configure_env(miia, llm, workdir)
+        ids_file = os.path.join(workdir, "ids.txt")
+        with open(ids_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(integration_ids) + "\n")
+        report_base = os.path.join(workdir, "metrics")
+
+        miia.reset_counts()
+        llm.reset_counts()
+        log = sys.stdout if args.verbose else open(os.devnull, "w")
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(log):
+                pipeline_main.main(["--ids-file", ids_file, "--metrics-report", report_base, *main_args])
+        finally:
+            if log is not sys.stdout:
+                log.close()
+        elapsed = time.perf_counter() - start
+
+        with open(f"{report_base}.json", encoding="utf-8") as f:
+            report = json.load(f)
+
+    return {
+        "size": size,
+        "elapsed_s": elapsed,
+        "questions_per_minute": size / elapsed * 60,
+        "ok": report["questions"]["ok"],
+        "failed": report["questions"]["failed"],
+        "requests": {"miia": dict(miia.counts), "llm": dict(llm.counts)},
+        "stages": {name: report["spans"][name] for name in STAGES if name in report["spans"]},
+        "counters": report["counters"],
+        "faults": report["faults"],
+        "hedging": report["hedging"],
+    }
+
+
+def print_results(results):
+    print(f"\n{'lote':>6}{'tempo (s)':>11}{'q/min':>9}{'ok':>6}{'erro':>6}{'POST MIIA':>11}{'GET MIIA':>10}{'LLM':>7}")
+    for r in results:
+        miia, llm = r["requests"]["miia"], r["requests"]["llm"]
+        print(f"{r['size']:>6}{r['elapsed_s']:>11.1f}{r['questions_per_minute']:>9.1f}{r['ok']:>6}{r['failed']:>6}"
+              f"{miia.get('POST assess', 0):>11}{miia.get('GET job', 0):>10}{llm.get('POST chat/completions', 0):>7}")
+
+    print(f"\n{'etapa (p50 / p95, s)':<22}" + "".join(f"{r['size']:>18}" for r in results))
+    for name in STAGES:
+        cells = []
+        for r in results:
+            s = r["stages"].get(name)
+            cells.append(f"{s['p50_s']:.2f} / {s['p95_s']:.2f}" if s else "-")
+        print(f"{name:<22}" + "".join(f"{c:>18}" for c in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000", help="tamanhos de lote, separados por vírgula")
+    parser.add_argument("--criteria", type=int, default=8, help="critérios por questão")
+    parser.add_argument("--job-latency", type=float, default=5.0, help="mediana da duração de um job na MIIA (s)")
+    parser.add_argument("--job-latency-sigma", type=float, default=0.5, help="sigma da lognormal da duração dos jobs")
+    parser.add_argument("--job-failure-rate", type=float, default=0.0, help="fração de jobs que terminam em 'failed'")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fração de requisições à MIIA que recebem 500")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="mediana da latência do LLM (s)")
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.3)
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0,
+                        help="fração de chamadas ao LLM na cauda lenta (para avaliar --hedge)")
+    parser.add_argument("--llm-slow-latency", type=float, default=30.0, help="mediana das chamadas lentas (s)")
+    parser.add_argument("--fallback-latency", type=float, default=None,
+                        help="mediana do modelo reserva; liga LLM_FALLBACK_MODEL=openai/bench-fallback")
+    parser.add_argument("--poll-interval", type=float, default=miia_api.MIIA_API.POLL_INTERVAL_S,
+                        help="intervalo entre rodadas de polling (s)")
+    parser.add_argument("--seed", type=int, default=42, help="semente das latências e notas sorteadas")
+    parser.add_argument("-o", "--output", help="grava os resultados completos em JSON")
+    parser.add_argument("-v", "--verbose", action="store_true", help="mostra a saída do pipeline")
+    args, main_args = parser.parse_known_args()
+    if main_args[:1] == ["--"]:
+        main_args = main_args[1:]
+
+    seed.configure_env()
+    database = db.Database()
+    database.structure_cache = None
+    fakes.install_memory_sheets()
+    miia_api.MIIA_API.POLL_INTERVAL_S = args.poll_interval
+    model_latency = {}
+    if args.fallback_latency is not None:
+        os.environ["LLM_FALLBACK_MODEL"] = "openai/bench-fallback"
+        model_latency["bench-fallback"] = args.fallback_latency
+
+    results = []
+    with fakes.FakeMIIAServer(args.job_latency, args.job_latency_sigma, args.job_failure_rate,
+                              args.error_rate, seed_value=args.seed) as miia, \
+         fakes.FakeLLMServer(args.llm_latency, args.llm_latency_sigma, args.llm_slow_rate, args.llm_slow_latency,
+                             model_latency, seed_value=args.seed) as llm:
+        for size in (int(s) for s in args.sizes.split(",") if s.strip()):
+            print(f"Lote de {size} questões...", flush=True)
+            results.append(run_batch(size, args, main_args, database, miia, llm))
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"params": vars(args), "main_args": main_args, "results": results}, f, indent=2)
+        print(f"\nResultados gravados em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
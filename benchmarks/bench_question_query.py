@@ -0,0 +1,120 @@
+"""
+Compara os dois caminhos de busca da estrutura das questões num PostgreSQL local semeado:
+
+- legado: JOIN em question_answer/job + GROUP BY em todas as colunas
+- enxuto: só os JOINs de critérios (padrão de db.Database)
+
+e o cache local de estruturas sobre o caminho enxuto: frio (diretório vazio: impressão digital,
+query de critérios e gravação) e quente (só a impressão digital; nenhuma query de critérios).
+Por fim, edita a descrição de uma classificação e confere que o cache quente devolve o critério novo.
+
+Uso:
+    BENCH_DB_HOST=localhost BENCH_DB_PASSWORD=postgres python benchmarks/bench_question_query.py \
+        --questions 200 --criteria 12 --answers 200
+"""
+import io
+import time
+import tempfile
+import argparse
+import statistics
+from contextlib import redirect_stdout
+
+import seed
+import db
+import cache
+import metrics
+
+
+def _time_it(fn, repeat):
+    tempos = []
+    for _ in range(repeat):
+        inicio = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            resultado = fn()
+        tempos.append(time.perf_counter() - inicio)
+    return resultado, tempos
+
+
+def _check_invalidation(database, integration_id):
+    """Edita a long_description de um critério da questão e confere que o cache devolve o texto novo."""
+    with database.connect() as conn:
+        row = conn.execute("""
+            SELECT c.id, c.long_description FROM question q
+            JOIN question_item qi ON q.id = qi.question_id
+            JOIN item_grouping ig ON qi.item_id = ig.item_id
+            JOIN classification_grouping cg ON ig.grouping_id = cg.grouping_id
+            JOIN classification c ON cg.classification_id = c.id
+            WHERE q.integration_id = %s LIMIT 1
+        """, (integration_id,)).fetchone()
+    if row is None:
+        return None
+    classification_id, original = row
+    edited = f"{original} (editado)"
+    try:
+        with database.connect() as conn:
+            conn.execute("UPDATE classification SET long_description = %s WHERE id = %s", (edited, classification_id))
+        with redirect_stdout(io.StringIO()):
+            structure = dict(database.get_question_structures([integration_id]))[integration_id]
+        return any(c["long_description"] == edited for c in structure["criteria"])
+    finally:
+        with database.connect() as conn:
+            conn.execute("UPDATE classification SET long_description = %s WHERE id = %s", (original, classification_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--criteria", type=int, default=12, help="critérios por questão")
+    parser.add_argument("--answers", type=int, default=200, help="respostas históricas por questão (fan-out)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--single", type=int, default=20, help="IDs medidos também pelo caminho de um ID por vez")
+    parser.add_argument("--no-seed", action="store_true", help="reaproveita o schema já semeado")
+    args = parser.parse_args()
+
+    seed.configure_env()
+    database = db.Database()
+    database.structure_cache = None  # mede só o banco
+
+    if args.no_seed:
+        integration_ids = [str(3000000 + n) for n in range(1, args.questions + 1)]
+    else:
+        print(f"Semeando {args.questions} questões × {args.criteria} critérios × {args.answers} respostas...")
+        integration_ids = seed.seed(database, args.questions, args.criteria, args.answers)
+
+    resultados = {}
+    print(f"\n{'caminho':<22}{'mediana (s)':>14}{'mín (s)':>12}")
+    for nome, lean in (("legado", False), ("enxuto", True)):
+        bulk, tempos = _time_it(lambda: dict(database.get_question_structures(integration_ids, lean=lean)), args.repeat)
+        resultados[nome] = bulk
+        print(f"{nome + ' (lote)':<22}{statistics.median(tempos):>14.4f}{min(tempos):>12.4f}")
+
+        amostra = integration_ids[:args.single]
+        _, tempos = _time_it(lambda: [database.get_question_structure(i, lean=lean) for i in amostra], args.repeat)
+        print(f"{nome + f' ({len(amostra)}× 1 ID)':<22}{statistics.median(tempos):>14.4f}{min(tempos):>12.4f}")
+
+    # Cache de estruturas: cada repetição "fria" parte de um diretório vazio
+    with tempfile.TemporaryDirectory(prefix="bench_structures_") as root:
+        def _cold():
+            database.structure_cache = cache.DiskCache(tempfile.mkdtemp(dir=root))
+            return dict(database.get_question_structures(integration_ids))
+
+        _, tempos = _time_it(_cold, args.repeat)
+        print(f"{'cache frio (lote)':<22}{statistics.median(tempos):>14.4f}{min(tempos):>12.4f}")
+
+        metrics.REGISTRY.reset()
+        warm, tempos = _time_it(lambda: dict(database.get_question_structures(integration_ids)), args.repeat)
+        print(f"{'cache quente (lote)':<22}{statistics.median(tempos):>14.4f}{min(tempos):>12.4f}")
+        spans = metrics.REGISTRY.report()["spans"]
+        resultados["cache"] = warm
+        invalidado = _check_invalidation(database, integration_ids[0])
+        database.structure_cache = None
+    print(f"  (cache quente: {spans.get('db.structure_query', {}).get('count', 0)} queries de critérios, "
+          f"{spans['db.stamp_query']['count']} consultas de impressão digital)")
+
+    iguais = resultados["legado"] == resultados["enxuto"] == resultados["cache"]
+    print(f"\nEstruturas idênticas entre os caminhos: {iguais}")
+    print(f"Cache invalidado pela edição de um critério: {invalidado}")
+
+
+if __name__ == "__main__":
+    main()
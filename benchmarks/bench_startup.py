@@ -0,0 +1,133 @@
+"""
+Tempo de partida da CLI: quanto custa importar cada módulo e instanciar cada conector.
+
+Cada medida roda num interpretador novo (nada fica em cache no sys.modules entre elas) e é
+repetida `--repeat` vezes; o relatório mostra mediana e mínimo. Três blocos:
+
+- imports dos provedores (litellm, gspread/google-auth, psycopg, google-genai, httpx);
+- imports dos módulos de src/, cada um com suas dependências;
+- criação dos conectores (MIIA_API, LiteLLMClient, Database, SheetManager, JobPoller) e o
+  primeiro uso do LiteLLMClient, que é onde o litellm passa a ser importado;
+
+e, por fim, `python src/main.py --help` de ponta a ponta. Nenhum serviço é chamado: os
+conectores recebem configuração fictícia e só são construídos.
+
+Uso:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --repeat 10 -o startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+PROVIDERS = ("litellm", "gspread", "google.oauth2.service_account", "psycopg", "google.genai", "httpx")
+MODULES = ("metrics", "ratelimit", "cache", "schemas", "validator", "miia_api", "poller", "db", "sheet",
+           "liteLLM", "gemini", "store", "belt", "pipeline", "main")
+
+# Configuração fictícia: suficiente para os construtores, sem nenhum endereço real
+FAKE_ENV = {
+    "BASE_URL": "http://127.0.0.1:9",
+    "MIIA_API_TOKEN": "bench",
+    "LITELLM_API_BASE": "http://127.0.0.1:9/v1",
+    "LITELLM_API_KEY": "bench",
+    "LLM_DEFAULT_MODEL": "openai/gpt-4o-mini",
+    "LLM_MAX_TOKENS": "2048",
+    "LLM_TIMEOUT": "60",
+    "DB_HOST": "127.0.0.1",
+    "DB_NAME": "bench",
+    "DB_USER": "bench",
+    "DB_PASSWORD": "bench",
+    "STRUCTURE_CACHE": "0",
+    "LITELLM_LOCAL_MODEL_COST_MAP": "True",  # sem rede: o litellm não baixa a tabela de custos no import
+}
+
+CONNECTORS = {
+    "MIIA_API()": ("import miia_api", "miia_api.MIIA_API()"),
+    "LiteLLMClient()": ("import liteLLM", "liteLLM.LiteLLMClient()"),
+    "LiteLLMClient: 1º uso": ("import liteLLM; client = liteLLM.LiteLLMClient()", "client.count_tokens('bench')"),
+    "Database()": ("import db", "db.Database()"),
+    "SheetManager() + aba": ("import sheet", "sheet.SheetManager('auth.json', 'bench', 'resultados').open_tab('log')"),
+    "JobPoller()": ("import miia_api, poller; client = miia_api.MIIA_API()", "poller.JobPoller(client)"),
+}
+
+# Roda num interpretador novo: executa `setup`, mede `stmt` e imprime a duração em segundos
+_PROBE = """
+import sys, time
+sys.path.insert(0, {src!r})
+{setup}
+start = time.perf_counter()
+{stmt}
+print(time.perf_counter() - start)
+"""
+
+
+def _probe(setup, stmt):
+    code = _PROBE.format(src=SRC_DIR, setup=setup, stmt=stmt)
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            env={**os.environ, **FAKE_ENV}, cwd=SRC_DIR)
+    if result.returncode != 0:
+        return None, (result.stderr.strip().splitlines() or ["erro"])[-1]
+    return float(result.stdout.strip().splitlines()[-1]), None
+
+
+def _cli_help():
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, os.path.join(SRC_DIR, "main.py"), "--help"], capture_output=True,
+                            env={**os.environ, **FAKE_ENV}, cwd=SRC_DIR)
+    return (time.perf_counter() - start, None) if result.returncode == 0 else (None, "falhou")
+
+
+def measure(probe, repeat):
+    samples, error = [], None
+    for _ in range(repeat):
+        seconds, error = probe()
+        if seconds is None:
+            break
+        samples.append(seconds)
+    if not samples:
+        return {"error": error}
+    return {"median_ms": statistics.median(samples) * 1000, "min_ms": min(samples) * 1000, "samples": len(samples)}
+
+
+def print_section(title, rows):
+    print(f"\n{title:<32}{'mediana (ms)':>14}{'mín (ms)':>12}")
+    for name, r in rows.items():
+        if "error" in r:
+            print(f"{name:<32}{'-':>14}{'-':>12}  {r['error']}")
+        else:
+            print(f"{name:<32}{r['median_ms']:>14.1f}{r['min_ms']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="interpretadores novos por medida")
+    parser.add_argument("-o", "--output", help="grava os resultados em JSON")
+    args = parser.parse_args()
+
+    results = {
+        "providers": {m: measure(lambda m=m: _probe("", f"import {m}"), args.repeat) for m in PROVIDERS},
+        "modules": {m: measure(lambda m=m: _probe("", f"import {m}"), args.repeat) for m in MODULES},
+        "connectors": {name: measure(lambda s=setup, t=stmt: _probe(s, t), args.repeat)
+                       for name, (setup, stmt) in CONNECTORS.items()},
+        "cli": {"main.py --help": measure(_cli_help, args.repeat)},
+    }
+
+    print_section("import (provedor)", results["providers"])
+    print_section("import (src/)", results["modules"])
+    print_section("conector", results["connectors"])
+    print_section("CLI", results["cli"])
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version, "repeat": args.repeat, "results": results}, f, indent=2)
+        print(f"\nResultados gravados em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
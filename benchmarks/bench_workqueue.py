@@ -0,0 +1,208 @@
+"""
+Fila de trabalho (src/workqueue.py) num PostgreSQL local: confere a semântica e mede a vazão.
+
+Cada verificação usa uma tabela descartável no schema miia_bench e leases curtos:
+
+- ensure_table: workers subindo juntos não colidem no DDL;
+- enqueue: IDs repetidos ou já ativos não se duplicam;
+- claim: workers concorrentes nunca recebem o mesmo item;
+- lease: o item de um worker que parou volta para outro depois do lease, e a conclusão atrasada
+  do primeiro é ignorada; esgotadas as tentativas, o item vira failed;
+- heartbeat: enquanto o dono renova, ninguém mais pega o item;
+- worker_id: dois WorkQueue no mesmo processo têm ids diferentes (o heartbeat de um não renova o outro);
+- complete: done/failed só para o dono do lease.
+
+Depois, `--workers` threads esvaziam uma fila de `--items` itens (claim + complete) para medir a vazão.
+Sai com código 1 se alguma verificação falhar.
+
+Uso:
+    BENCH_DB_HOST=localhost BENCH_DB_PASSWORD=postgres python benchmarks/bench_workqueue.py
+    python benchmarks/bench_workqueue.py --items 20000 --workers 16 --claim-size 50
+"""
+import io
+import sys
+import time
+import argparse
+import threading
+from contextlib import redirect_stdout
+
+import seed
+import db
+import workqueue
+
+TABLE = "validation_queue_bench"
+LEASE_S = 1.0
+
+
+def _queue(database, worker_id, **kwargs):
+    kwargs.setdefault("lease_s", LEASE_S)
+    kwargs.setdefault("max_attempts", 2)
+    return workqueue.WorkQueue(database, table=TABLE, worker_id=worker_id, **kwargs)
+
+
+def _reset(database):
+    with database.connect() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    _queue(database, "setup").ensure_table()
+
+
+def check_concurrent_setup(database, workers=8):
+    with database.connect() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    errors = []
+    barrier = threading.Barrier(workers)
+
+    def _setup(n):
+        barrier.wait()
+        try:
+            _queue(database, f"s{n}").ensure_table()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_setup, args=(n,)) for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return not errors, f"{workers} ensure_table simultâneos, erros: {errors[:1]}"
+
+
+def check_enqueue(database):
+    _reset(database)
+    q = _queue(database, "w1")
+    first = q.enqueue(str(i) for i in range(20))
+    again = q.enqueue(["1", "2", "1", "99"])
+    return first == 20 and again == 1, f"20 novos + 1 novo entre repetidos (obtido: {first} + {again})"
+
+
+def check_concurrent_claims(database, workers=8, claim_size=10):
+    _reset(database)
+    _queue(database, "setup").enqueue(str(i) for i in range(workers * claim_size))
+    claimed = {}
+    barrier = threading.Barrier(workers)
+
+    def _grab(n):
+        q = _queue(database, f"c{n}", lease_s=30)
+        barrier.wait()
+        claimed[n] = q.claim(claim_size)
+
+    threads = [threading.Thread(target=_grab, args=(n,)) for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ids = [i for batch in claimed.values() for i in batch]
+    return len(ids) == len(set(ids)) == workers * claim_size, f"{len(ids)} reivindicados, {len(set(ids))} distintos"
+
+
+def check_lease_expiry(database):
+    _reset(database)
+    w1, w2, w3 = (_queue(database, name) for name in ("w1", "w2", "w3"))
+    w1.enqueue(["a"])
+    steps = [w1.claim(5) == ["a"], w2.claim(5) == []]   # lease de w1 ainda vale
+    time.sleep(LEASE_S + 0.2)
+    steps.append(w2.claim(5) == ["a"])                  # w1 "morreu": w2 retoma
+    steps.append(w1.complete(["a"]) == [])              # conclusão atrasada de w1 é ignorada
+    time.sleep(LEASE_S + 0.2)
+    steps.append(w3.claim(5) == [])                     # 2 tentativas esgotadas
+    steps.append(w3.stats().get("failed") == 1)
+    return all(steps), f"passos {steps}"
+
+
+def check_heartbeat(database):
+    _reset(database)
+    owner, other = _queue(database, "dono"), _queue(database, "outro")
+    owner.enqueue(["b"])
+    owner.claim(5)
+    with owner.heartbeat(interval=LEASE_S / 4):
+        time.sleep(LEASE_S * 2)
+        stolen = other.claim(5)
+    done = owner.complete(["b"])
+    return stolen == [] and done == ["b"], f"reivindicado por outro: {stolen}, concluído pelo dono: {done}"
+
+
+def check_worker_ids(database):
+    a, b = workqueue.WorkQueue(database, table=TABLE), workqueue.WorkQueue(database, table=TABLE)
+    return a.worker_id != b.worker_id, f"{a.worker_id} / {b.worker_id}"
+
+
+def check_complete(database):
+    _reset(database)
+    q = _queue(database, "w1", lease_s=30)
+    q.enqueue(["x", "y", "z"])
+    q.claim(3)
+    ok, failed = q.complete(["x", "y"]), q.complete(["z"], ok=False, error="falha simulada")
+    stats = q.stats()
+    return sorted(ok) == ["x", "y"] and failed == ["z"] and stats == {"done": 2, "failed": 1}, f"situação final {stats}"
+
+
+def throughput(database, items, workers, claim_size):
+    _reset(database)
+    _queue(database, "setup").enqueue(str(i) for i in range(items))
+    done = []
+    lock = threading.Lock()
+
+    def _drain(n):
+        q = _queue(database, f"t{n}", lease_s=60)
+        while True:
+            batch = q.claim(claim_size)
+            if not batch:
+                return
+            for integration_id in batch:
+                q.complete([integration_id])
+            with lock:
+                done.extend(batch)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=_drain, args=(n,)) for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return len(done), len(set(done)), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000, help="itens na fila da medida de vazão")
+    parser.add_argument("--workers", type=int, default=8, help="threads consumindo a fila")
+    parser.add_argument("--claim-size", type=int, default=20)
+    args = parser.parse_args()
+
+    seed.configure_env()
+    database = db.Database()
+    with database.connect() as conn:
+        conn.execute(f"CREATE SCHEMA IF NOT EXISTS {seed.BENCH_SCHEMA}")
+
+    checks = {
+        "ensure_table concorrente": check_concurrent_setup,
+        "enqueue sem duplicatas": check_enqueue,
+        "claims concorrentes": check_concurrent_claims,
+        "lease vencido / tentativas": check_lease_expiry,
+        "heartbeat": check_heartbeat,
+        "worker_id único": check_worker_ids,
+        "complete done/failed": check_complete,
+    }
+    failures = 0
+    for name, check in checks.items():
+        with redirect_stdout(io.StringIO()):
+            ok, detail = check(database)
+        failures += not ok
+        print(f"{'ok' if ok else 'FALHOU':<7}{name:<30}{detail}")
+
+    with redirect_stdout(io.StringIO()):
+        total, unique, elapsed = throughput(database, args.items, args.workers, args.claim_size)
+    print(f"\nVazão: {total} itens ({unique} distintos) em {elapsed:.2f}s com {args.workers} workers "
+          f"— {total / elapsed:.0f} itens/s (claim de {args.claim_size}, complete por item)")
+    if total != unique or total != args.items:
+        failures += 1
+        print("FALHOU: itens perdidos ou processados duas vezes")
+
+    with database.connect() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
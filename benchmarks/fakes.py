@@ -0,0 +1,279 @@
+"""
+Substitutos locais dos serviços externos para os benchmarks ponta a ponta:
+
+- FakeMIIAServer: API de correção (POST assess / GET jobs) com latência dos jobs sorteada
+  de uma lognormal, taxa de jobs que terminam em "failed" e taxa de erros HTTP 500;
+- FakeLLMServer: endpoint compatível com OpenAI (/v1/chat/completions) para o LiteLLM, com uma
+  fração de chamadas lentas (cauda longa) e latência própria por modelo;
+- MemorySpreadsheet / MemorySheetManager: planilha em memória no lugar do Google Sheets.
+
+As notas devolvidas pela MIIA falsa seguem o tipo da resposta (bolo ≈ 0, ruim baixa,
+med no meio, max alta), então o Validator percorre os mesmos caminhos de uma execução real.
+"""
+import re
+import json
+import math
+import time
+import random
+import itertools
+import threading
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import seed  # noqa: F401 — coloca src/ no sys.path
+import sheet
+
+MAX_SCORE = 10
+TIER_SCORES = {"bolo": (0, 0), "ruim": (2, 0.5), "med": (5, 1.0), "max": (9, 0.5)}
+_TIER_MARKER = re.compile(r"\[nivel:(ruim|med|max)\]")
+
+
+def _lognormal(rng, median, sigma):
+    return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+class _FakeServer(ABC):
+    """
+    ThreadingHTTPServer em uma thread de fundo, com contadores de requisições por rota.
+    Cada serviço falso implementa _dispatch com as suas rotas.
+    """
+
+    def __init__(self, seed_value=None):
+        self.rng = random.Random(seed_value)
+        self._rng_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self.counts = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, como os serviços reais
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _send(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # O cliente desistiu (ex.: chamada perdedora cancelada pelo hedging do LLM)
+                    server.count("desconectado")
+                    self.close_connection = True
+
+            def do_GET(self):
+                server._dispatch(self, "GET")
+
+            def do_POST(self):
+                server._dispatch(self, "POST")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def count(self, key):
+        with self._counts_lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reset_counts(self):
+        with self._counts_lock:
+            self.counts = {}
+
+    def random(self, fn, *args):
+        with self._rng_lock:
+            return fn(self.rng, *args)
+
+    @abstractmethod
+    def _dispatch(self, handler, method):
+        """Responde à requisição `method` (GET/POST) recebida por `handler` (ver Handler._send)."""
+
+
+class FakeMIIAServer(_FakeServer):
+
+    def __init__(self, job_latency=5.0, job_latency_sigma=0.5, job_failure_rate=0.0, error_rate=0.0, seed_value=None):
+        super().__init__(seed_value)
+        self.job_latency = job_latency
+        self.job_latency_sigma = job_latency_sigma
+        self.job_failure_rate = job_failure_rate
+        self.error_rate = error_rate
+        self._jobs = {}
+        self._jobs_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _dispatch(self, handler, method):
+        path = handler.path.split("?")[0]
+        if self.error_rate and self.random(lambda rng: rng.random()) < self.error_rate:
+            self.count(f"{method} 500")
+            if method == "POST":
+                handler._body()  # consome o corpo: a conexão keep-alive segue para a próxima requisição
+            handler._send(500, {"detail": "erro simulado"})
+            return
+
+        match = re.fullmatch(r"/textual-corrections/v1/discursive/([^/]+)/assess", path)
+        if method == "POST" and match:
+            self.count("POST assess")
+            handler._send(200, {"job_id": self._create_job(handler._body())})
+            return
+
+        match = re.fullmatch(r"/textual-corrections/v1/jobs/([^/]+)", path)
+        if method == "GET" and match:
+            self.count("GET job")
+            with self._jobs_lock:
+                job = self._jobs.get(match.group(1))
+            if job is None:
+                handler._send(404, {"detail": "job não encontrado"})
+            elif time.monotonic() < job["ready_at"]:
+                handler._send(200, {"status": "running"})
+            else:
+                handler._send(200, job["result"])
+            return
+
+        self.count(f"{method} 404")
+        handler._send(404, {"detail": "rota desconhecida"})
+
+    def _create_job(self, body):
+        try:
+            answer = body["content"][0]["answer"]
+        except (KeyError, IndexError, TypeError):
+            answer = ""
+        marker = _TIER_MARKER.search(answer)
+        tier = marker.group(1) if marker else ("bolo" if "bolo de cenoura" in answer else "med")
+
+        def _sample(rng):
+            mean, sd = TIER_SCORES[tier]
+            score = min(MAX_SCORE, max(0, round(rng.gauss(mean, sd) * 2) / 2))
+            return (_lognormal(rng, self.job_latency, self.job_latency_sigma),
+                    rng.random() < self.job_failure_rate, score)
+
+        latency, failed, score = self.random(_sample)
+        job_id = f"bench-{next(self._ids)}"
+        if failed:
+            result = {"job_id": job_id, "status": "failed", "error": "falha simulada"}
+        else:
+            result = {"job_id": job_id, "status": "completed", "result": {"score": score, "max_score": MAX_SCORE}}
+        with self._jobs_lock:
+            self._jobs[job_id] = {"ready_at": time.monotonic() + latency, "result": result}
+        return job_id
+
+
+class FakeLLMServer(_FakeServer):
+    """Responde a /chat/completions com o JSON de resposta esperado pelo belt, marcado com o tipo pedido."""
+
+    TIER_HINTS = (("max", "EXCELENTE"), ("med", "MEDIANA"), ("ruim", "RUIM"))
+
+    def __init__(self, latency=1.0, latency_sigma=0.3, slow_rate=0.0, slow_latency=30.0, model_latency=None,
+                 seed_value=None):
+        super().__init__(seed_value)
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.model_latency = model_latency or {}  # modelo -> mediana própria (ex.: o modelo reserva)
+
+    def _dispatch(self, handler, method):
+        path = handler.path.split("?")[0]
+        if method != "POST" or not path.endswith("/chat/completions"):
+            self.count(f"{method} 404")
+            handler._send(404, {"error": {"message": "rota desconhecida"}})
+            return
+
+        body = handler._body()
+        model = body.get("model", "bench")
+        self.count("POST chat/completions")
+        self.count(f"modelo {model}")
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        median = self.model_latency.get(model, self.latency)
+        if self.slow_rate and self.random(lambda rng: rng.random()) < self.slow_rate:
+            self.count("lenta")
+            median = self.slow_latency
+        time.sleep(self.random(_lognormal, median, self.latency_sigma))
+
+        def _answer(tier):
+            return {"content": [{"answer": f"[nivel:{tier}] Resposta sintética de benchmark."}]}
+
+        if '"ruim": {"content"' in prompt:
+            # Modo combined: os três tipos numa única resposta
+            content = json.dumps({tier: _answer(tier) for tier in ("ruim", "med", "max")}, ensure_ascii=False)
+        else:
+            tier = next((tier for tier, hint in self.TIER_HINTS if hint in prompt), "med")
+            content = json.dumps(_answer(tier), ensure_ascii=False)
+        handler._send(200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                      "total_tokens": (len(prompt) + len(content)) // 4},
+        })
+
+
+class MemoryWorksheet:
+
+    def __init__(self, title):
+        self.title = title
+        self.rows = []
+        self._lock = threading.Lock()
+
+    def append_row(self, values):
+        with self._lock:
+            self.rows.append(list(values))
+
+    def append_rows(self, rows):
+        with self._lock:
+            self.rows.extend(list(values) for values in rows)
+
+    def get_all_values(self):
+        with self._lock:
+            return [list(values) for values in self.rows]
+
+
+class MemorySpreadsheet:
+
+    def __init__(self):
+        self.tabs = {}
+
+    def worksheet(self, title):
+        return self.tabs.setdefault(title, MemoryWorksheet(title))
+
+
+MEMORY_SPREADSHEET = MemorySpreadsheet()
+
+
+class MemorySheetManager(sheet.SheetManager):
+    """SheetManager sobre a planilha em memória: nada de credenciais nem chamadas ao Google."""
+
+    def __init__(self, json_path, sheet_id, tab_name, planilha=None, **kwargs):
+        super().__init__(json_path, sheet_id, tab_name, planilha=planilha or MEMORY_SPREADSHEET, **kwargs)
+
+
+def install_memory_sheets():
+    """Faz main/belt usarem a planilha em memória. Retorna a planilha para inspeção."""
+    sheet.SheetManager = MemorySheetManager
+    return MEMORY_SPREADSHEET
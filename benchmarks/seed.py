@@ -0,0 +1,108 @@
+"""
+Banco PostgreSQL local semeado para benchmarks.
+
+Cria, num schema isolado (`miia_bench`), as tabelas usadas pelas queries de src/db.py e as
+popula com questões sintéticas. Nunca lê o .env do projeto: a conexão vem das variáveis
+BENCH_DB_* (padrão: postgres local), que são copiadas para DB_* antes de instanciar db.Database.
+"""
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), '..', 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+BENCH_SCHEMA = "miia_bench"
+
+DDL = f"""
+CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA};
+SET search_path TO {BENCH_SCHEMA};
+
+DROP TABLE IF EXISTS tenant_question, question_answer, job, classification_grouping, classification,
+                     item_grouping, grouping, question_item, item, question CASCADE;
+
+CREATE TABLE question (
+    id serial PRIMARY KEY,
+    integration_id text NOT NULL,
+    statement text,
+    type text,
+    tenant_id int,
+    created_at timestamptz DEFAULT NOW(),
+    updated_at timestamptz DEFAULT NOW()
+);
+CREATE TABLE item (id serial PRIMARY KEY, name text, max_score numeric, starts_max boolean, eval_mode text);
+CREATE TABLE question_item (question_id int REFERENCES question(id), item_id int REFERENCES item(id));
+CREATE TABLE grouping (id serial PRIMARY KEY, name text);
+CREATE TABLE item_grouping (item_id int REFERENCES item(id), grouping_id int REFERENCES grouping(id));
+CREATE TABLE classification (id serial PRIMARY KEY, code text, short_description text, long_description text);
+CREATE TABLE classification_grouping (
+    id serial PRIMARY KEY,
+    grouping_id int REFERENCES grouping(id),
+    classification_id int REFERENCES classification(id),
+    weight numeric, type text, eval_target text, rigor_level text, user_context text, eval_mode text
+);
+CREATE TABLE job (id serial PRIMARY KEY, status text, created_at timestamptz DEFAULT NOW());
+CREATE TABLE question_answer (id serial PRIMARY KEY, question_id int REFERENCES question(id), job_id int REFERENCES job(id), answer text);
+CREATE TABLE tenant_question (
+    id serial PRIMARY KEY,
+    tenant_id int, question_id int, integration_id text,
+    created_at timestamptz, updated_at timestamptz,
+    UNIQUE (tenant_id, integration_id)
+);
+
+CREATE INDEX ON question (integration_id);
+CREATE INDEX ON question_item (question_id);
+CREATE INDEX ON item_grouping (item_id);
+CREATE INDEX ON classification_grouping (grouping_id);
+CREATE INDEX ON question_answer (question_id);
+"""
+
+SEED = """
+INSERT INTO question (id, integration_id, statement, type)
+    SELECT n, (3000000 + n)::text, 'Enunciado sintético ' || n, 'DISCURSIVE' FROM generate_series(1, %(q)s) n;
+INSERT INTO item (id, name, max_score, starts_max, eval_mode)
+    SELECT n, 'Item ' || n, 10, false, 'SUM' FROM generate_series(1, %(q)s) n;
+INSERT INTO question_item SELECT n, n FROM generate_series(1, %(q)s) n;
+INSERT INTO grouping (id, name) SELECT n, 'Agrupamento ' || n FROM generate_series(1, %(q)s) n;
+INSERT INTO item_grouping SELECT n, n FROM generate_series(1, %(q)s) n;
+INSERT INTO classification (id, code, short_description, long_description)
+    SELECT k, 'C' || k, 'Critério ' || k, repeat('Descrição longa do critério. ', 40)
+    FROM generate_series(1, %(q)s * %(c)s) k;
+INSERT INTO classification_grouping (grouping_id, classification_id, weight, type, eval_target, rigor_level, eval_mode)
+    SELECT ((k - 1) / %(c)s) + 1, k, 1 + (k %% 3),
+           CASE WHEN k %% 5 = 0 THEN 'QUANTITATIVE' ELSE 'BINARY' END,
+           CASE WHEN k %% 7 = 0 THEN 'DEVIATION' ELSE 'OCCURRENCE' END,
+           'MEDIUM', 'DEFAULT'
+    FROM generate_series(1, %(q)s * %(c)s) k;
+INSERT INTO job (id, status) SELECT k, 'completed' FROM generate_series(1, %(q)s * %(a)s) k;
+INSERT INTO question_answer (question_id, job_id, answer)
+    SELECT ((k - 1) / %(a)s) + 1, k, 'resposta histórica' FROM generate_series(1, %(q)s * %(a)s) k;
+"""
+
+
+def configure_env():
+    """Aponta db.Database para o banco local de benchmark, isolado no schema miia_bench."""
+    os.environ["DB_HOST"] = os.environ.get("BENCH_DB_HOST", "localhost")
+    os.environ["DB_PORT"] = os.environ.get("BENCH_DB_PORT", "5432")
+    os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "postgres")
+    os.environ["DB_USER"] = os.environ.get("BENCH_DB_USER", "postgres")
+    os.environ["DB_PASSWORD"] = os.environ.get("BENCH_DB_PASSWORD", "postgres")
+    # libpq lê PGOPTIONS: todas as conexões do db.Database caem no schema de benchmark
+    os.environ["PGOPTIONS"] = f"-c search_path={BENCH_SCHEMA}"
+    if os.environ["DB_HOST"] not in ("localhost", "127.0.0.1", "::1") and os.environ.get("BENCH_ALLOW_REMOTE") != "1":
+        raise SystemExit("Benchmark recusado: BENCH_DB_HOST não é local (defina BENCH_ALLOW_REMOTE=1 para forçar).")
+
+
+def seed(database, questions, criteria_per_question, answers_per_question):
+    """Recria o schema e insere as questões sintéticas. Retorna a lista de integration_ids."""
+    with database.connect() as conn:
+        with conn.cursor() as cur:
+            cur.execute(DDL)
+            params = {"q": questions, "c": criteria_per_question, "a": answers_per_question}
+            # Comandos com parâmetros vão um por vez (protocolo estendido não aceita vários)
+            for statement in SEED.split(";\n"):
+                if statement.strip():
+                    cur.execute(statement, params)
+            cur.execute("ANALYZE")
+        conn.commit()
+    return [str(3000000 + n) for n in range(1, questions + 1)]
@@ -3,9 +3,13 @@ import json
 import db
 import liteLLM
 import miia_api
+import poller
 import sheet
 import validator
+import schemas
+import metrics
 import time
+import hashlib
 from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
@@ -162,200 +166,672 @@ def _build_criteria_instructions(criteria):
     }
 
 
-def submit_n_times(client, integration_id, answer, n, delay=0.5):
+CAKE_RECIPE = """{"content":[{"answer": "Preparar um bolo de cenoura com cobertura de chocolate é uma prática culinária bastante comum nos lares brasileiros, sendo associada a momentos de convivência e simplicidade. A receita, apesar de tradicional, exige atenção a alguns detalhes para que o resultado final seja macio e saboroso.\n\nInicialmente, é necessário separar os ingredientes básicos, como cenouras, ovos, óleo, açúcar e farinha de trigo. As cenouras devem ser descascadas, cortadas em pedaços pequenos e batidas no liquidificador juntamente com os ovos e o óleo, até que se obtenha uma mistura homogênea. Em seguida, adiciona-se o açúcar e bate-se novamente, garantindo que todos os componentes estejam bem incorporados.\n\nApós esse processo, a mistura líquida deve ser transferida para um recipiente maior, no qual se acrescenta a farinha de trigo peneirada, mexendo-se cuidadosamente para evitar a formação de grumos. Por fim, adiciona-se o fermento químico em pó, misturando de forma delicada. A massa é então despejada em uma forma untada e levada ao forno preaquecido, onde deve assar até atingir consistência firme.\n\nEnquanto o bolo assa, pode-se preparar a cobertura, utilizando ingredientes simples como chocolate em pó, açúcar, manteiga e leite. Esses elementos devem ser levados ao fogo baixo, mexendo-se constantemente até formar uma calda lisa. Após retirar o bolo do forno, basta espalhar a cobertura ainda quente sobre a massa.\n\nDessa forma, o bolo de cenoura com chocolate destaca-se como uma receita prática e acessível, adequada tanto para o consumo cotidiano quanto para ocasiões especiais, demonstrando que a culinária pode ser, ao mesmo tempo, funcional e prazerosa."}]}"""
+
+# Quantas vezes cada tipo de resposta é submetido à MIIA
+REPETITIONS = {"bolo": 1, "ruim": 3, "med": 3, "max": 3}
+
+# Atributos de cada critério, na ordem em que aparecem no prompt: (chave, rótulo)
+_CRITERION_FIELDS = (
+    ("weight", "peso"),
+    ("type", "tipo"),
+    ("eval_target", "alvo"),
+    ("rigor_level", "rigor"),
+    ("eval_mode", "modo"),
+)
+
+
+def estimate_tokens(text):
+    """Estimativa rápida (~4 caracteres por token), usada quando não há tokenizador do modelo."""
+    return (len(text) + 3) // 4
+
+
+def _fmt_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def render_criteria(criteria, token_budget=None, count_tokens=estimate_tokens):
+    """
+    Texto compacto e determinístico dos critérios para o prompt: agrupado por item e agrupamento,
+    sem campos vazios, com critérios repetidos removidos e atributos iguais em todos os critérios
+    declarados uma única vez no topo.
+
+    Com `token_budget`, se o bloco passar do orçamento, as descrições longas são retiradas
+    começando pelos critérios de menor peso (em módulo) até caber; a descrição curta fica sempre.
+    """
+    unique = []
+    seen = set()
+    for c in criteria:
+        key = tuple(sorted((k, _fmt_value(v)) for k, v in c.items() if v is not None))
+        if key not in seen and c.get("short_description"):
+            seen.add(key)
+            unique.append(c)
+
+    common = {}
+    for field, _ in _CRITERION_FIELDS:
+        values = {c.get(field) for c in unique}
+        if len(unique) > 1 and len(values) == 1 and None not in values:
+            common[field] = values.pop()
+
+    def _render(dropped):
+        lines = []
+        if common:
+            lines.append("Comum a todos os critérios: " + "; ".join(
+                f"{label} {_fmt_value(common[field])}" for field, label in _CRITERION_FIELDS if field in common))
+        current_item = current_grouping = None
+        for index, c in enumerate(unique):
+            item = (c.get("item_name"), c.get("max_score"))
+            if item != current_item:
+                current_item, current_grouping = item, None
+                name, max_score = item
+                lines.append(f"Item: {name or '-'}" + (f" (máx. {_fmt_value(max_score)} pts)" if max_score is not None else ""))
+            if c.get("grouping_name") != current_grouping:
+                current_grouping = c.get("grouping_name")
+                if current_grouping:
+                    lines.append(f"  Agrupamento: {current_grouping}")
+
+            attrs = [f"{label} {_fmt_value(c[field])}" for field, label in _CRITERION_FIELDS
+                     if field not in common and c.get(field) is not None]
+            code = f"[{c['classification_code']}] " if c.get("classification_code") else ""
+            lines.append(f"  - {code}{c['short_description']}" + (f" ({'; '.join(attrs)})" if attrs else ""))
+            if c.get("long_description") and index not in dropped:
+                lines.append(f"    {' '.join(c['long_description'].split())}")
+            if c.get("user_context"):
+                lines.append(f"    Contexto: {' '.join(c['user_context'].split())}")
+        return "\n".join(lines)
+
+    dropped = set()
+    text = _render(dropped)
+    if token_budget is None or count_tokens(text) <= token_budget:
+        return text
+
+    # Menor peso primeiro; no empate, o critério que aparece depois sai antes
+    by_weight = sorted((i for i, c in enumerate(unique) if c.get("long_description")),
+                       key=lambda i: (abs(unique[i].get("weight") or 0), -i))
+    for index in by_weight:
+        dropped.add(index)
+        text = _render(dropped)
+        if count_tokens(text) <= token_budget:
+            break
+    return text
+
+
+_ANSWER_FORMAT = """Me retorne UNICAMENTE UM JSON estruturado da seguinte forma: {"content": [{"answer": ""}]}. SEM ```json ... ```"""
+
+_COMBINED_FORMAT = (
+    "Gere as TRÊS respostas abaixo, cada uma seguindo apenas as instruções da sua seção, e me retorne "
+    'UNICAMENTE UM JSON estruturado da seguinte forma: {"ruim": {"content": [{"answer": ""}]}, '
+    '"med": {"content": [{"answer": ""}]}, "max": {"content": [{"answer": ""}]}}. SEM ```json ... ```'
+)
+
+
+def build_prompt_parts(statement, criteria, token_budget=None, count_tokens=estimate_tokens):
+    """
+    Partes dos prompts de geração: o contexto comum (enunciado + critérios), igual para os três
+    tipos de resposta, e as instruções específicas de cada tipo {"ruim", "med", "max"}.
+    """
+    criteria_text = render_criteria(criteria, token_budget, count_tokens)
+    context = f""" Veja o seguinte enunciado: {statement}
+
+Critérios de avaliação:
+{criteria_text}"""
+
+    criteria_hints = _build_criteria_instructions(criteria)
+
+    instructions_ruim = (
+        "\n\nGere uma resposta RUIM que deve obter menos de 35% da pontuação máxima. "
+        "REGRAS OBRIGATÓRIAS:\n"
+        "- Trate o tema de forma superficial, como alguém que tem noção vaga do assunto mas não estudou\n"
+        "- NÃO atenda nenhum dos critérios de avaliação de forma satisfatória — mencione o tema mas sem profundidade\n"
+        "- NÃO use termos técnicos, leis, normas, conceitos específicos da área ou nomenclatura especializada\n"
+        "- Use apenas afirmações genéricas e senso comum — sem dados, exemplos, embasamento ou fundamentação\n"
+        "- Escreva com alguns erros de coesão e argumentação fraca, mas de forma legível\n"
+        "- Apesar disso, segundo os critérios de correção a resposta deve tentar NÃO ZERAR, pontuando pouco, mas pontuando em algum critério avaliativo"
+        + criteria_hints["ruim"]
+    )
+    instructions_med = (
+        "\n\nGere uma resposta MEDIANA que deve obter uma nota próxima a metade do máximo disponível. "
+        "REGRAS OBRIGATÓRIAS — siga à risca:\n"
+        "- Aborde pelo menos metade dos critérios de avaliação listados, usando os termos técnicos corretos para que o corretor os reconheça\n"
+        "- Para cada critério abordado, trate de forma SIMPLES e objetiva: mencione o conceito mas sem aprofundamento completo\n"
+        "- Os critérios NÃO abordados devem ser completamente omitidos da resposta\n"
+        "- Demonstre conhecimento básico do tema: use alguma terminologia técnica, mas evite desenvolver argumentação completa\n"
+        "- Cometa poucos erros gramaticais e use estrutura de texto funcional e objetiva, mas sem grande refinamento estrutural ou estilístico"
+        + criteria_hints["med"]
+    )
+    instructions_max = (
+        "\n\nGere uma resposta EXCELENTE E MÁXIMA que gabarite a questão, atingindo a nota mais alta possível. "
+        "Para isso: atenda TODOS os critérios de avaliação listados de forma completa, precisa e aprofundada; "
+        "cada critério avaliativo deve ser coberto individualmente — NÃO omita nenhum; "
+        "demonstre domínio pleno do tema com argumentação sólida, bem fundamentada e exemplos pertinentes; "
+        "escreva com clareza, coesão e sem nenhum erro gramatical; "
+        "a resposta deve ser impecável, bem estruturada e tecnicamente perfeita em todos os pontos avaliados."
+        + criteria_hints["max"]
+    )
+    return context, {"ruim": instructions_ruim, "med": instructions_med, "max": instructions_max}
+
+
+def build_prompts(statement, criteria, token_budget=None, count_tokens=estimate_tokens):
+    """Monta os prompts de geração das respostas ruim/med/max."""
+    context, instructions = build_prompt_parts(statement, criteria, token_budget, count_tokens)
+    return {tier: _tier_prompt(context, text) for tier, text in instructions.items()}
+
+
+def _tier_prompt(context, instructions):
+    return f"{context}\n\n{_ANSWER_FORMAT}{instructions}"
+
+
+def build_combined_prompt(context, instructions):
+    """Um único prompt pedindo as três respostas num JSON {"ruim", "med", "max"}."""
+    sections = "".join(f"\n\n### RESPOSTA {tier.upper()}{text}" for tier, text in instructions.items())
+    return f"{context}\n\n{_COMBINED_FORMAT}{sections}"
+
+
+def generate_answers(clientLLM, prompts, refresh=False):
+    """Gera as três respostas sintéticas em paralelo. Retorna {"ruim", "med", "max"}."""
+    with ThreadPoolExecutor(max_workers=3) as exc:
+        futures = {tier: exc.submit(clientLLM.send_prompt, prompt, refresh=refresh) for tier, prompt in prompts.items()}
+    return {tier: f.result() for tier, f in futures.items()}
+
+
+def _split_combined(content):
+    """Separa a resposta combinada em {tier: JSON no formato de uma resposta}; tipos ausentes viram None."""
+    text = (content or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    try:
+        data = json.loads(text, strict=False)
+    except json.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        return {tier: None for tier in ("ruim", "med", "max")}
+
+    answers = {}
+    for tier in ("ruim", "med", "max"):
+        value = data.get(tier)
+        if isinstance(value, str):
+            value = {"content": [{"answer": value}]}
+        answers[tier] = json.dumps(value, ensure_ascii=False) if isinstance(value, dict) else None
+    return answers
+
+
+def generate_combined(clientLLM, context, instructions):
+    """
+    Modo "combined": uma única chamada gera os três tipos. O contexto vai uma vez só,
+    então a entrada cai para cerca de um terço. Tipos que faltarem na resposta são
+    gerados separadamente.
+    """
+    content = clientLLM.send_prompt(build_combined_prompt(context, instructions),
+                                    max_tokens=clientLLM.max_tokens * 3)
+    answers = _split_combined(content)
+    missing = [tier for tier, answer in answers.items() if answer is None]
+    if missing:
+        print(f"[Geração] Resposta combinada sem {missing} — gerando esses tipos separadamente.")
+        answers.update(generate_answers(clientLLM, {
+            tier: _tier_prompt(context, instructions[tier]) for tier in missing
+        }))
+    return answers
+
+
+def generate_with_shared_prefix(clientLLM, context, instructions):
+    """
+    Modo "prefix": contexto + formato vão como mensagem de sistema idêntica nas três chamadas,
+    e só as instruções do tipo variam na mensagem do usuário. O prefixo estável permite o cache
+    de prompt do provedor; a primeira chamada aquece o cache antes das outras duas em paralelo.
+    """
+    system = f"{context}\n\n{_ANSWER_FORMAT}"
+    tiers = list(instructions)
+    answers = {tiers[0]: clientLLM.send_prompt(instructions[tiers[0]].lstrip(), system=system)}
+    with ThreadPoolExecutor(max_workers=len(tiers) - 1) as exc:
+        futures = {tier: exc.submit(clientLLM.send_prompt, instructions[tier].lstrip(), system=system)
+                   for tier in tiers[1:]}
+    answers.update({tier: f.result() for tier, f in futures.items()})
+    return answers
+
+
+def submit_n_times(client, integration_id, answer, n):
+    """
+    Submete `n` correções. Uma submissão que falha de vez (miia_api.SubmitError) vira None na
+    lista e as demais seguem; stage_submit decide se o que sobrou basta.
+    """
+    # O ritmo das submissões é controlado pelo throttle do cliente (MIIA_RATE_LIMIT)
     jobs = []
     for _ in range(n):
-        job = client.create_job(integration_id, answer)
-        jobs.append(job)
-        time.sleep(delay)
+        try:
+            jobs.append(client.create_job(integration_id, answer))
+        except miia_api.SubmitError as e:
+            print(f"[{integration_id}] Submissão descartada: {e}")
+            jobs.append(None)
     return jobs
 
 
-def run(integration_id, clientMIIA, clientLLM, database, sheets, sheets_log=None):
-    print(f"\n{'='*60}")
-    print(f"Processando integration_id: {integration_id}")
-    print(f"{'='*60}")
+def submit_answers(clientMIIA, integration_id, answers, repetitions=None):
+    """Submete bolo + ruim/med/max à MIIA. Retorna {tier: [job_id, ...]}."""
+    repetitions = repetitions or REPETITIONS
+    payloads = {"bolo": CAKE_RECIPE, **answers}
+    # Nada fora do schema chega à MIIA, nem respostas retomadas de um ledger antigo
+    for tier in repetitions:
+        _, error = schemas.parse_answer(payloads.get(tier))
+        if error:
+            raise ValueError(f"resposta {tier} inválida, não submetida: {error}")
+    with ThreadPoolExecutor(max_workers=len(repetitions)) as exc:
+        futures = {
+            tier: exc.submit(submit_n_times, clientMIIA, integration_id, payloads[tier], n)
+            for tier, n in repetitions.items()
+        }
+    return {tier: f.result() for tier, f in futures.items()}
+
+
+def collect_assessments(clientMIIA, jobs, job_poller=None):
+    """Aguarda todos os jobs. Retorna {tier: [assessment ou None, ...]} na mesma ordem de `jobs`."""
+    # Um poller compartilhado acompanha os jobs de todas as questões em execução
+    own_poller = job_poller is None
+    if own_poller:
+        job_poller = poller.JobPoller(clientMIIA)
+    try:
+        futures = {tier: [job_poller.submit(job) for job in tier_jobs] for tier, tier_jobs in jobs.items()}
+        return {tier: [f.result() for f in tier_futures] for tier, tier_futures in futures.items()}
+    finally:
+        if own_poller:
+            job_poller.close()
 
-    question_id = None
-    bolo_score = None
-    ruim_scores = [None, None, None]
-    med_scores  = [None, None, None]
-    max_scores  = [None, None, None]
-    max_score   = None
-    row_written = False
 
-    try:
-        data = database.get_question_structure(integration_id)
-        question_id = data["question_id"]
-        statement = data["statement"]
-        criteria = data["criteria"]
-
-        # --- Geração das respostas sintéticas ---
-        base_prompt = f""" Veja o seguinte enunciado: {statement}, que possui os seguintes critérios de avaliacao: {criteria}, me retorne UNICAMENTE UM JSON estruturado da seguinte forma: {{"content": [{{"answer": ""}}]}}. SEM ```json ... ```"""
-
-        criteria_hints = _build_criteria_instructions(criteria)
-
-        cake_recipe = """{"content":[{"answer": "Preparar um bolo de cenoura com cobertura de chocolate é uma prática culinária bastante comum nos lares brasileiros, sendo associada a momentos de convivência e simplicidade. A receita, apesar de tradicional, exige atenção a alguns detalhes para que o resultado final seja macio e saboroso.\n\nInicialmente, é necessário separar os ingredientes básicos, como cenouras, ovos, óleo, açúcar e farinha de trigo. As cenouras devem ser descascadas, cortadas em pedaços pequenos e batidas no liquidificador juntamente com os ovos e o óleo, até que se obtenha uma mistura homogênea. Em seguida, adiciona-se o açúcar e bate-se novamente, garantindo que todos os componentes estejam bem incorporados.\n\nApós esse processo, a mistura líquida deve ser transferida para um recipiente maior, no qual se acrescenta a farinha de trigo peneirada, mexendo-se cuidadosamente para evitar a formação de grumos. Por fim, adiciona-se o fermento químico em pó, misturando de forma delicada. A massa é então despejada em uma forma untada e levada ao forno preaquecido, onde deve assar até atingir consistência firme.\n\nEnquanto o bolo assa, pode-se preparar a cobertura, utilizando ingredientes simples como chocolate em pó, açúcar, manteiga e leite. Esses elementos devem ser levados ao fogo baixo, mexendo-se constantemente até formar uma calda lisa. Após retirar o bolo do forno, basta espalhar a cobertura ainda quente sobre a massa.\n\nDessa forma, o bolo de cenoura com chocolate destaca-se como uma receita prática e acessível, adequada tanto para o consumo cotidiano quanto para ocasiões especiais, demonstrando que a culinária pode ser, ao mesmo tempo, funcional e prazerosa."}]}"""
-
-        prompt_ruim = (
-            base_prompt +
-            "\n\nGere uma resposta RUIM que deve obter menos de 35% da pontuação máxima. "
-            "REGRAS OBRIGATÓRIAS:\n"
-            "- Trate o tema de forma superficial, como alguém que tem noção vaga do assunto mas não estudou\n"
-            "- NÃO atenda nenhum dos critérios de avaliação de forma satisfatória — mencione o tema mas sem profundidade\n"
-            "- NÃO use termos técnicos, leis, normas, conceitos específicos da área ou nomenclatura especializada\n"
-            "- Use apenas afirmações genéricas e senso comum — sem dados, exemplos, embasamento ou fundamentação\n"
-            "- Escreva com alguns erros de coesão e argumentação fraca, mas de forma legível\n"
-            "- Apesar disso, segundo os critérios de correção a resposta deve tentar NÃO ZERAR, pontuando pouco, mas pontuando em algum critério avaliativo"
-            + criteria_hints["ruim"]
-        )
-        prompt_med = (
-            base_prompt +
-            "\n\nGere uma resposta MEDIANA que deve obter uma nota próxima a metade do máximo disponível. "
-            "REGRAS OBRIGATÓRIAS — siga à risca:\n"
-            "- Aborde pelo menos metade dos critérios de avaliação listados, usando os termos técnicos corretos para que o corretor os reconheça\n"
-            "- Para cada critério abordado, trate de forma SIMPLES e objetiva: mencione o conceito mas sem aprofundamento completo\n"
-            "- Os critérios NÃO abordados devem ser completamente omitidos da resposta\n"
-            "- Demonstre conhecimento básico do tema: use alguma terminologia técnica, mas evite desenvolver argumentação completa\n"
-            "- Cometa poucos erros gramaticais e use estrutura de texto funcional e objetiva, mas sem grande refinamento estrutural ou estilístico"
-            + criteria_hints["med"]
-        )
-        prompt_max = (
-            base_prompt +
-            "\n\nGere uma resposta EXCELENTE E MÁXIMA que gabarite a questão, atingindo a nota mais alta possível. "
-            "Para isso: atenda TODOS os critérios de avaliação listados de forma completa, precisa e aprofundada; "
-            "cada critério avaliativo deve ser coberto individualmente — NÃO omita nenhum; "
-            "demonstre domínio pleno do tema com argumentação sólida, bem fundamentada e exemplos pertinentes; "
-            "escreva com clareza, coesão e sem nenhum erro gramatical; "
-            "a resposta deve ser impecável, bem estruturada e tecnicamente perfeita em todos os pontos avaliados."
-            + criteria_hints["max"]
-        )
+def initial_repetitions(sampling=None):
+    """Repetições da primeira rodada: fixas, ou `min_reps` por tipo no modo adaptativo."""
+    if not sampling:
+        return dict(REPETITIONS)
+    return {"bolo": 1, **{tier: sampling["min_reps"] for tier in ("ruim", "med", "max")}}
 
-        print("\n[2/5] Gerando respostas sintéticas...")
-        with ThreadPoolExecutor(max_workers=3) as exc:
-            f_ruim = exc.submit(clientLLM.send_prompt, prompt_ruim)
-            f_med  = exc.submit(clientLLM.send_prompt, prompt_med)
-            f_max  = exc.submit(clientLLM.send_prompt, prompt_max)
-        ruim_answer = f_ruim.result()
-        med_answer  = f_med.result()
-        max_answer  = f_max.result()
-
-        # --- Submissão para a API da MIIA ---
-        print("\n[3/5] Submetendo respostas para correção...")
-        with ThreadPoolExecutor(max_workers=4) as exc:
-            f_bolo = exc.submit(submit_n_times, clientMIIA, integration_id, cake_recipe, 1)
-            f_ruim = exc.submit(submit_n_times, clientMIIA, integration_id, ruim_answer, 3)
-            f_med  = exc.submit(submit_n_times, clientMIIA, integration_id, med_answer,  3)
-            f_max  = exc.submit(submit_n_times, clientMIIA, integration_id, max_answer,  3)
-        bolo_job  = f_bolo.result()[0]
-        ruim_jobs = f_ruim.result()
-        med_jobs  = f_med.result()
-        max_jobs  = f_max.result()
-
-        # --- Coleta dos resultados ---
-        print("\n[4/5] Aguardando e coletando resultados...")
-        all_jobs = [bolo_job] + ruim_jobs + med_jobs + max_jobs
-
-        def _check_job(args):
-            idx, job = args
-            time.sleep(idx * 0.5)
-            return idx, clientMIIA.check_status(job, verbose=False)
-
-        with ThreadPoolExecutor(max_workers=len(all_jobs)) as exc:
-            all_results = dict(exc.map(_check_job, enumerate(all_jobs)))
-
-        bolo_assessment  = all_results[0]
-        ruim_assessments = [all_results[i] for i in range(1, 4)]
-        med_assessments  = [all_results[i] for i in range(4, 7)]
-        max_assessments  = [all_results[i] for i in range(7, 10)]
-
-        bolo_score  = bolo_assessment["result"]["score"] if bolo_assessment else None
-        ruim_scores = [a["result"]["score"] if a else None for a in ruim_assessments]
-        med_scores  = [a["result"]["score"] if a else None for a in med_assessments]
-        max_scores  = [a["result"]["score"] if a else None for a in max_assessments]
-
-        ref_assessment = bolo_assessment or (max_assessments[-1] if max_assessments else None)
-        max_score = ref_assessment["result"]["max_score"] if ref_assessment else None
-
-        print(f"\nScores — bolo: {bolo_score} | ruim: {ruim_scores} | med: {med_scores} | max: {max_scores} | max_score: {max_score}")
-
-        # --- Validação e inserção na planilha ---
-        print("\n[5/5] Inserindo resultado na planilha...")
-        v = validator.Validator()
-        row = v.build_row(
-            question_id=question_id,
-            integration_id=integration_id,
-            bolo_score=bolo_score,
-            ruim_scores=ruim_scores,
-            med_scores=med_scores,
-            max_scores=max_scores,
-            max_score=max_score,
-        )
-        sheets.insert_line(row)
-        row_written = True
-        print(f"[Concluído] {integration_id} inserido na planilha com sucesso.")
-
-        # --- Debug: print sample assessment for each failing validation column ---
-        v2 = validator.Validator()
-        checks = [
-            ("pass_bolo",      v2.pass_bolo(bolo_score),                          bolo_assessment),
-            ("pass_ruim_var",  v2.pass_var(ruim_scores, max_score),               ruim_assessments[0]),
-            ("pass_med_var",   v2.pass_var(med_scores,  max_score),               med_assessments[0]),
-            ("pass_max_var",   v2.pass_var(max_scores,  max_score),               max_assessments[0]),
-            ("pass_min_score", v2.pass_min_score(ruim_scores, max_score),         ruim_assessments[0]),
-            ("pass_med_score", v2.pass_med_score(med_scores, max_score),          med_assessments[0]),
-            ("pass_max_score", v2.pass_max_score(max_scores, max_score),          max_assessments[0]),
+
+def collect_adaptive(clientMIIA, integration_id, answers, jobs, sampling, job_poller=None, on_submit=None):
+    """
+    Amostragem adaptativa: depois das `min_reps` iniciais, submete uma correção a mais por rodada
+    apenas para os tipos de resposta cujos critérios do Validator ainda estão indefinidos,
+    até `max_reps`. Retorna (jobs, assessments) com todas as submissões.
+    """
+    v = validator.Validator()
+    assessments = collect_assessments(clientMIIA, jobs, job_poller)
+    while True:
+        scores = extract_scores(assessments)
+        extra = {
+            tier: 1 for tier in ("ruim", "med", "max")
+            if len(jobs[tier]) < sampling["max_reps"]
+            and not v.tier_decided(tier, scores[tier], scores["max_score"],
+                                   sampling["max_reps"] - len(jobs[tier]), sampling.get("margin"))
+        }
+        if not extra:
+            return jobs, assessments
+
+        print(f"[{integration_id}] [Adaptativo] Critérios indefinidos em {sorted(extra)} — submetendo mais uma correção.")
+        new_jobs = submit_answers(clientMIIA, integration_id, answers, repetitions=extra)
+        for tier, tier_jobs in new_jobs.items():
+            jobs[tier] = jobs[tier] + tier_jobs
+        if on_submit:
+            on_submit(jobs)
+        new_assessments = collect_assessments(clientMIIA, new_jobs, job_poller)
+        for tier, tier_assessments in new_assessments.items():
+            assessments[tier] = assessments[tier] + tier_assessments
+
+
+def _fill_missing(jobs, resent):
+    """Encaixa os jobs reenviados nas posições que ficaram None, na ordem."""
+    filled = {}
+    for tier, tier_jobs in jobs.items():
+        new_jobs = iter(resent.get(tier, []))
+        filled[tier] = [job if job is not None else next(new_jobs, None) for job in tier_jobs]
+    return filled
+
+
+def partial_summary(jobs, assessments):
+    """Descrição das correções que faltaram (submissão recusada ou job sem resultado), ou None se veio tudo."""
+    total = sum(len(tier_assessments) for tier_assessments in assessments.values())
+    missing = sum(a is None for tier_assessments in assessments.values() for a in tier_assessments)
+    if not missing:
+        return None
+    unsent = sum(job is None for tier_jobs in jobs.values() for job in tier_jobs)
+    return (f"resultado parcial: {missing}/{total} correções sem nota "
+            f"({unsent} submissões falharam, {missing - unsent} jobs sem resultado)")
+
+
+def extract_scores(assessments):
+    """Notas por tipo de resposta + nota máxima da questão."""
+    def _score(a):
+        return a["result"]["score"] if a else None
+
+    bolo_assessment = assessments["bolo"][0] if assessments["bolo"] else None
+    max_assessments = assessments["max"]
+    ref_assessment = bolo_assessment or (max_assessments[-1] if max_assessments else None)
+    return {
+        "bolo": _score(bolo_assessment),
+        "ruim": [_score(a) for a in assessments["ruim"]],
+        "med":  [_score(a) for a in assessments["med"]],
+        "max":  [_score(a) for a in max_assessments],
+        "max_score": ref_assessment["result"]["max_score"] if ref_assessment else None,
+    }
+
+
+# --- Etapas do pipeline de uma questão ---
+# Cada etapa recebe e completa o mesmo `state` (ver new_state). belt.run encadeia as etapas em
+# sequência; pipeline.Pipeline as distribui em threads com filas entre elas. Com `ledger`
+# (store.RunLedger), cada etapa concluída é registrada e uma execução retomada continua de onde
+# parou: respostas já geradas não são regeradas e jobs já submetidos voltam a ser acompanhados.
+
+def question_fingerprint(data, clientLLM):
+    """
+    Impressão digital de tudo que determina o resultado de uma questão: enunciado e critérios
+    (como vêm de Database.get_question_structure), modelo e temperatura do LLM e a versão do Validator.
+    """
+    payload = {
+        "statement": data["statement"],
+        "type": data["type"],
+        "criteria": data["criteria"],
+        "model": clientLLM.model,
+        "temperature": clientLLM.temperature,
+        "validator_version": validator.Validator.VERSION,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def new_state(integration_id, data=None, ledger=None):
+    return {
+        "integration_id": integration_id,
+        "data": data,
+        "question_id": None,
+        "answers": None,
+        "jobs": None,
+        "assessments": None,
+        "scores": None,
+        "fingerprint": None,
+        "row_written": False,
+        "checkpoint": ledger.load(integration_id) if ledger else {},
+        "started_at": time.monotonic(),
+    }
+
+
+@metrics.timed("stage.structure")
+def stage_structure(state, database, ledger=None):
+    integration_id = state["integration_id"]
+    # `data` pode vir pré-carregado em lote (Database.get_question_structures)
+    if state["data"] is None:
+        state["data"] = database.get_question_structure(integration_id)
+    if state["data"] is None:
+        raise ValueError(f"estrutura da questão {integration_id} não encontrada no banco")
+    state["question_id"] = state["data"]["question_id"]
+    if ledger and "structure" not in state["checkpoint"]:
+        ledger.record(integration_id, "structure")
+
+
+def validate_answers(answers):
+    """Separa as respostas geradas em ({tier: payload normalizado}, {tier: motivo da rejeição})."""
+    valid, errors = {}, {}
+    for tier, raw in answers.items():
+        payload, error = schemas.parse_answer(raw)
+        if error:
+            errors[tier] = error
+        else:
+            valid[tier] = payload
+    return valid, errors
+
+
+def _regenerate(clientLLM, context, instructions, tiers):
+    """Nova geração só dos tipos informados, ignorando o cache (que pode guardar a resposta ruim)."""
+    if clientLLM.generation_mode == "prefix":
+        system = f"{context}\n\n{_ANSWER_FORMAT}"
+        with ThreadPoolExecutor(max_workers=len(tiers)) as exc:
+            futures = {tier: exc.submit(clientLLM.send_prompt, instructions[tier].lstrip(), system=system, refresh=True)
+                       for tier in tiers}
+        return {tier: f.result() for tier, f in futures.items()}
+    return generate_answers(clientLLM, {tier: _tier_prompt(context, instructions[tier]) for tier in tiers}, refresh=True)
+
+
+def _generate(integration_id, data, clientLLM, previous=None):
+    """
+    Gera as respostas no modo configurado em clientLLM.generation_mode, registrando os tokens de entrada,
+    e valida cada uma contra schemas.AnswerPayload. Só os tipos rejeitados são regerados, até
+    clientLLM.answer_retries vezes; `previous` (respostas retomadas do ledger) pula a geração inicial.
+    """
+    mode = clientLLM.generation_mode
+    context, instructions = build_prompt_parts(data["statement"], data["criteria"],
+                                               clientLLM.prompt_token_budget, clientLLM.count_tokens)
+    answers = previous or _generate_initial(integration_id, clientLLM, mode, context, instructions)
+
+    valid, errors = validate_answers(answers)
+    for attempt in range(1, clientLLM.answer_retries + 1):
+        if not errors:
+            break
+        for tier, error in errors.items():
+            metrics.incr("llm.invalid_answers")
+            print(f"[{integration_id}] Resposta {tier} inválida ({error}) — regerando ({attempt}/{clientLLM.answer_retries}).")
+        regenerated, errors = validate_answers(_regenerate(clientLLM, context, instructions, list(errors)))
+        valid.update(regenerated)
+
+    if errors:
+        metrics.incr("llm.invalid_answers", len(errors))
+        raise ValueError(f"respostas inválidas após {clientLLM.answer_retries} regerações: {errors}")
+    return {tier: valid[tier] for tier in instructions}
+
+
+def _generate_initial(integration_id, clientLLM, mode, context, instructions):
+    """Primeira geração das três respostas, no modo escolhido."""
+    if mode == "combined":
+        tokens = {"combined": clientLLM.count_tokens(build_combined_prompt(context, instructions))}
+    elif mode == "prefix":
+        tokens = {"prefixo": clientLLM.count_tokens(f"{context}\n\n{_ANSWER_FORMAT}"),
+                  **{tier: clientLLM.count_tokens(text) for tier, text in instructions.items()}}
+    else:
+        prompts = {tier: _tier_prompt(context, text) for tier, text in instructions.items()}
+        tokens = {tier: clientLLM.count_tokens(prompt) for tier, prompt in prompts.items()}
+    for key, n in tokens.items():
+        metrics.incr(f"llm.prompt_tokens.{key}", n)
+    print(f"[{integration_id}] Tokens de entrada ({mode}) — " + " | ".join(f"{k}: {n}" for k, n in tokens.items()))
+
+    if mode == "combined":
+        return generate_combined(clientLLM, context, instructions)
+    if mode == "prefix":
+        return generate_with_shared_prefix(clientLLM, context, instructions)
+    return generate_answers(clientLLM, prompts)
+
+
+@metrics.timed("stage.generate")
+def stage_generate(state, clientLLM, ledger=None):
+    integration_id = state["integration_id"]
+    state["fingerprint"] = question_fingerprint(state["data"], clientLLM)
+    answers = state["checkpoint"].get("answers")
+    if answers is None:
+        print(f"\n[{integration_id}] [2/5] Gerando respostas sintéticas...")
+        answers = _generate(integration_id, state["data"], clientLLM)
+        if ledger:
+            ledger.record(integration_id, "answers", answers)
+    else:
+        print(f"\n[{integration_id}] [2/5] Respostas sintéticas retomadas do ledger.")
+        if validate_answers(answers)[1]:
+            answers = _generate(integration_id, state["data"], clientLLM, previous=answers)
+            if ledger:
+                ledger.record(integration_id, "answers", answers)
+    state["answers"] = answers
+
+
+@metrics.timed("stage.submit")
+def stage_submit(state, clientMIIA, ledger=None, sampling=None):
+    integration_id = state["integration_id"]
+    jobs = state["checkpoint"].get("jobs")
+    if jobs is None:
+        print(f"\n[{integration_id}] [3/5] Submetendo respostas para correção...")
+        jobs = submit_answers(clientMIIA, integration_id, state["answers"], initial_repetitions(sampling))
+        if ledger:
+            ledger.record(integration_id, "jobs", jobs)
+    else:
+        print(f"\n[{integration_id}] [3/5] Jobs retomados do ledger: {sum(len(j) for j in jobs.values())} já submetidos.")
+        # Submissões que falharam na execução anterior são reenviadas, a menos que a coleta já tenha terminado
+        missing = {tier: tier_jobs.count(None) for tier, tier_jobs in jobs.items() if None in tier_jobs}
+        if missing and "assessments" not in state["checkpoint"]:
+            print(f"[{integration_id}] Reenviando {sum(missing.values())} submissões que falharam: {missing}")
+            jobs = _fill_missing(jobs, submit_answers(clientMIIA, integration_id, state["answers"], missing))
+            if ledger:
+                ledger.record(integration_id, "jobs", jobs)
+    state["jobs"] = jobs
+
+    submitted = sum(job is not None for tier_jobs in jobs.values() for job in tier_jobs)
+    if not submitted:
+        raise miia_api.SubmitError(f"nenhuma das {sum(len(j) for j in jobs.values())} submissões foi aceita pela MIIA",
+                                   integration_id)
+
+
+@metrics.timed("stage.collect")
+def stage_collect(state, clientMIIA, job_poller=None, ledger=None, sampling=None):
+    integration_id = state["integration_id"]
+    assessments = state["checkpoint"].get("assessments")
+    if assessments is None:
+        print(f"\n[{integration_id}] [4/5] Aguardando e coletando resultados...")
+        if sampling:
+            on_submit = (lambda all_jobs: ledger.record(integration_id, "jobs", all_jobs)) if ledger else None
+            state["jobs"], assessments = collect_adaptive(clientMIIA, integration_id, state["answers"], state["jobs"],
+                                                          sampling, job_poller, on_submit)
+        else:
+            assessments = collect_assessments(clientMIIA, state["jobs"], job_poller)
+        if ledger:
+            ledger.record(integration_id, "assessments", assessments)
+    state["assessments"] = assessments
+    state["scores"] = extract_scores(assessments)
+
+
+@metrics.timed("stage.write")
+def stage_write(state, sheets, sheets_log=None, ledger=None):
+    integration_id = state["integration_id"]
+    assessments = state["assessments"]
+    bolo_assessment  = assessments["bolo"][0] if assessments["bolo"] else None
+    ruim_assessments = assessments["ruim"]
+    med_assessments  = assessments["med"]
+    max_assessments  = assessments["max"]
+
+    scores = state["scores"]
+    bolo_score  = scores["bolo"]
+    ruim_scores = scores["ruim"]
+    med_scores  = scores["med"]
+    max_scores  = scores["max"]
+    max_score   = scores["max_score"]
+
+    print(f"\n[{integration_id}] Scores — bolo: {bolo_score} | ruim: {ruim_scores} | med: {med_scores} | max: {max_scores} | max_score: {max_score}")
+
+    # --- Validação e inserção na planilha ---
+    print(f"\n[{integration_id}] [5/5] Registrando resultado...")
+    # Correções perdidas não derrubam a questão: a linha sai com as notas que vieram e o motivo em log_erro
+    error_log = partial_summary(state["jobs"], assessments)
+    if error_log:
+        metrics.incr("questions.partial")
+        print(f"[{integration_id}] [Parcial] {error_log}")
+    v = validator.Validator()
+    row = v.build_row(
+        question_id=state["question_id"],
+        integration_id=integration_id,
+        bolo_score=bolo_score,
+        ruim_scores=ruim_scores,
+        med_scores=med_scores,
+        max_scores=max_scores,
+        max_score=max_score,
+        error_log=error_log,
+    )
+    sheets.insert_line(row)
+    state["row_written"] = True
+    print(f"[Concluído] {integration_id} registrado com sucesso.")
+
+    # --- Debug: print sample assessment for each failing validation column ---
+    v2 = validator.Validator()
+    checks = [
+        ("pass_bolo",      v2.pass_bolo(bolo_score),                          bolo_assessment),
+        ("pass_ruim_var",  v2.pass_var(ruim_scores, max_score),               ruim_assessments[0]),
+        ("pass_med_var",   v2.pass_var(med_scores,  max_score),               med_assessments[0]),
+        ("pass_max_var",   v2.pass_var(max_scores,  max_score),               max_assessments[0]),
+        ("pass_min_score", v2.pass_min_score(ruim_scores, max_score),         ruim_assessments[0]),
+        ("pass_med_score", v2.pass_med_score(med_scores, max_score),          med_assessments[0]),
+        ("pass_max_score", v2.pass_max_score(max_scores, max_score),          max_assessments[0]),
+    ]
+    for col_name, result, sample_assessment in checks:
+        if result is False:
+            print(f"\n[DEBUG FALSE] {integration_id} {col_name} — sample assessment:\n"
+                  + json.dumps(sample_assessment, ensure_ascii=False, indent=2))
+    # Aprovada = todos os critérios True com todas as correções; é o que a validação incremental consulta
+    passed = error_log is None and all(result is True for _, result, _ in checks)
+
+    # --- Log detalhado na aba esteira_log ---
+    if sheets_log:
+        def _dump(a):
+            return json.dumps(a, ensure_ascii=False) if a else ""
+
+        def _at(lst, i):
+            return lst[i] if lst and len(lst) > i else None
+
+        log_row = [
+            integration_id,
+            _dump(bolo_assessment),
+            _dump(_at(ruim_assessments, 0)),
+            _dump(_at(ruim_assessments, 1)),
+            _dump(_at(ruim_assessments, 2)),
+            _dump(_at(med_assessments,  0)),
+            _dump(_at(med_assessments,  1)),
+            _dump(_at(med_assessments,  2)),
+            _dump(_at(max_assessments,  0)),
+            _dump(_at(max_assessments,  1)),
+            _dump(_at(max_assessments,  2)),
         ]
-        for col_name, result, sample_assessment in checks:
-            if result is False:
-                print(f"\n[DEBUG FALSE] {col_name} — sample assessment:")
-                print(json.dumps(sample_assessment, ensure_ascii=False, indent=2))
-
-        # --- Log detalhado na aba esteira_log ---
-        if sheets_log:
-            def _dump(a):
-                return json.dumps(a, ensure_ascii=False) if a else ""
-
-            def _at(lst, i):
-                return lst[i] if lst and len(lst) > i else None
-
-            log_row = [
-                integration_id,
-                _dump(bolo_assessment),
-                _dump(_at(ruim_assessments, 0)),
-                _dump(_at(ruim_assessments, 1)),
-                _dump(_at(ruim_assessments, 2)),
-                _dump(_at(med_assessments,  0)),
-                _dump(_at(med_assessments,  1)),
-                _dump(_at(med_assessments,  2)),
-                _dump(_at(max_assessments,  0)),
-                _dump(_at(max_assessments,  1)),
-                _dump(_at(max_assessments,  2)),
-            ]
-            sheets_log.insert_line(log_row)
-            print(f"[Log] Detalhamento registrado em esteira_log para {integration_id}.")
+        sheets_log.insert_line(log_row)
+        print(f"[Log] Detalhamento registrado em esteira_log para {integration_id}.")
+
+    if ledger:
+        ledger.record(integration_id, "row", {"passed": passed, "fingerprint": state["fingerprint"]})
+
+
+def write_error(state, sheets, error):
+    """Registra na planilha a linha parcial de uma questão que falhou (se a linha ainda não foi gravada)."""
+    integration_id = state["integration_id"]
+    error_msg = f"{type(error).__name__}: {error}"
+    print(f"[ERRO] Falha em {integration_id}: {error_msg}")
+    if state["row_written"]:
+        return
+
+    scores = state["scores"] or {}
+    v = validator.Validator()
+    partial_row = v.build_row(
+        question_id=state["question_id"],
+        integration_id=integration_id,
+        bolo_score=scores.get("bolo"),
+        ruim_scores=scores.get("ruim", [None, None, None]),
+        med_scores=scores.get("med", [None, None, None]),
+        max_scores=scores.get("max", [None, None, None]),
+        max_score=scores.get("max_score"),
+        error_log=error_msg,
+    )
+    try:
+        sheets.insert_line(partial_row)
+        print(f"[ERRO] Linha de erro registrada na planilha para {integration_id}.")
+    except Exception as sheet_err:
+        print(f"[ERRO] Não foi possível registrar erro na planilha para {integration_id}: {sheet_err}")
+
 
+def run(integration_id, clientMIIA, clientLLM, database, sheets, sheets_log=None, job_poller=None, data=None,
+        ledger=None, sampling=None):
+    """
+    Executa o pipeline completo de uma questão, etapa por etapa.
+    `sampling` ({"min_reps", "max_reps", "margin"}) liga a amostragem adaptativa das correções.
+    """
+    print(f"\n{'='*60}")
+    print(f"Processando integration_id: {integration_id}")
+    print(f"{'='*60}")
+
+    state = new_state(integration_id, data, ledger)
+    try:
+        stage_structure(state, database, ledger)
+        stage_generate(state, clientLLM, ledger)
+        stage_submit(state, clientMIIA, ledger, sampling)
+        stage_collect(state, clientMIIA, job_poller, ledger, sampling)
+        stage_write(state, sheets, sheets_log, ledger)
     except Exception as e:
-        error_msg = f"{type(e).__name__}: {e}"
-        print(f"[ERRO] Falha em {integration_id}: {error_msg}")
-        if not row_written:
-            v = validator.Validator()
-            partial_row = v.build_row(
-                question_id=question_id,
-                integration_id=integration_id,
-                bolo_score=bolo_score,
-                ruim_scores=ruim_scores,
-                med_scores=med_scores,
-                max_scores=max_scores,
-                max_score=max_score,
-                error_log=error_msg,
-            )
-            try:
-                sheets.insert_line(partial_row)
-                print(f"[ERRO] Linha de erro registrada na planilha para {integration_id}.")
-            except Exception as sheet_err:
-                print(f"[ERRO] Não foi possível registrar erro na planilha: {sheet_err}")
+        write_error(state, sheets, e)
         raise
+    finally:
+        metrics.observe("question", time.monotonic() - state["started_at"])
 
 
 def main():
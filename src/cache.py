@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+CACHE_ROOT = os.path.join(os.path.dirname(__file__), '..', '.cache')
+
+
+class DiskCache:
+    """
+    Cache simples em disco: um arquivo JSON por chave dentro de `directory`.
+    Escritas são atômicas (arquivo temporário + rename), então é seguro entre threads e processos.
+
+    Despejo opcional: `ttl` (segundos desde a última gravação) expira entradas na leitura;
+    `max_entries`/`max_bytes` removem as entradas menos usadas recentemente a cada gravação.
+    Com limites, um índice em memória (ordem LRU e tamanhos) evita varrer o diretório a cada gravação;
+    ele é montado na primeira gravação e refeito a cada REINDEX_EVERY gravações, para incorporar o
+    que outros processos gravaram ou removeram no mesmo diretório.
+    """
+
+    REINDEX_EVERY = 1000
+
+    def __init__(self, directory, ttl=None, max_entries=None, max_bytes=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._index = None  # caminho -> tamanho, do menos para o mais usado recentemente
+        self._index_bytes = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if self.ttl is not None and time.time() - entry.get("stored_at", 0) > self.ttl:
+            self._remove(path)
+            return None
+
+        # Atualiza o mtime: é ele que define a ordem de despejo (LRU) entre execuções
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if self._index is not None and path in self._index:
+                self._index.move_to_end(path)
+        return entry.get("value")
+
+    def set(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"stored_at": time.time(), "value": value}, f, ensure_ascii=False)
+            f.flush()
+            size = os.fstat(f.fileno()).st_size
+        path = self._path(key)
+        os.replace(tmp_path, path)
+        if self.max_entries is not None or self.max_bytes is not None:
+            self._evict(path, size)
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            if self._index is not None:
+                self._index_bytes -= self._index.pop(path, 0)
+
+    def _scan(self):
+        """Monta o índice a partir do diretório, em ordem de mtime (a ordem LRU persistida)."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, size, path in entries)
+        self._index_bytes = sum(self._index.values())
+
+    def _evict(self, path, size):
+        """Registra a gravação de `path` no índice e remove as entradas menos usadas acima dos limites."""
+        with self._lock:
+            if self._index is None or self._writes % self.REINDEX_EVERY == 0:
+                self._scan()
+            self._writes += 1
+            self._index_bytes += size - self._index.pop(path, 0)
+            self._index[path] = size
+
+            victims = []
+            while self._index and (
+                (self.max_entries is not None and len(self._index) > self.max_entries)
+                or (self.max_bytes is not None and self._index_bytes > self.max_bytes)
+            ):
+                victim, victim_size = self._index.popitem(last=False)
+                self._index_bytes -= victim_size
+                victims.append(victim)
+        for victim in victims:
+            try:
+                os.remove(victim)
+            except FileNotFoundError:
+                pass
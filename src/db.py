@@ -1,31 +1,14 @@
 import os
-import psycopg
+import cache
+import metrics
+from itertools import groupby
 from dotenv import load_dotenv
-from psycopg.rows import dict_row
-
-class Database:
-    
-    def __init__(self):
-        self.db_host = os.environ.get("DB_HOST")
-        self.db_port = os.environ.get("DB_PORT", "5432") # Puxa a porta 5432 como fallback se não achar
-        self.db_name = os.environ.get("DB_NAME")
-        self.db_user = os.environ.get("DB_USER")
-        self.db_pass = os.environ.get("DB_PASSWORD")
-
-        database_vars = [self.db_host, self.db_name, self.db_user, self.db_pass]
-        if not all(database_vars):
-            raise ValueError("ERROR: missing database configuration variables in .env file.")
 
 
-    def connect(self):
-        conn_info = f"host={self.db_host} port={self.db_port} dbname={self.db_name} user={self.db_user} password={self.db_pass}"
-        return psycopg.connect(conn_info)
-
-
-    def get_question_structure(self, integration_id):
-        query = """
+_QUESTION_STRUCTURE_SELECT = """
         SELECT
             q.id as question_id,
+            q.integration_id,
             q.statement as question_statement,
             q.type as question_type,
             i.name as item_name,
@@ -49,22 +32,141 @@ class Database:
         LEFT JOIN grouping g ON ig.grouping_id = g.id
         LEFT JOIN classification_grouping cg ON g.id = cg.grouping_id
         LEFT JOIN classification c ON cg.classification_id = c.id
+"""
+
+# Caminho antigo: os JOINs em question_answer/job não são lidos, mas multiplicam as linhas
+# por resposta histórica e obrigam o GROUP BY a colapsar tudo de volta. Mantido só para comparação.
+_LEGACY_FANOUT_JOINS = """
         LEFT JOIN question_answer qa ON q.id = qa.question_id
         LEFT JOIN job j ON qa.job_id = j.id
-        WHERE q.integration_id = %s::text
+"""
+
+_LEGACY_GROUP_BY = """
         GROUP BY q.id, q.integration_id, q.statement, q.type, i.id, i.name, i.max_score, i.starts_max, i.eval_mode,
                  g.id, g.name, c.id, c.code, c.short_description, c.long_description, cg.id, cg.weight, cg.type, cg.eval_target, cg.user_context, cg.eval_mode
+"""
+
+# Impressão digital dos critérios para invalidar o cache de estruturas: os mesmos JOINs da query enxuta
+# (sem o fan-out de question_answer/job), mas sem ler os textos. Nem todas as tabelas de critérios têm
+# updated_at, então cada linha entra com o xmin (transação que gravou a versão atual da linha): qualquer
+# UPDATE/INSERT na questão, itens, agrupamentos, classificações ou vínculos muda o xmin, e um vínculo
+# removido some do agregado. O banco devolve só um md5 por questão.
+_STRUCTURE_STAMP_QUERY = """
+        SELECT
+            q.integration_id,
+            md5(string_agg(
+                row(q.id, q.xmin, qi.xmin, i.id, i.xmin, ig.xmin, g.id, g.xmin, cg.id, cg.xmin, c.id, c.xmin)::text,
+                '#' ORDER BY i.id, g.id, c.id, cg.id
+            )) as stamp
+        FROM question q
+        LEFT JOIN question_item qi ON q.id = qi.question_id
+        LEFT JOIN item i ON qi.item_id = i.id
+        LEFT JOIN item_grouping ig ON i.id = ig.item_id
+        LEFT JOIN grouping g ON ig.grouping_id = g.id
+        LEFT JOIN classification_grouping cg ON g.id = cg.grouping_id
+        LEFT JOIN classification c ON cg.classification_id = c.id
+        WHERE q.integration_id = ANY(%s::text[])
+        GROUP BY q.integration_id
+"""
+
+
+def _structure_query(where, order_by, lean=True):
+    if lean:
+        return _QUESTION_STRUCTURE_SELECT + where + order_by
+    return _QUESTION_STRUCTURE_SELECT + _LEGACY_FANOUT_JOINS + where + _LEGACY_GROUP_BY + order_by
+
+
+def _build_structure(linhas):
+    """Monta o dicionário {question_id, statement, type, criteria} a partir das linhas de uma questão."""
+    # Extrai os dados que são iguais para todas as linhas (pegamos da primeira linha [0])
+    dados_estruturados = {
+        "question_id": linhas[0]["question_id"],
+        "statement": linhas[0]["question_statement"],
+        "type": linhas[0]["question_type"],
+        "criteria": []
+    }
+
+    # Itera sobre todas as linhas para montar a estrutura tabular dos critérios
+    for linha in linhas:
+        criterio = {
+            "item_name": linha["item_name"],
+            "max_score": float(linha["max_score"]) if linha["max_score"] else None,
+            "grouping_name": linha["grouping_name"],
+            "classification_code": linha["classification_code"],
+            "short_description": linha["short_description"],
+            "long_description": linha["long_description"],
+            "user_context": linha["user_context"],
+            "weight": float(linha["weight"]) if linha["weight"] else None,
+            "type": linha["type"],
+            "eval_target": linha["eval_target"],
+            "eval_mode": linha["cls_eval_mode"],
+            "rigor_level": linha["rigor_level"],
+        }
+        dados_estruturados["criteria"].append(criterio)
+
+    return dados_estruturados
+
+
+class Database:
+    
+    def __init__(self):
+        self.db_host = os.environ.get("DB_HOST")
+        self.db_port = os.environ.get("DB_PORT", "5432") # Puxa a porta 5432 como fallback se não achar
+        self.db_name = os.environ.get("DB_NAME")
+        self.db_user = os.environ.get("DB_USER")
+        self.db_pass = os.environ.get("DB_PASSWORD")
+
+        database_vars = [self.db_host, self.db_name, self.db_user, self.db_pass]
+        if not all(database_vars):
+            raise ValueError("ERROR: missing database configuration variables in .env file.")
+
+        # Cache local das estruturas, invalidado quando a impressão digital dos critérios muda;
+        # STRUCTURE_CACHE_TTL segundos é só uma rede de segurança (STRUCTURE_CACHE=0 desliga)
+        self.structure_cache = None
+        if os.environ.get("STRUCTURE_CACHE", "1") != "0":
+            cache_dir = os.environ.get("STRUCTURE_CACHE_DIR", os.path.join(cache.CACHE_ROOT, "structures"))
+            ttl = os.environ.get("STRUCTURE_CACHE_TTL", "86400")
+            self.structure_cache = cache.DiskCache(cache_dir, ttl=float(ttl) if ttl else None)
+
+
+    def connect(self):
+        # psycopg é importado só quando o banco é de fato usado (o import custa ~0,2s na partida)
+        import psycopg
+
+        conn_info = f"host={self.db_host} port={self.db_port} dbname={self.db_name} user={self.db_user} password={self.db_pass}"
+        return psycopg.connect(conn_info)
+
+
+    def dict_cursor(self, conn):
+        """Cursor que devolve cada linha como dict."""
+        from psycopg.rows import dict_row
+
+        return conn.cursor(row_factory=dict_row)
+
+
+    def get_question_structure(self, integration_id, lean=True):
+        if lean and self.structure_cache is not None:
+            try:
+                return dict(self.get_question_structures([integration_id]))[str(integration_id)]
+            except Exception as e:
+                print(f"Erro no Banco de Dados: {e}")
+                return None
+
+        query = _structure_query("""
+        WHERE q.integration_id = %s::text
+        """, """
         ORDER BY i.id, g.id, c.id;
-        """
+        """, lean=lean)
 
         try:
             with self.connect() as conn:
                 # O row_factory converte a saída para dicionários
-                with conn.cursor(row_factory=dict_row) as cur:
+                with self.dict_cursor(conn) as cur:
                     
                     # Passamos o integration_id como uma tupla (note a vírgula)
-                    cur.execute(query, (integration_id,))
-                    linhas = cur.fetchall()
+                    with metrics.span("db.structure_query"):
+                        cur.execute(query, (integration_id,))
+                        linhas = cur.fetchall()
 
                     print(f"Buscadas {cur.rowcount} linhas de critério para o integration_id {integration_id}.")
 
@@ -72,39 +174,117 @@ class Database:
                     if not linhas:
                         return None
 
-                    # Extrai os dados que são iguais para todas as linhas (pegamos da primeira linha [0])
-                    dados_estruturados = {
-                        "question_id": linhas[0]["question_id"],
-                        "statement": linhas[0]["question_statement"],
-                        "type": linhas[0]["question_type"],
-                        "criteria": []
-                    }
-
-                    # Itera sobre todas as linhas para montar a estrutura tabular dos critérios
-                    for linha in linhas:
-                        criterio = {
-                            "item_name": linha["item_name"],
-                            "max_score": float(linha["max_score"]) if linha["max_score"] else None,
-                            "grouping_name": linha["grouping_name"],
-                            "classification_code": linha["classification_code"],
-                            "short_description": linha["short_description"],
-                            "long_description": linha["long_description"],
-                            "user_context": linha["user_context"],
-                            "weight": float(linha["weight"]) if linha["weight"] else None,
-                            "type": linha["type"],
-                            "eval_target": linha["eval_target"],
-                            "eval_mode": linha["cls_eval_mode"],
-                            "rigor_level": linha["rigor_level"],
-                        }
-                        dados_estruturados["criteria"].append(criterio)
-
-                    return dados_estruturados
+                    return _build_structure(linhas)
 
         except Exception as e:
             print(f"Erro no Banco de Dados: {e}")
             return None
 
 
+    def get_question_structures(self, integration_ids, chunk_size=500, lean=True):
+        """
+        Versão em lote de get_question_structure: uma query por bloco de `chunk_size` IDs
+        (integration_id = ANY(...)). É um gerador de pares (integration_id, estrutura), com
+        estrutura None para IDs inexistentes, então só um bloco fica em memória por vez.
+
+        Com o cache ligado, cada bloco consulta antes só a impressão digital dos critérios (um md5 por
+        questão, sem ler os textos); a query completa roda apenas para IDs sem cache, com a questão ou
+        algum critério alterado ou com a entrada mais velha que STRUCTURE_CACHE_TTL.
+        """
+        query = _structure_query("""
+        WHERE q.integration_id = ANY(%s::text[])
+        """, """
+        ORDER BY q.integration_id, i.id, g.id, c.id;
+        """, lean=lean)
+        use_cache = lean and self.structure_cache is not None
+
+        integration_ids = [str(i) for i in integration_ids]
+        with self.connect() as conn:
+            with self.dict_cursor(conn) as cur:
+                for start in range(0, len(integration_ids), chunk_size):
+                    chunk = integration_ids[start:start + chunk_size]
+
+                    por_id = {}
+                    to_fetch = chunk
+                    from_cache = 0
+                    if use_cache:
+                        with metrics.span("db.stamp_query"):
+                            cur.execute(_STRUCTURE_STAMP_QUERY, (chunk,))
+                            stamps = {row["integration_id"]: row["stamp"] for row in cur.fetchall()}
+                        to_fetch = []
+                        for integration_id, stamp in stamps.items():
+                            entry = self.structure_cache.get(integration_id)
+                            if entry and entry.get("stamp") == stamp:
+                                por_id[integration_id] = entry["structure"]
+                            else:
+                                to_fetch.append(integration_id)
+                    from_cache = len(por_id)
+                    metrics.incr("db.structure_cache_hits", from_cache)
+
+                    if to_fetch:
+                        with metrics.span("db.structure_query"):
+                            cur.execute(query, (to_fetch,))
+                            rows = cur.fetchall()
+                        for integration_id, linhas in groupby(rows, key=lambda linha: linha["integration_id"]):
+                            estrutura = _build_structure(list(linhas))
+                            por_id[integration_id] = estrutura
+                            if use_cache:
+                                self.structure_cache.set(integration_id, {
+                                    "stamp": stamps[integration_id],
+                                    "structure": estrutura,
+                                })
+
+                    print(f"Buscadas estruturas de {len(por_id)}/{len(chunk)} questões em lote "
+                          f"({from_cache} do cache local).")
+                    for integration_id in chunk:
+                        yield integration_id, por_id.get(integration_id)
+
+
+    def iter_integration_ids(self, updated_since=None, question_types=None, tenant_id=None, page_size=1000):
+        """
+        Gerador dos integration_ids da tabela question, em ordem, com filtros opcionais (atualizadas
+        desde `updated_since`, tipo em `question_types`, vinculadas ao `tenant_id` em tenant_question).
+
+        Paginação por chave (integration_id > último visto), não por OFFSET: cada página custa o mesmo
+        em qualquer ponto do banco e só uma página fica em memória. Cada página abre sua própria
+        conexão, já que o consumidor pode levar horas entre uma e outra.
+        """
+        conditions, params = [], []
+        if updated_since is not None:
+            conditions.append("q.updated_at >= %s")
+            params.append(updated_since)
+        if question_types:
+            conditions.append("q.type = ANY(%s::text[])")
+            params.append(list(question_types))
+        if tenant_id is not None:
+            conditions.append("""EXISTS (
+                SELECT 1 FROM tenant_question tq
+                WHERE tq.integration_id = q.integration_id AND tq.tenant_id = %s
+            )""")
+            params.append(tenant_id)
+
+        def _page_query(first):
+            where = conditions if first else ["q.integration_id > %s", *conditions]
+            return f"""
+                SELECT DISTINCT q.integration_id FROM question q
+                {"WHERE " + " AND ".join(where) if where else ""}
+                ORDER BY q.integration_id
+                LIMIT %s
+            """
+
+        last = None
+        while True:
+            page_params = params if last is None else [last, *params]
+            with metrics.span("db.discovery_page"), self.connect() as conn:
+                rows = conn.execute(_page_query(last is None), (*page_params, page_size)).fetchall()
+            metrics.incr("db.discovered_ids", len(rows))
+            for (integration_id,) in rows:
+                yield integration_id
+            if len(rows) < page_size:
+                return
+            last = rows[-1][0]
+
+
     def ensure_tenant_question(self, integration_id):
         """
         Garante que o integration_id esteja vinculado ao tenant configurado em TENANT_ID.
@@ -146,4 +326,63 @@ class Database:
 
         except Exception as e:
             print(f"[PRÉ-VALIDAÇÃO] Erro ao garantir tenant_question para '{integration_id}': {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def ensure_tenant_questions(self, integration_ids):
+        """
+        Versão em lote de ensure_tenant_question: vincula todos os IDs ao TENANT_ID numa única
+        transação, com um INSERT ... SELECT baseado em conjunto.
+        Retorna {integration_id: True (já existia) | False (inserido) | None (fora da tabela question)}.
+        """
+        tenant_id = int(os.environ.get("TENANT_ID", 11))
+        integration_ids = list(dict.fromkeys(str(i) for i in integration_ids))
+
+        check_query = """
+            SELECT integration_id FROM tenant_question
+            WHERE tenant_id = %s AND integration_id = ANY(%s::text[])
+        """
+        insert_query = """
+            INSERT INTO tenant_question (tenant_id, question_id, integration_id, created_at, updated_at)
+            SELECT DISTINCT ON (q.integration_id) %s, q.id, q.integration_id, NOW(), NOW()
+            FROM question q
+            WHERE q.integration_id = ANY(%s::text[])
+            ORDER BY q.integration_id, q.id
+            ON CONFLICT (tenant_id, integration_id) DO NOTHING
+            RETURNING integration_id
+        """
+
+        try:
+            with metrics.span("db.ensure_tenant"), self.connect() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(check_query, (tenant_id, integration_ids))
+                    linked = {row[0] for row in cur.fetchall()}
+
+                    to_link = [i for i in integration_ids if i not in linked]
+                    inserted = set()
+                    if to_link:
+                        cur.execute(insert_query, (tenant_id, to_link))
+                        inserted = {row[0] for row in cur.fetchall()}
+
+                    # Vínculos criados por outro processo no meio tempo caem no ON CONFLICT
+                    leftover = [i for i in to_link if i not in inserted]
+                    if leftover:
+                        cur.execute(check_query, (tenant_id, leftover))
+                        linked.update(row[0] for row in cur.fetchall())
+                conn.commit()
+
+        except Exception as e:
+            print(f"[PRÉ-VALIDAÇÃO] Erro ao garantir tenant_question em lote: {e}")
+            return {integration_id: None for integration_id in integration_ids}
+
+        print(f"[PRÉ-VALIDAÇÃO] tenant={tenant_id}: {len(linked)} já vinculados, {len(inserted)} inseridos, "
+              f"{len(integration_ids) - len(linked) - len(inserted)} ausentes da tabela question.")
+
+        status = {}
+        for integration_id in integration_ids:
+            if integration_id in linked:
+                status[integration_id] = True
+            elif integration_id in inserted:
+                status[integration_id] = False
+            else:
+                status[integration_id] = None
+        return status
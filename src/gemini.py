@@ -1,5 +1,4 @@
 import os
-from google import genai
 from dotenv import load_dotenv
 
 
@@ -9,6 +8,8 @@ class GeminiClient:
         self.api_key = os.environ.get("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("ERROR: GEMINI_API_KEY not set in environment variables.")
+        # google-genai é importado sob demanda: leva cerca de 1s e só este cliente o usa
+        from google import genai
         self.client = genai.Client(api_key=self.api_key)
 
     def send_prompt(self, prompt):
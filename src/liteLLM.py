@@ -1,33 +1,345 @@
 import os
-import litellm
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+import cache
+import ratelimit
+import metrics
+
+
+GENERATION_MODES = ("separate", "combined", "prefix")
+
+
+def _litellm():
+    """
+    Importa o litellm no primeiro uso: o import leva alguns segundos e não deve pesar
+    em execuções que nem chegam a chamar o LLM (--help, questões já concluídas, erros de configuração).
+    """
+    # O lock de import do Python faz as outras threads esperarem um import em andamento
+    import litellm
+    return litellm
+
+
+_preload_lock = threading.Lock()
+_preload_thread = None
+
+
+def preload():
+    """Começa a importar o litellm numa thread de fundo (uma vez só), em paralelo com o que vem antes da geração."""
+    global _preload_thread
+    with _preload_lock:
+        if _preload_thread is None:
+            _preload_thread = threading.Thread(target=_litellm, name="litellm-import", daemon=True)
+            _preload_thread.start()
+        return _preload_thread
 
 
 class LiteLLMClient:
 
-    def __init__(self):
+    THROTTLE_RETRIES = 5  # quantas vezes uma chamada que recebeu 429 é refeita
+    HEDGE_MIN_SAMPLES = 20  # latências observadas antes de o percentil substituir LLM_HEDGE_DELAY
+    HEDGE_WINDOW = 500      # últimas latências consideradas no percentil
+
+    def __init__(self, use_cache=None, refresh_cache=False, generation_mode=None, hedge=None):
         self.api_base = os.environ.get("LITELLM_API_BASE")
         self.api_key = os.environ.get("LITELLM_API_KEY")
         self.model = os.environ.get("LLM_DEFAULT_MODEL")
         self.temperature = float(os.getenv("LLM_TEMPERATURE", "0.1"))
         self.max_tokens = int(os.getenv("LLM_MAX_TOKENS", ""))
         self.timeout = int(os.getenv("LLM_TIMEOUT", ""))
+        # Orçamento opcional de tokens do bloco de critérios (ver belt.render_criteria)
+        budget = os.environ.get("LLM_CRITERIA_TOKEN_BUDGET")
+        self.prompt_token_budget = int(budget) if budget else None
+        # Como belt gera as três respostas: separate (3 chamadas), combined (1 chamada) ou
+        # prefix (3 chamadas com o mesmo prefixo de sistema, para o cache de prompt do provedor)
+        self.generation_mode = generation_mode or os.environ.get("LLM_GENERATION_MODE", "separate")
+        if self.generation_mode not in GENERATION_MODES:
+            raise ValueError(f"ERROR: LLM_GENERATION_MODE deve ser um de {', '.join(GENERATION_MODES)}.")
+        # Marca o prefixo de sistema com cache_control (cache explícito, ex.: Anthropic)
+        self.cache_control = os.environ.get("LLM_CACHE_CONTROL", "0") == "1"
+        # Quantas vezes um tipo de resposta fora do schema é regerado antes de a questão falhar
+        self.answer_retries = int(os.environ.get("LLM_ANSWER_RETRIES", "2"))
 
         if not self.api_base or not self.api_key or not self.model:
             raise ValueError("ERROR: LITELLM_API_BASE, LITELLM_API_KEY e LLM_DEFAULT_MODEL devem estar no .env.")
 
-    def send_prompt(self, prompt, temperature=None):
-        try:
-            response = litellm.completion(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                api_base=self.api_base,
-                api_key=self.api_key,
-                temperature=temperature if temperature is not None else self.temperature,
-                max_tokens=self.max_tokens,
-                timeout=self.timeout,
-                drop_params=True,
+        # Cache persistente das respostas (opt-in): chave = (modelo, temperatura, hash do prompt)
+        if use_cache is None:
+            use_cache = os.environ.get("LLM_CACHE", "0") == "1"
+        self.cache = None
+        if use_cache:
+            ttl = os.environ.get("LLM_CACHE_TTL")
+            max_entries = os.environ.get("LLM_CACHE_MAX_ENTRIES", "5000")
+            self.cache = cache.DiskCache(
+                os.environ.get("LLM_CACHE_DIR", os.path.join(cache.CACHE_ROOT, "llm")),
+                ttl=float(ttl) if ttl else None,
+                max_entries=int(max_entries) if max_entries else None,
             )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Error communicating with LiteLLM: {e}")
+        # refresh_cache ignora leituras (força nova geração) mas grava o resultado novo
+        self.refresh_cache = refresh_cache
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._stats_lock = threading.Lock()
+
+        # Vazão compartilhada por todas as threads: LLM_RATE_LIMIT req/s (padrão sem limite),
+        # LLM_MAX_IN_FLIGHT chamadas simultâneas, pausa em 429 e circuit breaker (LLM_BREAKER_*)
+        self.throttle = ratelimit.Throttle.from_env("LLM", "LiteLLM", max_in_flight=16)
+
+        # Modelo reserva: recebe a chamada quando o principal falha de vez (e as cópias do hedging)
+        self.fallback_model = os.environ.get("LLM_FALLBACK_MODEL") or None
+        # Hedging (opt-in): a chamada que passa do percentil LLM_HEDGE_PERCENTILE da latência observada
+        # ganha uma cópia; vale a primeira resposta não vazia e a outra é cancelada
+        if hedge is None:
+            hedge = os.environ.get("LLM_HEDGE", "0") == "1"
+        self.hedge = hedge
+        self.hedge_percentile = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.95"))
+        self.hedge_initial_delay = float(os.environ.get("LLM_HEDGE_DELAY", "10"))
+        self.hedge_min_delay = float(os.environ.get("LLM_HEDGE_MIN_DELAY", "1"))
+        # Fração máxima das chamadas que pode ganhar cópia, para o hedging não dobrar a carga num provedor lento
+        self.hedge_budget = float(os.environ.get("LLM_HEDGE_BUDGET", "0.1"))
+        if not 0 < self.hedge_percentile < 1:
+            raise ValueError("ERROR: LLM_HEDGE_PERCENTILE deve estar entre 0 e 1 (ex.: 0.95).")
+        self._latencies = deque(maxlen=self.HEDGE_WINDOW)
+        self._calls = 0
+        self._hedges = 0
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+
+    def _cache_key(self, prompt, temperature, system=None):
+        text = prompt if system is None else f"{system}\x00{prompt}"
+        prompt_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return json.dumps([self.model, temperature, prompt_hash])
+
+    def _messages(self, prompt, system=None):
+        messages = [{"role": "user", "content": prompt}]
+        if system is not None:
+            content = system
+            if self.cache_control:
+                content = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+            messages.insert(0, {"role": "system", "content": content})
+        return messages
+
+    def send_prompt(self, prompt, temperature=None, use_cache=True, system=None, max_tokens=None, refresh=False):
+        temperature = temperature if temperature is not None else self.temperature
+        use_cache = use_cache and self.cache is not None
+
+        if use_cache:
+            key = self._cache_key(prompt, temperature, system)
+            if not (self.refresh_cache or refresh):
+                cached = self.cache.get(key)
+                if cached is not None:
+                    metrics.incr("llm.cache_hits")
+                    with self._stats_lock:
+                        self.cache_hits += 1
+                    return cached
+            metrics.incr("llm.cache_misses")
+            with self._stats_lock:
+                self.cache_misses += 1
+
+        request = {
+            "messages": self._messages(prompt, system),
+            "api_base": self.api_base,
+            "api_key": self.api_key,
+            "temperature": temperature,
+            "max_tokens": max_tokens or self.max_tokens,
+            "timeout": self.timeout,
+            "drop_params": True,
+        }
+        try:
+            if self.hedge:
+                model, content = self._run_async(self._hedged(request))
+            else:
+                model, content = self._complete_with_fallback(request)
+        except Exception as error:
+            metrics.incr("llm.failures")
+            print(f"Error communicating with LiteLLM: {error}")
             return None
+
+        # Resposta do modelo reserva não entra no cache: a chave é do modelo principal
+        if model != self.model:
+            use_cache = False
+        if use_cache and content:
+            self.cache.set(key, content)
+        return content
+
+    def _complete(self, model, request, observe=True):
+        """
+        Uma chamada síncrona, refeita em 429. Retorna o conteúdo ou lança o último erro.
+        `observe` registra a latência para o hedge_delay (só chamadas principais).
+        """
+        for attempt in range(self.THROTTLE_RETRIES + 1):
+            self.throttle.acquire()
+            error = None
+            started = time.monotonic()
+            try:
+                with metrics.span("llm.completion"):
+                    response = _litellm().completion(model=model, **request)
+                content = response.choices[0].message.content
+            except Exception as e:
+                error = e
+            throttled = self.throttle.release(error=error)
+            if error is None:
+                if observe:
+                    self._observe_latency(time.monotonic() - started)
+                return content
+            if not throttled or attempt == self.THROTTLE_RETRIES:
+                raise error
+            metrics.incr("llm.retries")
+
+    def _complete_with_fallback(self, request):
+        try:
+            return self.model, self._complete(self.model, request)
+        except Exception as error:
+            if self.fallback_model is None:
+                raise
+            metrics.incr("llm.fallbacks")
+            print(f"[LiteLLM] {self.model} falhou ({error}) — tentando o modelo reserva {self.fallback_model}.")
+            return self.fallback_model, self._complete(self.fallback_model, request, observe=False)
+
+    async def _acomplete(self, model, request, observe=True):
+        """Versão assíncrona de _complete (litellm.acompletion), cancelável pelo hedging."""
+        import asyncio
+
+        for attempt in range(self.THROTTLE_RETRIES + 1):
+            await self.throttle.acquire_async()
+            error = None
+            started = time.monotonic()
+            try:
+                response = await _litellm().acompletion(model=model, **request)
+                content = response.choices[0].message.content
+            except asyncio.CancelledError:
+                # Perdeu a corrida: libera a vaga sem contar falha no circuit breaker
+                self.throttle.release()
+                raise
+            except Exception as e:
+                error = e
+            elapsed = time.monotonic() - started
+            metrics.observe("llm.completion", elapsed)
+            throttled = self.throttle.release(error=error)
+            if error is None:
+                if observe:
+                    self._observe_latency(elapsed)
+                return content
+            metrics.incr("llm.completion.errors")
+            if not throttled or attempt == self.THROTTLE_RETRIES:
+                raise error
+            metrics.incr("llm.retries")
+
+    async def _hedged(self, request):
+        """
+        Dispara a chamada principal; se ela não responder em hedge_delay() segundos, dispara uma cópia
+        (no modelo reserva, se houver) e fica com a primeira resposta não vazia, cancelando a outra.
+        Se a principal falhar antes disso, a cópia sai na hora como reserva. Retorna (modelo, conteúdo).
+        """
+        import asyncio
+
+        primary = asyncio.ensure_future(self._acomplete(self.model, request))
+        calls = {primary: self.model}
+        with self._stats_lock:
+            self._calls += 1
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+
+        backup_model = self.fallback_model or self.model
+        if not done and self._take_hedge():
+            metrics.incr("llm.hedge.sent")
+            calls[asyncio.ensure_future(self._acomplete(backup_model, request, observe=False))] = "hedge"
+        elif done and (primary.exception() is not None or not primary.result()) and self.fallback_model:
+            metrics.incr("llm.fallbacks")
+            print(f"[LiteLLM] {self.model} falhou ({primary.exception() or 'resposta vazia'}) "
+                  f"— tentando o modelo reserva {self.fallback_model}.")
+            calls[asyncio.ensure_future(self._acomplete(self.fallback_model, request, observe=False))] = self.fallback_model
+
+        pending, winner, error = set(calls), None, None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for call in done:
+                if call.exception() is None and call.result():
+                    winner = call
+                    break
+                error = call.exception() or ValueError("LLM retornou resposta vazia")
+        for call in pending:
+            call.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            metrics.incr("llm.hedge.cancelled", len(pending))
+
+        if "hedge" in calls.values() and winner is not None:
+            metrics.incr("llm.hedge.wins" if calls[winner] == "hedge" else "llm.hedge.primary_wins")
+        if winner is None:
+            raise error
+        model = backup_model if calls[winner] == "hedge" else calls[winner]
+        return model, winner.result()
+
+    def _run_async(self, coro):
+        """Executa `coro` no event loop do cliente (uma thread de fundo, criada no primeiro uso) e espera o resultado."""
+        import asyncio
+
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="litellm-hedge", daemon=True)
+                self._loop_thread.start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def close(self):
+        """Encerra o event loop do hedging, se chegou a ser criado (cancela o que ainda estiver pendente nele)."""
+        import asyncio
+
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        if loop is None:
+            return
+
+        async def _drain():
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(_drain(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def _observe_latency(self, seconds):
+        with self._stats_lock:
+            self._latencies.append(seconds)
+
+    def _take_hedge(self):
+        """
+        Reserva uma cópia dentro de LLM_HEDGE_BUDGET (fração das chamadas, mais uma de saída para as
+        primeiras chamadas lentas não ficarem sem cópia). False se o orçamento acabou.
+        """
+        with self._stats_lock:
+            if self._hedges + 1 > self.hedge_budget * self._calls + 1:
+                metrics.incr("llm.hedge.over_budget")
+                return False
+            self._hedges += 1
+            return True
+
+    def hedge_delay(self):
+        """
+        Espera antes da cópia: o percentil LLM_HEDGE_PERCENTILE das latências recentes do modelo principal
+        (LLM_HEDGE_DELAY até haver amostras). Cópias e respostas do modelo reserva não entram na conta.
+        """
+        with self._stats_lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.HEDGE_MIN_SAMPLES:
+            return self.hedge_initial_delay
+        return max(self.hedge_min_delay, samples[min(len(samples) - 1, int(self.hedge_percentile * len(samples)))])
+
+    def count_tokens(self, text):
+        """Tokens de `text` pelo tokenizador do modelo; sem ele, uma estimativa por caracteres."""
+        try:
+            return _litellm().token_counter(model=self.model, text=text)
+        except Exception:
+            return (len(text) + 3) // 4
+
+    def cache_stats(self):
+        with self._stats_lock:
+            return {"hits": self.cache_hits, "misses": self.cache_misses}
@@ -1,25 +1,524 @@
 import os
+import sys
+import time
+import argparse
+import itertools
+from datetime import datetime
 import db
+import metrics
 import liteLLM
 import miia_api
+import poller
 import sheet
+import store
+import validator
 import belt
+import pipeline
+import workqueue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 IDS_FILE = os.path.join(os.path.dirname(__file__), '..', 'ids.txt')
 
 
-def main():
-    load_dotenv()
+def _parse_since(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data inválida: '{value}' (use o formato ISO, ex.: 2026-10-01)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pipeline de validação de questões discursivas da MIIA.")
+    parser.add_argument(
+        "--ids-file", default=IDS_FILE,
+        help="Arquivo com um integration_id por linha (padrão: ids.txt na raiz do projeto); '-' lê da entrada padrão, em fluxo.",
+    )
+    parser.add_argument(
+        "--from-db", action="store_true",
+        help="Em vez de --ids-file, percorre a tabela question do banco em páginas (filtros: --updated-since, --question-type, --tenant).",
+    )
+    parser.add_argument(
+        "--updated-since", type=_parse_since, default=None,
+        help="Com --from-db, só questões com updated_at a partir desta data (ISO, ex.: 2026-10-01 ou 2026-10-01T08:00).",
+    )
+    parser.add_argument(
+        "--question-type", action="append", default=None,
+        help="Com --from-db, só questões deste tipo (pode repetir a opção).",
+    )
+    parser.add_argument(
+        "--tenant", type=int, default=None,
+        help="Com --from-db, só questões vinculadas a este tenant em tenant_question.",
+    )
+    parser.add_argument(
+        "--page-size", type=int, default=int(os.environ.get("DB_DISCOVERY_PAGE_SIZE", "1000")),
+        help="Com --from-db, IDs por página da consulta ao banco (padrão: DB_DISCOVERY_PAGE_SIZE ou 1000).",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=int(os.environ.get("STREAM_BATCH_SIZE", "500")),
+        help="Na entrada em fluxo (--from-db ou --ids-file -), IDs preparados por vez: seleção incremental, "
+             "pré-validação e, no modo padrão, processamento (padrão: STREAM_BATCH_SIZE ou 500).",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("PIPELINE_WORKERS", "1")),
+        help="Quantidade de questões processadas em paralelo (padrão: PIPELINE_WORKERS ou 1).",
+    )
+    parser.add_argument(
+        "--buffer-sheets", action="store_true",
+        help="Com --no-store: acumula as linhas e envia em lote para o Google Sheets (SHEET_FLUSH_SIZE linhas "
+             "ou SHEET_FLUSH_INTERVAL segundos). Com o store ligado, o envio já é em lote e a opção é ignorada.",
+    )
+    parser.add_argument(
+        "--no-store", action="store_true",
+        help="Escreve direto na planilha, sem passar pelo armazenamento local de resultados.",
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="Retoma a última execução: pula questões concluídas e volta a acompanhar os jobs já submetidos.",
+    )
+    parser.add_argument(
+        "--llm-cache", action="store_true", default=os.environ.get("LLM_CACHE", "0") == "1",
+        help="Reaproveita respostas do LLM já geradas para o mesmo prompt (cache em disco; também via LLM_CACHE=1).",
+    )
+    parser.add_argument(
+        "--refresh-llm-cache", action="store_true",
+        help="Ignora o cache do LLM na leitura (gera de novo) e grava as respostas novas.",
+    )
+    parser.add_argument(
+        "--hedge", action="store_true", default=os.environ.get("LLM_HEDGE", "0") == "1",
+        help="Chamadas ao LLM mais lentas que o percentil LLM_HEDGE_PERCENTILE ganham uma cópia (em LLM_FALLBACK_MODEL, "
+             "se houver); vale a primeira resposta e a outra é cancelada (também via LLM_HEDGE=1).",
+    )
+    parser.add_argument(
+        "--generation-mode", choices=liteLLM.GENERATION_MODES, default=os.environ.get("LLM_GENERATION_MODE", "separate"),
+        help="separate: uma chamada por tipo de resposta; combined: uma chamada para os três; "
+             "prefix: três chamadas com prefixo comum estável (cache de prompt do provedor).",
+    )
+    parser.add_argument(
+        "--incremental", action="store_true", default=os.environ.get("INCREMENTAL_VALIDATION", "0") == "1",
+        help="Processa só questões novas, alteradas (enunciado, critérios, modelo/temperatura, versão do Validator), "
+             "reprovadas na última validação ou validadas há mais de --max-age dias (também via INCREMENTAL_VALIDATION=1).",
+    )
+    parser.add_argument(
+        "--max-age", type=float, default=float(os.environ.get("INCREMENTAL_MAX_AGE_DAYS", "30")),
+        help="No modo --incremental, idade máxima (dias) de uma aprovação antes de validar de novo; 0 = sem limite (padrão: 30).",
+    )
+    parser.add_argument(
+        "--adaptive", action="store_true",
+        help="Amostragem adaptativa: submete --min-reps correções por tipo e só acrescenta mais enquanto algum critério estiver indefinido.",
+    )
+    parser.add_argument("--min-reps", type=int, default=2, help="Correções iniciais por tipo no modo adaptativo (padrão: 2).")
+    parser.add_argument("--max-reps", type=int, default=3, help=f"Máximo de correções por tipo no modo adaptativo (padrão: 3; no máximo "
+                             f"{validator.Validator.ROW_REPS}, as colunas de notas por tipo na planilha).")
+    parser.add_argument(
+        "--adaptive-margin", type=float, default=validator.Validator.ADAPTIVE_MARGIN,
+        help="Quanto (fração de max_score) as próximas notas podem se afastar das já vistas; 1.0 = pior caso estrito.",
+    )
+    parser.add_argument(
+        "--pipeline", action="store_true",
+        help="Processa em fluxo: cada etapa (geração, submissão, coleta, registro) tem suas próprias threads e filas.",
+    )
+    parser.add_argument(
+        "--stage-workers", default=os.environ.get("PIPELINE_STAGE_WORKERS", ""),
+        help="Threads por etapa no modo --pipeline, ex.: generate=4,submit=4,collect=32,write=1.",
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=None,
+        help="Tamanho máximo de cada fila entre etapas no modo --pipeline (padrão: 2x as threads da etapa seguinte).",
+    )
+    parser.add_argument(
+        "--enqueue", action="store_true",
+        help="Só enfileira os IDs de --ids-file (ou de --from-db) na fila do banco (WORK_QUEUE_TABLE) para workers processarem, e sai.",
+    )
+    parser.add_argument(
+        "--worker", action="store_true",
+        help="Modo worker: em vez de --ids-file, reivindica blocos de IDs da fila do banco até esvaziá-la.",
+    )
+    parser.add_argument(
+        "--claim-size", type=int, default=int(os.environ.get("WORK_QUEUE_CLAIM_SIZE", "20")),
+        help="IDs reivindicados por vez no modo --worker (padrão: WORK_QUEUE_CLAIM_SIZE ou 20).",
+    )
+    parser.add_argument(
+        "--wait", action="store_true",
+        help="No modo --worker, continua aguardando novos itens quando a fila esvazia (a cada WORK_QUEUE_POLL_S segundos).",
+    )
+    parser.add_argument(
+        "--metrics-report", default=os.environ.get("METRICS_REPORT_PATH", metrics.REPORT_BASE),
+        help="Caminho base do relatório de métricas: grava <caminho>.json e <caminho>.prom (padrão: run_metrics).",
+    )
+    args = parser.parse_args(argv)
+    try:
+        args.stage_workers = pipeline.parse_concurrency(args.stage_workers)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.queue_size is not None and args.queue_size < 1:
+        parser.error("--queue-size deve ser >= 1")
+    if args.workers < 1:
+        parser.error("--workers deve ser >= 1")
+    if args.max_age < 0:
+        parser.error("--max-age deve ser >= 0")
+    if args.enqueue and args.worker:
+        parser.error("--enqueue e --worker são modos separados")
+    if args.claim_size < 1:
+        parser.error("--claim-size deve ser >= 1")
+    if args.page_size < 1 or args.batch_size < 1:
+        parser.error("--page-size e --batch-size devem ser >= 1")
+    if args.from_db and args.worker:
+        parser.error("--from-db não se aplica ao modo --worker (os IDs vêm da fila); use --enqueue --from-db")
+    if not args.from_db and (args.updated_since or args.question_type or args.tenant is not None):
+        parser.error("--updated-since, --question-type e --tenant exigem --from-db")
+    if not 1 <= args.min_reps <= args.max_reps <= validator.Validator.ROW_REPS:
+        parser.error(f"exigido 1 <= --min-reps <= --max-reps <= {validator.Validator.ROW_REPS} (colunas da planilha)")
+    return args
+
+
+def _select_incremental(integration_ids, database, clientLLM, history, max_age_days):
+    """
+    Validação incremental: mantém só as questões novas, alteradas (impressão digital diferente),
+    reprovadas na última validação ou aprovadas há mais de `max_age_days` dias.
+    Retorna (IDs a processar, {integration_id: estrutura} já carregadas do banco).
+    """
+    print("[Incremental] Comparando com a última validação de cada questão...")
+    last = history.last_results(integration_ids)
+    max_age_s = max_age_days * 86400 if max_age_days else None
+    now = time.time()
+
+    selected, structures = [], {}
+    reasons = {"nova": 0, "alterada": 0, "reprovada": 0, "expirada": 0, "inalterada": 0}
+    for integration_id, data in database.get_question_structures(integration_ids):
+        previous = last.get(integration_id)
+        if data is None or previous is None:
+            reason = "nova"  # sem estrutura no banco: segue e falha com linha de erro na planilha, como antes
+        elif previous["fingerprint"] != belt.question_fingerprint(data, clientLLM):
+            reason = "alterada"
+        elif not previous["passed"]:
+            reason = "reprovada"
+        elif max_age_s and now - previous["validated_at"] > max_age_s:
+            reason = "expirada"
+        else:
+            reason = "inalterada"
+        reasons[reason] += 1
+        if reason != "inalterada":
+            selected.append(integration_id)
+            structures[integration_id] = data
+
+    metrics.incr("questions.skipped_unchanged", reasons["inalterada"])
+    print(f"[Incremental] {len(selected)} de {len(integration_ids)} questões a validar — "
+          + ", ".join(f"{n} {reason}s" for reason, n in reasons.items()) + "\n")
+    return selected, structures
+
+
+def _record_history(history, ledger, failed):
+    """Grava no histórico o desfecho das questões desta execução (aprovadas ou não, e as que falharam)."""
+    rows = ledger.row_results()
+    entries = [(i, row.get("fingerprint"), row.get("passed", False)) for i, row in rows.items()]
+    entries += [(i, None, False) for i in failed if i not in rows]
+    history.record_many(entries)
+
+
+def _preload_structures(database, integration_ids, chunk_size=500):
+    """
+    Estruturas de `integration_ids` em blocos de `chunk_size`. Um bloco cuja query falha não derruba
+    o lote: seus IDs voltam em {integration_id: erro} e os demais blocos seguem.
+    """
+    structures, errors = {}, {}
+    for start in range(0, len(integration_ids), chunk_size):
+        chunk = integration_ids[start:start + chunk_size]
+        try:
+            structures.update(database.get_question_structures(chunk, chunk_size=chunk_size))
+        except Exception as e:
+            print(f"[Pré-carga] Falha ao buscar estruturas de {len(chunk)} questões: {e}")
+            errors.update((integration_id, e) for integration_id in chunk)
+    return structures, errors
+
+
+def _run_per_question(args, integration_ids, clientMIIA, clientLLM, database, sink, sink_log,
+                      job_poller, ledger, sampling, structures=None, on_finish=None):
+    """
+    Uma questão por worker, do início ao fim (modo padrão).
+    `on_finish(integration_id, ok)` é chamado assim que cada questão termina.
+    """
+    on_finish = on_finish or (lambda integration_id, ok: None)
+    # Carrega enunciado + critérios de todas as questões em poucas idas ao banco,
+    # antes de qualquer gasto com LLM (a validação incremental já traz as estruturas carregadas)
+    errors = {}
+    if structures is None:
+        print("[Pré-carga] Buscando estruturas das questões em lote...")
+        structures, errors = _preload_structures(database, integration_ids)
+    for integration_id in integration_ids:
+        if structures.get(integration_id) is None and integration_id not in errors:
+            errors[integration_id] = ValueError(f"estrutura da questão {integration_id} não encontrada no banco")
+    if errors:
+        print(f"[Pré-carga] AVISO: {len(errors)} questões sem estrutura serão registradas como falha: {list(errors)}")
+    print("[Pré-carga] Concluída.\n")
+
+    # Como em belt.run, a questão que falha já na estrutura ganha sua linha de erro na planilha
+    results = {"ok": [], "failed": list(errors)}
+    for integration_id, error in errors.items():
+        belt.write_error(belt.new_state(integration_id), sink, error)
+        on_finish(integration_id, False)
+    integration_ids = [i for i in integration_ids if i not in errors]
+    total = len(integration_ids)
+
+    def _process(position, integration_id):
+        print(f"[{position}/{total}] Iniciando: {integration_id}")
+        belt.run(integration_id, clientMIIA, clientLLM, database, sink, sink_log,
+                 job_poller=job_poller, data=structures.get(integration_id), ledger=ledger, sampling=sampling)
+
+    if args.workers > 1:
+        print(f"[Pipeline] Executando com {args.workers} workers em paralelo.\n")
 
-    with open(IDS_FILE, 'r', encoding='utf-8') as f:
-        integration_ids = [line.strip() for line in f if line.strip()]
+    # Cada questão passa a maior parte do tempo esperando LLM/MIIA, então threads bastam.
+    with ThreadPoolExecutor(max_workers=args.workers) as exc:
+        futures = {
+            exc.submit(_process, i, integration_id): integration_id
+            for i, integration_id in enumerate(integration_ids, start=1)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            integration_id = futures[future]
+            try:
+                future.result()
+                ok = True
+                print(f"[Pipeline] ({done}/{total}) {integration_id} ok")
+            except Exception as e:
+                ok = False
+                print(f"[ERRO] {integration_id} falhou: {e}")
+            results["ok" if ok else "failed"].append(integration_id)
+            on_finish(integration_id, ok)
+    return results
 
+
+def _print_metrics(report):
+    questions = report["questions"]
+    if questions["per_minute"] is not None:
+        print(f"[Métricas] {report['duration_s']:.1f}s no total — {questions['per_minute']:.2f} questões/min")
+    faults = report["faults"]
+    print(f"[Métricas] {faults['retries']['total']} novas tentativas, {faults['failures']['total']} falhas definitivas, "
+          f"{questions['partial']} questões com resultado parcial")
+    hedging = report["hedging"]
+    if hedging["sent"] or hedging["fallbacks"]:
+        win_rate = f" ({hedging['win_rate']:.0%} venceram)" if hedging["win_rate"] is not None else ""
+        print(f"[Métricas] LLM: {hedging['sent']} cópias por hedging{win_rate}, "
+              f"{hedging['fallbacks']} chamadas no modelo reserva")
+    for name, s in report["spans"].items():
+        print(f"  {name:<24} n={s['count']:<6} p50={s['p50_s']:.2f}s  p95={s['p95_s']:.2f}s  p99={s['p99_s']:.2f}s")
+    for name, value in report["counters"].items():
+        print(f"  {name:<24} {value}")
+
+
+def _prepare(args, integration_ids, database, clientLLM, history, ledger):
+    """
+    Seleção incremental (opcional) e pré-validação dos vínculos de um lote de IDs.
+    Retorna (IDs a processar, estruturas já carregadas ou None, IDs pulados).
+    """
+    structures = None
+    skipped = []
+    if args.incremental:
+        selected, structures = _select_incremental(integration_ids, database, clientLLM, history, args.max_age)
+        skipped = [i for i in integration_ids if i not in structures]
+        integration_ids = selected
+        if not integration_ids:
+            print("[Pipeline] Nada a fazer — nenhuma questão mudou desde a última validação.")
+            return [], structures, skipped
+
+    # Alguma questão ainda vai gerar respostas: o import do litellm (alguns segundos) corre em
+    # segundo plano enquanto a pré-validação e a pré-carga das estruturas consultam o banco
+    if {str(i) for i in integration_ids} - ledger.stage_ids("answers"):
+        liteLLM.preload()
+
+    print("[Pré-validação] Verificando vínculos em tenant_question...")
+    pre_validation_errors = []
+    link_status = database.ensure_tenant_questions(integration_ids)
+    for integration_id, result in link_status.items():
+        if result is None:
+            pre_validation_errors.append(integration_id)
+            print(f"[PRÉ-VALIDAÇÃO] AVISO: '{integration_id}' não encontrado na tabela question — será processado mas provavelmente falhará na API.")
+
+    if pre_validation_errors:
+        print(f"[PRÉ-VALIDAÇÃO] {len(pre_validation_errors)} IDs não puderam ser vinculados: {pre_validation_errors}")
+    print("[Pré-validação] Concluída.\n")
+    return integration_ids, structures, skipped
+
+
+def _process(args, integration_ids, clientMIIA, clientLLM, database, sink, sink_log, job_poller, ledger,
+             history, sampling, on_finish=None):
+    """
+    Valida um lote de IDs: seleção incremental (opcional), pré-validação dos vínculos e execução
+    por questão ou em fluxo. Retorna {"ok", "failed", "skipped"}; `on_finish(integration_id, ok)`
+    é chamado a cada questão concluída, sem esperar o lote.
+    """
+    integration_ids, structures, skipped = _prepare(args, integration_ids, database, clientLLM, history, ledger)
     if not integration_ids:
-        print(f"Nenhum integration_id encontrado em {IDS_FILE}. Adicione um ID por linha e tente novamente.")
+        return {"ok": [], "failed": [], "skipped": skipped}
+
+    if args.pipeline:
+        # As estruturas são buscadas em blocos dentro do próprio fluxo, conforme a geração consome
+        # (as já carregadas pela validação incremental não voltam ao banco)
+        flow = pipeline.Pipeline(clientMIIA, clientLLM, database, sink, sink_log, job_poller=job_poller,
+                                 ledger=ledger, sampling=sampling, concurrency=args.stage_workers,
+                                 queue_size=args.queue_size, structures=structures, on_finish=on_finish)
+        results = flow.run(integration_ids, total=len(integration_ids))
+    else:
+        results = _run_per_question(args, integration_ids, clientMIIA, clientLLM, database, sink, sink_log,
+                                    job_poller, ledger, sampling, structures, on_finish)
+    return {**results, "skipped": skipped}
+
+
+def _run_stream(args, batches, clientMIIA, clientLLM, database, sink, sink_log, job_poller, ledger,
+                history, sampling):
+    """
+    Entrada em fluxo (--from-db ou --ids-file -): os IDs chegam em blocos de --batch-size e só um bloco
+    é preparado por vez. No modo --pipeline, os blocos preparados alimentam um único Pipeline sob
+    demanda (sem esvaziar o fluxo entre blocos); no modo padrão, cada bloco é processado inteiro.
+    """
+    if not args.pipeline:
+        results = {"ok": [], "failed": [], "skipped": []}
+        for batch in batches:
+            batch_results = _process(args, batch, clientMIIA, clientLLM, database, sink, sink_log, job_poller,
+                                     ledger, history, sampling)
+            for key in results:
+                results[key].extend(batch_results[key])
+        return results
+
+    flow = pipeline.Pipeline(clientMIIA, clientLLM, database, sink, sink_log, job_poller=job_poller,
+                             ledger=ledger, sampling=sampling, concurrency=args.stage_workers,
+                             queue_size=args.queue_size, structures={})
+    skipped = []
+
+    # Roda na thread de busca do Pipeline, que só pede o próximo bloco quando a fila de geração tem espaço
+    def _prepared_ids():
+        for batch in batches:
+            selected, structures, batch_skipped = _prepare(args, batch, database, clientLLM, history, ledger)
+            skipped.extend(batch_skipped)
+            flow.structures.update(structures or {})
+            yield from selected
+
+    return {**flow.run(_prepared_ids()), "skipped": skipped}
+
+
+def _read_ids(path):
+    """IDs de um arquivo, um por linha, lidos sob demanda; '-' lê da entrada padrão."""
+    if path == "-":
+        yield from (line.strip() for line in sys.stdin if line.strip())
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from (line.strip() for line in f if line.strip())
+
+
+def _id_source(args, database):
+    """Iterável sob demanda dos IDs de entrada: tabela question (--from-db) ou --ids-file."""
+    if args.from_db:
+        filters = {"updated_since": args.updated_since, "question_types": args.question_type, "tenant_id": args.tenant}
+        active = ", ".join(f"{name}={value}" for name, value in filters.items() if value) or "nenhum"
+        print(f"[Entrada] Percorrendo a tabela question em páginas de {args.page_size} (filtros: {active}).")
+        return database.iter_integration_ids(page_size=args.page_size, **filters)
+    return _read_ids(args.ids_file)
+
+
+def _stream_batches(args, source, ledger):
+    """Blocos de --batch-size IDs de `source`; com --resume, sem as questões já concluídas."""
+    finished = ledger.finished_ids() if args.resume else set()
+    for number, batch in enumerate(itertools.batched(source, args.batch_size), start=1):
+        pending = [i for i in batch if i not in finished]
+        print(f"[Entrada] Bloco {number}: {len(batch)} IDs lidos"
+              + (f", {len(batch) - len(pending)} já concluídos pulados" if len(pending) < len(batch) else "") + ".")
+        if pending:
+            yield pending
+
+
+def _enqueue(args):
+    """--enqueue: leva os IDs de --ids-file (ou da tabela question, com --from-db) para a fila do banco."""
+    database = db.Database()
+    work = workqueue.WorkQueue(database)
+    work.ensure_table()
+    inserted = work.enqueue(_id_source(args, database))
+    print(f"[Fila] {inserted} IDs enfileirados em {work.table} (os que já estavam pendentes ou em andamento não se repetem).")
+    print(f"[Fila] Situação: {work.stats()}")
+
+
+def _run_worker(args, database, process):
+    """
+    --worker: reivindica blocos de `--claim-size` IDs da fila e valida cada bloco com `process`. Cada ID é
+    marcado como concluído na fila assim que termina, então um worker que cai no meio do bloco só devolve
+    à fila o que ainda não tinha terminado. Os leases são renovados em segundo plano enquanto o worker trabalha.
+    """
+    work = workqueue.WorkQueue(database)
+    work.ensure_table()
+    failure = "falhou na validação (ver log_erro na planilha)"
+    results = {"ok": [], "failed": [], "skipped": []}
+    print(f"[Worker] {work.worker_id} consumindo {work.table} em blocos de {args.claim_size} "
+          f"(lease de {work.lease_s:.0f}s, até {work.max_attempts} tentativas por item).\n")
+    with work.heartbeat():
+        while True:
+            batch = work.claim(args.claim_size)
+            if not batch:
+                if not args.wait:
+                    break
+                time.sleep(work.poll_interval)
+                continue
+            print(f"[Worker] Bloco reivindicado: {batch}\n")
+            completed = set()
+
+            def _finished(integration_id, ok):
+                # Roda nas threads do pipeline: uma falha do banco aqui não pode derrubá-las. O ID fica
+                # fora de `completed` e é concluído de novo no fim do bloco (ou volta à fila com o lease)
+                try:
+                    work.complete([integration_id], ok=ok, error=None if ok else failure)
+                except Exception as e:
+                    metrics.incr("queue.complete_failures")
+                    print(f"[Worker] Não foi possível marcar {integration_id} na fila ({e}); nova tentativa no fim do bloco.")
+                    return
+                completed.add(integration_id)
+
+            batch_results = process(batch, on_finish=_finished)
+            # Os que não passaram pelo callback (pulados pela validação incremental, falhas antes de rodar)
+            # ou cuja conclusão falhou; se falhar de novo, o lease vence e o item volta para a fila
+            try:
+                work.complete([i for i in batch_results["ok"] + batch_results["skipped"] if i not in completed], ok=True)
+                work.complete([i for i in batch_results["failed"] if i not in completed], ok=False, error=failure)
+            except Exception as e:
+                metrics.incr("queue.complete_failures")
+                print(f"[Worker] Não foi possível concluir o bloco na fila ({e}); os itens voltam com o lease vencido.")
+            for key in results:
+                results[key].extend(batch_results[key])
+    print(f"[Worker] Fila vazia. Situação: {work.stats()}")
+    return results
+
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    metrics.REGISTRY.reset()
+
+    if args.enqueue:
+        _enqueue(args)
         return
 
-    print(f"[Pipeline] {len(integration_ids)} questões na fila: {integration_ids}\n")
+    # --from-db e --ids-file - são lidos em fluxo, bloco a bloco; um arquivo comum é lido inteiro, como antes
+    streaming = not args.worker and (args.from_db or args.ids_file == "-")
+    integration_ids = None
+    if not args.worker and not streaming:
+        integration_ids = list(_read_ids(args.ids_file))
+
+        if not integration_ids:
+            print(f"Nenhum integration_id encontrado em {args.ids_file}. Adicione um ID por linha e tente novamente.")
+            return
+
+    ledger = store.RunLedger(resume=args.resume)
+    if args.resume and integration_ids is not None:
+        finished = ledger.finished_ids()
+        skipped = [i for i in integration_ids if i in finished]
+        integration_ids = [i for i in integration_ids if i not in finished]
+        print(f"[Pipeline] Retomando execução #{ledger.run_id}: {len(skipped)} questões já concluídas serão puladas.")
+        if not integration_ids:
+            print("[Pipeline] Nada a fazer — todas as questões já foram concluídas.")
+            return
+
+    if integration_ids is not None:
+        print(f"[Pipeline] {len(integration_ids)} questões na fila: {integration_ids}\n")
+
+    # O litellm só é importado quando alguma questão vai gerar respostas (ver _prepare), e a planilha
+    # só é aberta no primeiro envio (ver sheet.SheetManager)
 
     id_sheet     = os.environ.get("GOOGLE_SHEET_ID")
     tab_name     = os.environ.get("GOOGLE_SHEET_TAB")
@@ -27,40 +526,84 @@ def main():
     path_google_json = './auth_google.json'
 
     clientMIIA = miia_api.MIIA_API()
-    clientLLM = liteLLM.LiteLLMClient()
+    clientLLM = liteLLM.LiteLLMClient(use_cache=args.llm_cache, refresh_cache=args.refresh_llm_cache,
+                                      generation_mode=args.generation_mode, hedge=args.hedge)
     database = db.Database()
-    sheets     = sheet.SheetManager(path_google_json, id_sheet, tab_name)
-    sheets_log = sheet.SheetManager(path_google_json, id_sheet, tab_log_name)
+    history = store.ValidationHistory()
+    job_poller = poller.JobPoller(clientMIIA)
+    sheet_options = {}
+    if args.buffer_sheets and not args.no_store:
+        # Com o store, o SheetSyncer já envia em lote (insert_lines); um buffer por baixo dele só
+        # marcaria como sincronizadas linhas que ainda estão em memória
+        print("[Planilha] AVISO: --buffer-sheets só tem efeito com --no-store; "
+              "o armazenamento local já envia as linhas em lote.")
+    elif args.buffer_sheets:
+        sheet_options = {
+            "buffered": True,
+            "flush_size": int(os.environ.get("SHEET_FLUSH_SIZE", "50")),
+            "flush_interval": float(os.environ.get("SHEET_FLUSH_INTERVAL", "10")),
+        }
+    sheets     = sheet.SheetManager(path_google_json, id_sheet, tab_name, **sheet_options)
+    sheets_log = sheets.open_tab(tab_log_name, **sheet_options)
+
+    # Resultados vão primeiro para o store local; o syncer leva para a planilha em segundo plano
+    result_store = None
+    syncer = None
+    sink, sink_log = sheets, sheets_log
+    if not args.no_store:
+        result_store = store.ResultStore()
+        syncer = store.SheetSyncer(result_store, {tab_name: sheets, tab_log_name: sheets_log}).start()
+        sink, sink_log = result_store.sink(tab_name), result_store.sink(tab_log_name)
 
     print("[Sucesso] Todos os conectores instanciados!\n")
 
-    print("[Pré-validação] Verificando vínculos em tenant_question...")
-    pre_validation_errors = []
-    for integration_id in integration_ids:
-        result = database.ensure_tenant_question(integration_id)
-        if result is None:
-            pre_validation_errors.append(integration_id)
-            print(f"[PRÉ-VALIDAÇÃO] AVISO: '{integration_id}' não encontrado na tabela question — será processado mas provavelmente falhará na API.")
+    sampling = None
+    if args.adaptive:
+        sampling = {"min_reps": args.min_reps, "max_reps": args.max_reps, "margin": args.adaptive_margin}
+        print(f"[Pipeline] Amostragem adaptativa: {args.min_reps}–{args.max_reps} correções por tipo de resposta.\n")
+    if args.pipeline:
+        stages = ", ".join(f"{stage}={n}" for stage, n in args.stage_workers.items())
+        print(f"[Pipeline] Modo em fluxo — threads por etapa: {stages}\n")
 
-    if pre_validation_errors:
-        print(f"[PRÉ-VALIDAÇÃO] {len(pre_validation_errors)} IDs não puderam ser vinculados: {pre_validation_errors}")
-    print("[Pré-validação] Concluída.\n")
+    def process(ids, on_finish=None):
+        return _process(args, ids, clientMIIA, clientLLM, database, sink, sink_log, job_poller, ledger,
+                        history, sampling, on_finish)
 
-    results = {"ok": [], "failed": []}
+    # Um único poller acompanha os jobs de todos os lotes; fecha só no fim da execução
+    with job_poller:
+        if args.worker:
+            results = _run_worker(args, database, process)
+        elif streaming:
+            batches = _stream_batches(args, _id_source(args, database), ledger)
+            results = _run_stream(args, batches, clientMIIA, clientLLM, database, sink, sink_log, job_poller,
+                                  ledger, history, sampling)
+        else:
+            results = process(integration_ids)
 
-    for i, integration_id in enumerate(integration_ids, start=1):
-        print(f"[{i}/{len(integration_ids)}] Iniciando: {integration_id}")
-        try:
-            belt.run(integration_id, clientMIIA, clientLLM, database, sheets, sheets_log)
-            results["ok"].append(integration_id)
-        except Exception as e:
-            print(f"[ERRO] {integration_id} falhou: {e}")
-            results["failed"].append(integration_id)
+    if syncer is not None:
+        syncer.close()
+        result_store.close()
+    sheets.close()
+    sheets_log.close()
+    clientLLM.close()
+    _record_history(history, ledger, results["failed"])
+    history.close()
+    ledger.close()
 
     print(f"\n{'='*60}")
-    print(f"[Pipeline] Concluído — {len(results['ok'])} ok, {len(results['failed'])} com erro")
+    print(f"[Pipeline] Concluído — {len(results['ok'])} ok, {len(results['failed'])} com erro"
+          + (f", {len(results['skipped'])} inalteradas puladas" if results["skipped"] else ""))
     if results["failed"]:
         print(f"[Pipeline] Falharam: {results['failed']}")
+    if clientLLM.cache is not None:
+        stats = clientLLM.cache_stats()
+        print(f"[Pipeline] Cache do LLM — {stats['hits']} acertos, {stats['misses']} gerações novas")
+
+    metrics.incr("questions.ok", len(results["ok"]))
+    metrics.incr("questions.failed", len(results["failed"]))
+    report = metrics.REGISTRY.write_report(args.metrics_report)
+    _print_metrics(report)
+    print(f"[Métricas] Relatório gravado em {args.metrics_report}.json e {args.metrics_report}.prom")
 
 
 if __name__ == "__main__":
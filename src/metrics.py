@@ -0,0 +1,169 @@
+import os
+import json
+import math
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+REPORT_BASE = os.path.join(os.path.dirname(__file__), '..', 'run_metrics')
+PROM_PREFIX = "miia_validator"
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _percentile(ordered, q):
+    """Percentil por posição mais próxima sobre uma lista já ordenada."""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class Metrics:
+    """
+    Coletor de métricas da execução, compartilhado por todas as threads.
+    Spans medem a duração de cada etapa e chamada externa (nome -> lista de durações);
+    contadores acumulam eventos (polls, retries, falhas...).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._started = time.monotonic()
+            self.spans = {}
+            self.counters = {}
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.spans.setdefault(name, []).append(seconds)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, name):
+        """Mede o bloco; se ele lançar exceção, a duração entra igual e conta `<name>.errors`."""
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException:
+            self.incr(f"{name}.errors")
+            raise
+        finally:
+            self.observe(name, time.monotonic() - start)
+
+    def timed(self, name):
+        """Decorator equivalente a `with span(name)` em volta da função."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def report(self):
+        with self._lock:
+            spans = {name: sorted(values) for name, values in self.spans.items()}
+            counters = dict(self.counters)
+            elapsed = time.monotonic() - self._started
+
+        questions_ok = counters.get("questions.ok", 0)
+        questions_failed = counters.get("questions.failed", 0)
+        done = questions_ok + questions_failed
+        # Resumo dos contadores de resiliência: `*.retries`/`*_retries` e `*.failures`/`*_failures`
+        faults = {
+            kind: {name: value for name, value in sorted(counters.items()) if name.endswith(kind)}
+            for kind in ("retries", "failures")
+        }
+        # Hedging do LLM: cópias disparadas e quem venceu a corrida (ver liteLLM.LiteLLMClient)
+        hedges = counters.get("llm.hedge.sent", 0)
+        hedge_wins = counters.get("llm.hedge.wins", 0)
+        return {
+            "started_at": self.started_at,
+            "duration_s": elapsed,
+            "questions": {
+                "ok": questions_ok,
+                "failed": questions_failed,
+                "partial": counters.get("questions.partial", 0),
+                "per_minute": done / elapsed * 60 if elapsed > 0 else None,
+                "seconds_per_question": elapsed / done if done else None,
+            },
+            "spans": {
+                name: {
+                    "count": len(values),
+                    "total_s": sum(values),
+                    "mean_s": sum(values) / len(values),
+                    **{f"p{int(q * 100)}_s": _percentile(values, q) for q in QUANTILES},
+                    "max_s": values[-1],
+                }
+                for name, values in sorted(spans.items())
+            },
+            "counters": dict(sorted(counters.items())),
+            "faults": {kind: {"total": sum(values.values()), **values} for kind, values in faults.items()},
+            "hedging": {
+                "sent": hedges,
+                "hedge_wins": hedge_wins,
+                "primary_wins": counters.get("llm.hedge.primary_wins", 0),
+                "win_rate": hedge_wins / hedges if hedges else None,
+                "fallbacks": counters.get("llm.fallbacks", 0),
+            },
+        }
+
+    def write_json(self, path, report=None):
+        report = report or self.report()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    def write_prometheus(self, path, report=None):
+        """Formato textfile do node_exporter: summaries por span + contadores."""
+        report = report or self.report()
+        p = PROM_PREFIX
+        lines = [
+            f"# HELP {p}_span_seconds Duração das etapas e chamadas externas.",
+            f"# TYPE {p}_span_seconds summary",
+        ]
+        for name, s in report["spans"].items():
+            for q in QUANTILES:
+                lines.append(f'{p}_span_seconds{{span="{name}",quantile="{q}"}} {s[f"p{int(q * 100)}_s"]:.6f}')
+            lines.append(f'{p}_span_seconds_sum{{span="{name}"}} {s["total_s"]:.6f}')
+            lines.append(f'{p}_span_seconds_count{{span="{name}"}} {s["count"]}')
+
+        lines += [f"# HELP {p}_events_total Eventos contados na execução.", f"# TYPE {p}_events_total counter"]
+        for name, value in report["counters"].items():
+            lines.append(f'{p}_events_total{{event="{name}"}} {value}')
+
+        questions = report["questions"]
+        lines += [
+            f"# TYPE {p}_run_duration_seconds gauge",
+            f"{p}_run_duration_seconds {report['duration_s']:.3f}",
+            f"# TYPE {p}_questions_per_minute gauge",
+            f"{p}_questions_per_minute {questions['per_minute'] or 0:.3f}",
+            f"# TYPE {p}_run_started_timestamp_seconds gauge",
+            f"{p}_run_started_timestamp_seconds {report['started_at']:.0f}",
+        ]
+        # Escrita atômica: o node_exporter nunca lê um arquivo pela metade
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def write_report(self, base=None):
+        """Grava <base>.json e <base>.prom. Retorna o relatório."""
+        base = base or os.environ.get("METRICS_REPORT_PATH", REPORT_BASE)
+        report = self.report()
+        self.write_json(f"{base}.json", report)
+        self.write_prometheus(f"{base}.prom", report)
+        return report
+
+
+# Instância única do processo: os módulos registram nela sem precisar receber o coletor
+REGISTRY = Metrics()
+span = REGISTRY.span
+timed = REGISTRY.timed
+observe = REGISTRY.observe
+incr = REGISTRY.incr
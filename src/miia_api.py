@@ -2,89 +2,328 @@ import os
 import json
 import time
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+import ratelimit
+import metrics
+
+
+class MIIAError(Exception):
+    """Falha definitiva numa chamada à MIIA, depois de esgotadas as novas tentativas."""
+
+    def __init__(self, message, integration_id=None, status=None, attempts=1):
+        super().__init__(message)
+        self.integration_id = integration_id
+        self.status = status
+        self.attempts = attempts
+
+
+class SubmitError(MIIAError):
+    """O POST assess não criou o job: a submissão pode ser descartada sem derrubar o lote."""
+
+
+def _status_of(error):
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_transient(error, network_errors=(requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+    """Vale tentar de novo: conexão caiu, timeout ou status 408/5xx. Os demais 4xx não mudam com nova tentativa."""
+    return isinstance(error, network_errors) or _status_of(error) in ratelimit.TRANSIENT_STATUSES
+
+
+def is_unsent(error, connect_errors=(requests.exceptions.ConnectTimeout,)):
+    """
+    O POST não chegou a sair: a conexão nem abriu (recusada, DNS, timeout de conexão). Só então uma
+    submissão é repetida: depois de timeout de leitura, queda no meio ou 5xx a MIIA pode já ter criado
+    o job, e a API não documenta deduplicação de POSTs.
+    """
+    if isinstance(error, connect_errors):
+        return True
+    # requests embrulha a recusa/falha de DNS em ConnectionError(MaxRetryError(reason=NewConnectionError))
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    return isinstance(getattr(error.args[0], "reason", None), urllib3.exceptions.NewConnectionError)
 
 
 class MIIA_API:
 
-    def __init__(self):
+    POLL_MAX_TRY = 60
+    POLL_INTERVAL_S = 3
+    THROTTLE_RETRIES = 5  # quantas vezes uma chamada que recebeu 429 é refeita
+
+    def __init__(self, pool_size=None):
         self.base_url = os.environ.get("BASE_URL")
         self.token = os.environ.get("MIIA_API_TOKEN")
         if not self.base_url or not self.token:
             raise ValueError("ERROR: BASE_URL or MIIA_API_TOKEN missing from .env.")
 
-    def create_job(self, integration_id, answer):
-        url_post = f"{self.base_url}/textual-corrections/v1/discursive/{integration_id}/assess"
-        headers = {
+        self.pool_size = pool_size or int(os.environ.get("MIIA_POOL_SIZE", "20"))
+        self.headers = {
             "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json"
         }
-        print(f"1. Sending POST to create Job...")
+
+        # Sessão compartilhada: conexões keep-alive reaproveitadas entre jobs e threads
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._async_client = None
+
+        # Vazão compartilhada por todas as threads (submissões e polling): MIIA_RATE_LIMIT req/s (padrão
+        # sem limite, como no LLM: um teto fixo estrangula o polling de lotes grandes), MIIA_MAX_IN_FLIGHT
+        # chamadas simultâneas, pausa em 429 e circuit breaker (MIIA_BREAKER_*)
+        self.throttle = ratelimit.Throttle.from_env("MIIA", "MIIA", max_in_flight=self.pool_size)
+
+        # Falhas transitórias (rede, 408, 5xx): até MIIA_MAX_RETRIES novas tentativas por chamada,
+        # com backoff exponencial e jitter entre MIIA_RETRY_BACKOFF e MIIA_RETRY_BACKOFF_MAX segundos.
+        # No POST assess, só quando a conexão nem abriu (ver is_unsent)
+        self.max_retries = int(os.environ.get("MIIA_MAX_RETRIES", "4"))
+        self.backoff_base = float(os.environ.get("MIIA_RETRY_BACKOFF", "1"))
+        self.backoff_max = float(os.environ.get("MIIA_RETRY_BACKOFF_MAX", "30"))
+
+    def _assess_url(self, integration_id):
+        return f"{self.base_url}/textual-corrections/v1/discursive/{integration_id}/assess"
+
+    def _job_url(self, job_id):
+        return f"{self.base_url}/textual-corrections/v1/jobs/{job_id}"
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, method, url, **kwargs):
+        """Requisição passando pelo throttle; respostas 429 são refeitas depois do Retry-After."""
+        for attempt in range(self.THROTTLE_RETRIES + 1):
+            self.throttle.acquire()
+            response = error = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                error = e
+                raise
+            finally:
+                throttled = self.throttle.release(response=response, error=error)
+            if not throttled:
+                break
+            metrics.incr("miia.retries")
+        return response
+
+    def backoff(self, attempt):
+        return ratelimit.backoff_delay(attempt, self.backoff_base, self.backoff_max)
+
+    def _submit_failed(self, integration_id, error, attempts):
+        """Conta a falha definitiva de uma submissão e monta o SubmitError correspondente."""
+        metrics.incr("miia.submit_failures")
+        print(f"[{integration_id}] POST request failed after {attempts} attempt(s): {error}")
+        response = getattr(error, "response", None)
+        if response is not None:
+            print(response.text)
+        return SubmitError(f"POST assess falhou após {attempts} tentativa(s): {error}",
+                           integration_id, status=_status_of(error), attempts=attempts)
+
+    def create_job(self, integration_id, answer):
+        """
+        Cria um job de correção e retorna o job_id. Só falhas em abrir a conexão são repetidas (com
+        backoff): um POST que pode ter chegado à MIIA não é reenviado, para não criar job duplicado.
+        Lança SubmitError quando desiste.
+        """
+        url_post = self._assess_url(integration_id)
+        print(f"1. [{integration_id}] Sending POST to create Job...")
         if isinstance(answer, str):
             answer = json.loads(answer, strict=False)
-        try:
-            response_post = requests.post(url_post, headers=headers, json=answer)
-            response_post.raise_for_status()
-            data_post = response_post.json()
 
-            job_id = data_post.get("job_id")
-            if not job_id:
-                raise ValueError("API did not return a valid job_id.")
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.span("miia.create_job"):
+                    response_post = self._request("POST", url_post, json=answer)
+                response_post.raise_for_status()
+                job_id = response_post.json().get("job_id")
+            except requests.exceptions.RequestException as e:
+                if attempt < self.max_retries and is_unsent(e):
+                    wait = self.backoff(attempt)
+                    metrics.incr("miia.submit_retries")
+                    print(f"[{integration_id}] POST falhou ({e}) — tentativa {attempt + 2}/{self.max_retries + 1} em {wait:.1f}s")
+                    time.sleep(wait)
+                    continue
+                raise self._submit_failed(integration_id, e, attempt + 1) from e
 
-            print(f"   [Success] Job created: {job_id}")
+            if not job_id:
+                raise self._submit_failed(integration_id, "API did not return a valid job_id.", attempt + 1)
+            print(f"   [{integration_id}] [Success] Job created: {job_id}")
             return job_id
 
-        except requests.exceptions.RequestException as e:
-            print(f"POST request failed: {e}")
-            if e.response is not None:
-                print(e.response.text)
-            exit(1)
+
+    def fetch_status(self, job_id):
+        """Single GET on the job endpoint. Raises requests exceptions on network/HTTP errors."""
+        metrics.incr("miia.polls")
+        response_get = self._request("GET", self._job_url(job_id))
+        response_get.raise_for_status()
+        return response_get.json()
 
 
     def check_status(self, job_id, verbose=True):
-        url_get = f"{self.base_url}/textual-corrections/v1/jobs/{job_id}"
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Content-Type": "application/json"
-        }
         if verbose:
             print(f"\n2. Starting Job status check (Polling)...")
 
-        max_try = 60
-        interval_s = 3
+        max_try = self.POLL_MAX_TRY
+        interval_s = self.POLL_INTERVAL_S
 
+        errors = 0  # falhas consecutivas do GET
         for attempt in range(1, max_try + 1):
             try:
-                response_get = requests.get(url_get, headers=headers)
-                response_get.raise_for_status()
-
-                data_get = response_get.json()
-                current_status = data_get.get("status")
-
-                if current_status == "running":
-                    if verbose:
-                        print(f"   [{attempt}/{max_try}] Status: running. Waiting {interval_s}s...")
-                    time.sleep(interval_s)
+                data_get = self.fetch_status(job_id)
+            except requests.exceptions.RequestException as e:
+                if errors < self.max_retries and is_transient(e):
+                    wait = self.backoff(errors)
+                    errors += 1
+                    metrics.incr("miia.poll_retries")
+                    print(f"   Job {job_id}: GET falhou ({e}) — nova tentativa em {wait:.1f}s")
+                    time.sleep(wait)
                     continue
+                metrics.incr("miia.poll_failures")
+                print(f"\nNetwork failure during GET for job {job_id}: {e}")
+                break
+            errors = 0
+            current_status = data_get.get("status")
 
-                elif current_status == "completed" or current_status == "success":
-                    if verbose:
-                        print("\n[Success] Processing completed!")
-                        print("-" * 40)
-                        print(data_get)
-                        print("-" * 40)
-                    return data_get
+            if current_status == "running":
+                if verbose:
+                    print(f"   [{attempt}/{max_try}] Status: running. Waiting {interval_s}s...")
+                time.sleep(interval_s)
+                continue
 
-                elif current_status == "failed" or current_status == "error":
-                    print(f"\n[Backend Error] Job {job_id} failed: {data_get}")
-                    break
+            elif current_status == "completed" or current_status == "success":
+                if verbose:
+                    print("\n[Success] Processing completed!")
+                    print("-" * 40)
+                    print(data_get)
+                    print("-" * 40)
+                return data_get
 
-                else:
-                    print(f"\n[Warning] Job {job_id} unknown status: '{current_status}'. Response: {data_get}")
-                    break
+            elif current_status == "failed" or current_status == "error":
+                print(f"\n[Backend Error] Job {job_id} failed: {data_get}")
+                break
 
-            except requests.exceptions.RequestException as e:
-                print(f"\nNetwork failure during GET for job {job_id}: {e}")
+            else:
+                print(f"\n[Warning] Job {job_id} unknown status: '{current_status}'. Response: {data_get}")
                 break
         else:
             print(f"\n[Timeout] Job {job_id} não completou em {max_try * interval_s}s.")
+
+    # --- Variante assíncrona: um único event loop conduz centenas de jobs em paralelo ---
+
+    def _get_async_client(self):
+        # httpx é importado sob demanda para não pesar no modo síncrono
+        import httpx
+
+        if self._async_client is None:
+            limits = httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+            )
+            self._async_client = httpx.AsyncClient(headers=self.headers, limits=limits, timeout=30)
+        return self._async_client
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    async def _request_async(self, method, url, **kwargs):
+        import httpx
+
+        client = self._get_async_client()
+        for attempt in range(self.THROTTLE_RETRIES + 1):
+            await self.throttle.acquire_async()
+            response = error = None
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.HTTPError as e:
+                error = e
+                raise
+            finally:
+                throttled = self.throttle.release(response=response, error=error)
+            if not throttled:
+                break
+            metrics.incr("miia.retries")
+        return response
+
+    async def create_job_async(self, integration_id, answer):
+        """Mesmo contrato de create_job: retorna o job_id ou lança SubmitError."""
+        import asyncio
+        import httpx
+
+        print(f"1. [{integration_id}] Sending POST to create Job (async)...")
+        if isinstance(answer, str):
+            answer = json.loads(answer, strict=False)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.span("miia.create_job"):
+                    response_post = await self._request_async("POST", self._assess_url(integration_id), json=answer)
+                response_post.raise_for_status()
+                job_id = response_post.json().get("job_id")
+            except (httpx.HTTPError, json.JSONDecodeError) as e:
+                if attempt < self.max_retries and is_unsent(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    wait = self.backoff(attempt)
+                    metrics.incr("miia.submit_retries")
+                    print(f"[{integration_id}] POST falhou ({e}) — tentativa {attempt + 2}/{self.max_retries + 1} em {wait:.1f}s")
+                    await asyncio.sleep(wait)
+                    continue
+                raise self._submit_failed(integration_id, e, attempt + 1) from e
+
+            if not job_id:
+                raise self._submit_failed(integration_id, "API did not return a valid job_id.", attempt + 1)
+            print(f"   [{integration_id}] [Success] Job created: {job_id}")
+            return job_id
+
+    async def check_status_async(self, job_id, verbose=True):
+        import asyncio
+        import httpx
+
+        max_try = self.POLL_MAX_TRY
+        interval_s = self.POLL_INTERVAL_S
+
+        errors = 0  # falhas consecutivas do GET
+        for attempt in range(1, max_try + 1):
+            try:
+                metrics.incr("miia.polls")
+                response_get = await self._request_async("GET", self._job_url(job_id))
+                response_get.raise_for_status()
+                data_get = response_get.json()
+            except httpx.HTTPError as e:
+                if errors < self.max_retries and is_transient(e, (httpx.TransportError,)):
+                    wait = self.backoff(errors)
+                    errors += 1
+                    metrics.incr("miia.poll_retries")
+                    print(f"   Job {job_id}: GET falhou ({e}) — nova tentativa em {wait:.1f}s")
+                    await asyncio.sleep(wait)
+                    continue
+                metrics.incr("miia.poll_failures")
+                print(f"\nNetwork failure during GET for job {job_id}: {e}")
+                return None
+            errors = 0
+            current_status = data_get.get("status")
+
+            if current_status == "running":
+                if verbose:
+                    print(f"   [{attempt}/{max_try}] Job {job_id} status: running. Waiting {interval_s}s...")
+                await asyncio.sleep(interval_s)
+                continue
+
+            elif current_status == "completed" or current_status == "success":
+                return data_get
+
+            elif current_status == "failed" or current_status == "error":
+                print(f"\n[Backend Error] Job {job_id} failed: {data_get}")
+                return None
+
+            else:
+                print(f"\n[Warning] Job {job_id} unknown status: '{current_status}'. Response: {data_get}")
+                return None
+
+        print(f"\n[Timeout] Job {job_id} não completou em {max_try * interval_s}s.")
+        return None
@@ -0,0 +1,186 @@
+import queue
+import time
+import threading
+import metrics
+import belt
+
+# Threads por etapa. A coleta passa quase todo o tempo esperando a MIIA, então comporta
+# muitas questões em paralelo; as demais etapas são curtas ou limitadas pela API.
+# A busca no banco é feita por uma única thread, em blocos (ver Pipeline._fetch).
+DEFAULT_CONCURRENCY = {"generate": 4, "submit": 4, "collect": 32, "write": 1}
+STAGES = ("fetch", "generate", "submit", "collect", "write")
+
+_DONE = object()
+
+
+def parse_concurrency(spec):
+    """'generate=4,collect=64' -> dict de concorrência por etapa, partindo do padrão."""
+    concurrency = dict(DEFAULT_CONCURRENCY)
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        stage, _, value = part.partition("=")
+        if stage not in concurrency or not value.isdigit() or int(value) < 1:
+            raise ValueError(f"Concorrência inválida: '{part}' (etapas: {', '.join(DEFAULT_CONCURRENCY)})")
+        concurrency[stage] = int(value)
+    return concurrency
+
+
+class Pipeline:
+    """
+    Executa as etapas de belt em fluxo, com filas limitadas entre elas:
+    estrutura -> geração -> submissão -> coleta -> registro.
+    Enquanto a questão k espera a correção da MIIA, a geração da k+1 já está rodando.
+    As filas cheias bloqueiam a etapa anterior (backpressure), então a memória não cresce
+    com o tamanho da lista de IDs.
+    """
+
+    def __init__(self, clientMIIA, clientLLM, database, sheets, sheets_log=None, job_poller=None,
+                 ledger=None, sampling=None, concurrency=None, queue_size=None, fetch_chunk=50, structures=None,
+                 on_finish=None):
+        self.clientMIIA = clientMIIA
+        self.clientLLM = clientLLM
+        self.database = database
+        self.sheets = sheets
+        self.sheets_log = sheets_log
+        self.job_poller = job_poller
+        self.ledger = ledger
+        self.sampling = sampling
+        self.concurrency = concurrency or dict(DEFAULT_CONCURRENCY)
+        self.queue_size = queue_size
+        self.fetch_chunk = fetch_chunk
+        # Estruturas já carregadas (ex.: pela validação incremental). Cada uma sai do dicionário quando a
+        # questão entra no fluxo, então quem alimenta `integration_ids` sob demanda pode ir acrescentando aqui
+        self.structures = structures if structures is not None else {}
+        self.on_finish = on_finish  # chamado com (integration_id, ok) assim que cada questão termina
+
+        self.results = {"ok": [], "failed": []}
+        self._results_lock = threading.Lock()
+        self._done_count = 0
+
+    def _queue_for(self, stage):
+        # Por padrão, cada fila comporta duas levas da etapa consumidora
+        return queue.Queue(maxsize=self.queue_size or 2 * self.concurrency[stage])
+
+    def run(self, integration_ids, total=None):
+        """Processa `integration_ids` (qualquer iterável, consumido sob demanda). Retorna {"ok", "failed"}."""
+        self.total = total
+        queues = {stage: self._queue_for(stage) for stage in STAGES[1:]}
+
+        steps = {
+            "generate": (lambda st: belt.stage_generate(st, self.clientLLM, self.ledger), "submit"),
+            "submit":   (lambda st: belt.stage_submit(st, self.clientMIIA, self.ledger, self.sampling), "collect"),
+            "collect":  (lambda st: belt.stage_collect(st, self.clientMIIA, self.job_poller, self.ledger, self.sampling), "write"),
+        }
+
+        threads = [threading.Thread(target=self._fetch, args=(integration_ids, queues), name="stage-fetch")]
+        for stage, (fn, next_stage) in steps.items():
+            threads += self._workers(stage, queues[stage], fn, queues[next_stage], queues["write"])
+        threads += self._workers("write", queues["write"], None, None, None)
+
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.results
+
+    def _workers(self, stage, in_q, fn, out_q, error_q):
+        n = self.concurrency[stage]
+        remaining = [n]
+        lock = threading.Lock()
+
+        def _work():
+            while True:
+                state = in_q.get()
+                if state is _DONE:
+                    break
+                if fn is None:
+                    self._finish(state)
+                    continue
+                try:
+                    fn(state)
+                except Exception as e:
+                    # Falhas pulam direto para o registro, que grava a linha parcial
+                    state["error"] = e
+                    error_q.put(state)
+                    continue
+                out_q.put(state)
+
+            # O último worker da etapa avisa a próxima que não há mais nada
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and out_q is not None:
+                for _ in range(self.concurrency[STAGES[STAGES.index(stage) + 1]]):
+                    out_q.put(_DONE)
+
+        return [threading.Thread(target=_work, name=f"stage-{stage}-{i}") for i in range(n)]
+
+    def _fetch(self, integration_ids, queues):
+        """Busca as estruturas em blocos (uma query por bloco) conforme a fila de geração esvazia."""
+        out_q = queues["generate"]
+        chunk = []
+
+        def _flush(chunk):
+            try:
+                preloaded = {i: self.structures.pop(i, None) for i in dict.fromkeys(chunk)}
+                to_fetch = [i for i in chunk if preloaded[i] is None]
+                fetched = dict(self.database.get_question_structures(to_fetch)) if to_fetch else {}
+                structures = [(i, preloaded[i] or fetched.get(i)) for i in chunk]
+            except Exception as e:
+                print(f"[Pipeline] Falha ao buscar estruturas de {len(chunk)} questões: {e}")
+                for integration_id in chunk:
+                    state = belt.new_state(integration_id)
+                    state["error"] = e
+                    queues["write"].put(state)
+                return
+
+            for integration_id, data in structures:
+                state = belt.new_state(integration_id, data, self.ledger)
+                if data is None:
+                    state["error"] = ValueError(f"estrutura da questão {integration_id} não encontrada no banco")
+                    queues["write"].put(state)
+                    continue
+                try:
+                    belt.stage_structure(state, self.database, self.ledger)
+                except Exception as e:
+                    state["error"] = e
+                    queues["write"].put(state)
+                    continue
+                print(f"[Pipeline] {integration_id} entrou na fila de geração.")
+                out_q.put(state)
+
+        try:
+            for integration_id in integration_ids:
+                chunk.append(integration_id)
+                if len(chunk) >= self.fetch_chunk:
+                    _flush(chunk)
+                    chunk = []
+            if chunk:
+                _flush(chunk)
+        finally:
+            for _ in range(self.concurrency["generate"]):
+                out_q.put(_DONE)
+
+    def _finish(self, state):
+        integration_id = state["integration_id"]
+        error = state.get("error")
+        if error is None:
+            try:
+                belt.stage_write(state, self.sheets, self.sheets_log, self.ledger)
+            except Exception as e:
+                error = e
+        if error is not None:
+            belt.write_error(state, self.sheets, error)
+        metrics.observe("question", time.monotonic() - state["started_at"])
+
+        with self._results_lock:
+            self._done_count += 1
+            self.results["failed" if error is not None else "ok"].append(integration_id)
+            done = self._done_count
+        progress = f"{done}/{self.total}" if self.total else str(done)
+        print(f"[Pipeline] ({progress}) {integration_id} {'ok' if error is None else 'falhou'}")
+        if self.on_finish is not None:
+            # A etapa de escrita tem poucas threads: se uma morrer, as filas enchem e o fluxo trava
+            try:
+                self.on_finish(integration_id, error is None)
+            except Exception as e:
+                print(f"[Pipeline] on_finish falhou para {integration_id}: {e}")
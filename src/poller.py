@@ -0,0 +1,152 @@
+import os
+import time
+import threading
+import requests
+import metrics
+import miia_api
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class JobPoller:
+    """
+    Poller único para todos os jobs em aberto (de uma ou várias questões).
+    A cada rodada faz um GET por job pendente e resolve o Future do job assim que ele termina.
+    O resultado segue o contrato de MIIA_API.check_status: o JSON do job ou None em falha/timeout.
+    Um GET com falha transitória (rede, 408, 5xx) não encerra o job: ele fica fora das rodadas
+    pelo backoff do cliente e volta a ser consultado, até `client.max_retries` falhas seguidas.
+    """
+
+    def __init__(self, client, interval_s=None, max_try=None, workers=None):
+        self.client = client
+        self.interval_s = interval_s or client.POLL_INTERVAL_S
+        self.max_try = max_try or client.POLL_MAX_TRY
+        self.workers = workers or int(os.environ.get("MIIA_POLL_WORKERS", "8"))
+
+        self._pending = {}  # job_id -> {"futures": [...], "attempts": int, "errors": int, "retry_at": float}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+        self._executor = None
+
+    def submit(self, job_id):
+        """Registra um job para acompanhamento e retorna um Future com o resultado."""
+        future = Future()
+        if not job_id:
+            future.set_result(None)
+            return future
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("JobPoller já foi encerrado.")
+            entry = self._pending.setdefault(job_id, {"futures": [], "attempts": 0, "errors": 0, "retry_at": 0.0,
+                                                      "submitted_at": time.monotonic()})
+            entry["futures"].append(future)
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="poller")
+                self._thread = threading.Thread(target=self._loop, name="job-poller", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return future
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending.items())
+            self._pending.clear()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._executor.shutdown(wait=True)
+        for job_id, entry in pending:
+            self._resolve(entry, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _resolve(self, entry, result):
+        metrics.observe("miia.poll_until_done", time.monotonic() - entry["submitted_at"])
+        for future in entry["futures"]:
+            if not future.done():
+                future.set_result(result)
+
+    def _poll_one(self, job_id):
+        """Um GET; retorna (terminou, resultado, erro transitório ou None)."""
+        try:
+            data_get = self.client.fetch_status(job_id)
+        except requests.exceptions.RequestException as e:
+            if miia_api.is_transient(e):
+                return False, None, e
+            metrics.incr("miia.poll_failures")
+            print(f"\nNetwork failure during GET for job {job_id}: {e}")
+            return True, None, None
+
+        current_status = data_get.get("status")
+        if current_status == "running":
+            return False, None, None
+        elif current_status == "completed" or current_status == "success":
+            return True, data_get, None
+        elif current_status == "failed" or current_status == "error":
+            metrics.incr("miia.job_failures")
+            print(f"\n[Backend Error] Job {job_id} failed: {data_get}")
+            return True, None, None
+        else:
+            print(f"\n[Warning] Job {job_id} unknown status: '{current_status}'. Response: {data_get}")
+            return True, None, None
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+                waiting = bool(self._pending)
+                now = time.monotonic()
+                job_ids = [job_id for job_id, entry in self._pending.items() if entry["retry_at"] <= now]
+
+            if not waiting:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            round_start = time.monotonic()
+            outcomes = list(zip(job_ids, self._executor.map(self._poll_one, job_ids)))
+
+            with self._lock:
+                for job_id, (finished, result, error) in outcomes:
+                    entry = self._pending.get(job_id)
+                    if entry is None:
+                        continue
+                    if error is not None:
+                        if entry["errors"] < self.client.max_retries:
+                            wait = self.client.backoff(entry["errors"])
+                            entry["errors"] += 1
+                            entry["retry_at"] = time.monotonic() + wait
+                            metrics.incr("miia.poll_retries")
+                            print(f"   Job {job_id}: GET falhou ({error}) — nova tentativa em {wait:.1f}s")
+                            continue
+                        metrics.incr("miia.poll_failures")
+                        print(f"\nNetwork failure during GET for job {job_id}: {error}")
+                        finished = True
+                    else:
+                        entry["errors"] = 0
+                    entry["attempts"] += 1
+                    if not finished and entry["attempts"] >= self.max_try:
+                        metrics.incr("miia.poll_timeouts")
+                        print(f"\n[Timeout] Job {job_id} não completou em {self.max_try * self.interval_s}s.")
+                        finished = True
+                    if finished:
+                        del self._pending[job_id]
+                        self._resolve(entry, result)
+
+            # Próxima rodada só depois do intervalo; jobs novos entram na rodada seguinte
+            elapsed = time.monotonic() - round_start
+            self._wakeup.clear()
+            if elapsed < self.interval_s:
+                time.sleep(self.interval_s - elapsed)
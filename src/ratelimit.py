@@ -0,0 +1,202 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# Status que valem nova tentativa: timeout do servidor e falhas do lado dele. 429 é tratado pelo Throttle.
+TRANSIENT_STATUSES = frozenset({408, 500, 502, 503, 504})
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """Espera antes da tentativa `attempt + 1`: backoff exponencial com jitter completo, em [0, min(cap, base·2^attempt)]."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after_seconds(headers, default=None):
+    """Valor do cabeçalho Retry-After em segundos (aceita segundos ou data HTTP)."""
+    value = (headers or {}).get("Retry-After") or (headers or {}).get("retry-after")
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class CircuitBreaker:
+    """
+    Abre quando a fração de falhas nas últimas `window` chamadas passa de `threshold`
+    (com pelo menos `min_calls` chamadas). Aberto, segura novas chamadas por `cooldown` segundos;
+    depois deixa passar uma chamada de teste (meio-aberto): sucesso fecha, falha reabre.
+    """
+
+    def __init__(self, name, window=20, threshold=0.5, min_calls=10, cooldown=30):
+        self.name = name
+        self.window = window
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._probing = False
+
+    # Os métodos abaixo são chamados pelo Throttle com o lock dele já adquirido
+
+    def wait_time(self, now):
+        """0 se a chamada pode seguir; senão, quantos segundos esperar."""
+        if self._opened_at is None:
+            return 0
+        remaining = self._opened_at + self.cooldown - now
+        if remaining > 0:
+            return remaining
+        if self._probing:
+            return min(1.0, self.cooldown)
+        self._probing = True
+        return 0
+
+    def record(self, ok, now):
+        """`ok` None = desfecho inconclusivo (ex.: 429): não conta, mas libera a chamada de teste."""
+        if ok is None:
+            self._probing = False
+            return
+        if self._opened_at is not None:
+            if not self._probing:
+                return  # chamada que já estava em voo quando o circuito abriu
+            self._probing = False
+            if ok:
+                print(f"[{self.name}] Circuit breaker fechado — serviço respondeu normalmente.")
+                self._opened_at = None
+                self._outcomes.clear()
+            else:
+                self._opened_at = now
+            return
+
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.threshold:
+            print(f"[{self.name}] Circuit breaker aberto: {failures}/{len(self._outcomes)} falhas recentes — "
+                  f"pausando chamadas por {self.cooldown}s.")
+            self._opened_at = now
+
+
+class Throttle:
+    """
+    Controle de vazão compartilhado por todas as threads que chamam um serviço:
+    token bucket (`rate` chamadas/s, rajada de até `burst`), limite de chamadas em voo,
+    pausa global em respostas 429 (Retry-After) e circuit breaker.
+
+    Uso:
+        throttle.acquire()            # ou await throttle.acquire_async()
+        try:
+            response = ...
+        finally:
+            throttle.release(response=response, error=error)
+    """
+
+    def __init__(self, name, rate=None, burst=None, max_in_flight=None, breaker=None):
+        self.name = name
+        self.rate = rate or None
+        self.burst = burst or max(1.0, self.rate or 1.0)
+        self.max_in_flight = max_in_flight or None
+        self.breaker = breaker
+
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._paused_until = 0.0
+
+    @classmethod
+    def from_env(cls, prefix, name, rate=None, max_in_flight=None):
+        """Lê <PREFIX>_RATE_LIMIT, <PREFIX>_MAX_IN_FLIGHT e <PREFIX>_BREAKER_* do ambiente."""
+        env = os.environ.get
+        breaker = None
+        if env(f"{prefix}_BREAKER", "1") != "0":
+            breaker = CircuitBreaker(
+                name,
+                window=int(env(f"{prefix}_BREAKER_WINDOW", "20")),
+                threshold=float(env(f"{prefix}_BREAKER_THRESHOLD", "0.5")),
+                min_calls=int(env(f"{prefix}_BREAKER_MIN_CALLS", "10")),
+                cooldown=float(env(f"{prefix}_BREAKER_COOLDOWN", "30")),
+            )
+        return cls(
+            name,
+            rate=float(env(f"{prefix}_RATE_LIMIT", str(rate or 0))),
+            burst=float(env(f"{prefix}_RATE_BURST", "0")),
+            max_in_flight=int(env(f"{prefix}_MAX_IN_FLIGHT", str(max_in_flight or 0))),
+            breaker=breaker,
+        )
+
+    def _try_acquire(self):
+        """Com o lock: reserva a chamada e retorna None, ou retorna quantos segundos esperar."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.max_in_flight and self._in_flight >= self.max_in_flight:
+            return 1.0  # release() acorda quem estiver esperando
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.rate
+        # O breaker vem por último: no estado meio-aberto, liberar a chamada de teste a compromete
+        if self.breaker is not None:
+            wait = self.breaker.wait_time(now)
+            if wait:
+                return wait
+        if self.rate:
+            self._tokens -= 1
+        self._in_flight += 1
+        return None
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._try_acquire()
+                if wait is None:
+                    return
+                self._cond.wait(wait)
+
+    async def acquire_async(self):
+        import asyncio
+
+        while True:
+            with self._cond:
+                wait = self._try_acquire()
+            if wait is None:
+                return
+            await asyncio.sleep(min(wait, 0.1) if self.max_in_flight else wait)
+
+    def release(self, response=None, error=None):
+        """
+        Libera a vaga em voo e registra o desfecho: erro de rede, timeout ou 5xx conta como falha no breaker;
+        429 pausa todas as chamadas pelo Retry-After (ou 1s) sem contar como falha.
+        Retorna True quando a resposta foi 429 e a chamada deve ser refeita.
+        """
+        if response is None and error is not None:
+            response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(error, "status_code", None)
+        throttled = status == 429
+
+        with self._cond:
+            now = time.monotonic()
+            self._in_flight -= 1
+            if throttled:
+                pause = retry_after_seconds(getattr(response, "headers", None), default=1.0)
+                if now + pause > self._paused_until:
+                    print(f"[{self.name}] 429 recebido — pausando chamadas por {pause:.1f}s.")
+                    self._paused_until = now + pause
+            if self.breaker is not None:
+                if throttled:
+                    self.breaker.record(None, now)
+                else:
+                    failed = (error is not None and status is None) or (status is not None and (status >= 500 or status == 408))
+                    self.breaker.record(not failed, now)
+            self._cond.notify_all()
+        return throttled
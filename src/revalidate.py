@@ -0,0 +1,300 @@
+"""
+Revalidação offline: recalcula todos os critérios pass_* a partir das avaliações já coletadas
+(aba esteira_log), sem chamar a MIIA de novo. As notas viram matrizes questões × repetições
+(NaN onde não há nota) e cada critério do Validator é avaliado de uma vez com operações NumPy.
+
+Uso:
+    python src/revalidate.py --from-store                     # results.sqlite3 do projeto (ou RESULTS_STORE_PATH)
+    python src/revalidate.py --from-csv esteira_log.csv       # export da aba
+    python src/revalidate.py --from-sheet                     # lê a aba direto da planilha
+    python src/revalidate.py --from-store --min-score-ratio 0.30 --var-floor 1.0 -o novo.csv
+"""
+import os
+import csv
+import json
+import argparse
+import sqlite3
+import warnings
+import numpy as np
+from dotenv import load_dotenv
+
+import store
+import validator
+
+REPORT_PATH = os.path.join(os.path.dirname(__file__), '..', 'revalidation_report.csv')
+TIERS = ("ruim", "med", "max")
+REPS = validator.Validator.ROW_REPS  # colunas por tipo de resposta na esteira_log
+PASS_COLUMNS = ("pass_bolo", "pass_ruim_var", "pass_med_var", "pass_max_var",
+                "pass_min_score", "pass_med_score", "pass_max_score")
+
+
+# --- Carga das avaliações ---
+
+def _parse_assessment(cell):
+    if not cell:
+        return None
+    try:
+        return json.loads(cell) if isinstance(cell, str) else cell
+    except json.JSONDecodeError:
+        return None
+
+
+def _log_row_to_record(values):
+    """Linha da esteira_log: [integration_id, bolo, ruim1..3, med1..3, max1..3] (JSONs das avaliações)."""
+    width = 1 + len(TIERS) * REPS
+    if not values or not values[0] or values[0] == "integration_id":
+        return None
+    assessments = [_parse_assessment(cell) for cell in values[1:]]
+    if not any(assessments):
+        return None  # cabeçalho do export ou questão sem nenhuma avaliação
+    assessments += [None] * (width - len(assessments))
+    record = {"integration_id": str(values[0]), "bolo": assessments[0]}
+    for i, tier in enumerate(TIERS):
+        record[tier] = assessments[1 + i * REPS:1 + (i + 1) * REPS]
+    return record
+
+
+def load_from_store(path, tab):
+    # Só leitura: um caminho errado dá erro em vez de criar um banco vazio e não revalidar nada
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        for (row_json,) in conn.execute("SELECT row_json FROM sheet_rows WHERE tab = ? ORDER BY id", (tab,)):
+            yield json.loads(row_json)
+    finally:
+        conn.close()
+
+
+def load_from_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.reader(f)
+
+
+def load_from_sheet(tab):
+    import sheet
+    manager = sheet.SheetManager('./auth_google.json', os.environ.get("GOOGLE_SHEET_ID"), tab)
+    yield from manager.aba.get_all_values()
+
+
+def build_matrices(rows):
+    """
+    Converte as linhas em arrays: bolo (Q,), notas por tipo (Q, R) e max_score (Q,).
+    Quando a mesma questão aparece várias vezes, vale a linha mais recente.
+    """
+    latest = {}
+    for values in rows:
+        record = _log_row_to_record(values)
+        if record is not None:
+            latest.pop(record["integration_id"], None)
+            latest[record["integration_id"]] = record
+
+    def _score(a, key="score"):
+        try:
+            return float(a["result"][key])
+        except (TypeError, KeyError, ValueError):
+            return np.nan
+
+    records = list(latest.values())
+    ids = [r["integration_id"] for r in records]
+    bolo = np.array([_score(r["bolo"]) for r in records], dtype=float)
+    scores = {
+        # Forma explícita: uma fonte vazia (ou só com cabeçalho) vira matrizes (0, REPS), não um erro no reshape
+        tier: np.array([[_score(a) for a in r[tier]] for r in records], dtype=float).reshape(len(records), REPS)
+        for tier in TIERS
+    }
+    # Mesma referência de belt.extract_scores: avaliação do bolo, senão a última máxima
+    max_score = np.array([
+        _score(r["bolo"] or r["max"][-1], "max_score") if (r["bolo"] or r["max"][-1]) else np.nan
+        for r in records
+    ], dtype=float)
+    return ids, bolo, scores, max_score
+
+
+# --- Critérios vetorizados (mesma semântica de validator.Validator; NaN = None) ---
+
+def _tristate(result, defined):
+    out = np.where(result, 1.0, 0.0)
+    out[~defined] = np.nan
+    return out
+
+
+def _count_mean(scores):
+    count = np.sum(~np.isnan(scores), axis=1)
+    total = np.nansum(scores, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+    return count, mean
+
+
+def pass_bolo(bolo):
+    return _tristate(bolo == 0, ~np.isnan(bolo))
+
+
+def pass_var(v, scores, max_score):
+    count, mean = _count_mean(scores)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.sqrt(np.nansum((scores - mean[:, None]) ** 2, axis=1) / (count - 1))
+    threshold = np.maximum(v.VAR_RATIO * max_score, v.VAR_FLOOR)
+    defined = (count >= 2) & ~np.isnan(max_score) & (max_score != 0)
+    return _tristate(std < threshold, defined)
+
+
+def pass_min_score(v, scores, max_score):
+    count, mean = _count_mean(scores)
+    defined = (count > 0) & ~np.isnan(max_score) & (max_score != 0)
+    return _tristate(mean < v.MIN_SCORE_RATIO * max_score, defined)
+
+
+def pass_max_score(v, scores, max_score):
+    count, mean = _count_mean(scores)
+    defined = (count > 0) & ~np.isnan(max_score) & (max_score != 0)
+    return _tristate(mean > v.MAX_SCORE_RATIO * max_score, defined)
+
+
+def pass_med_score(v, scores, max_score):
+    count, mean = _count_mean(scores)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(scores, axis=1)
+    lo, hi = v.MED_SCORE_LO * max_score, v.MED_SCORE_HI * max_score
+    valid = ~np.isnan(scores)
+    all_max = np.all(~valid | (scores == max_score[:, None]), axis=1)
+    any_in_band = np.any(valid & (scores >= lo[:, None]) & (scores <= hi[:, None]), axis=1)
+    result = (all_max
+              | ((lo <= mean) & (mean <= hi))
+              | ((lo <= median) & (median <= hi))
+              | any_in_band)
+    defined = (count > 0) & ~np.isnan(max_score) & (max_score != 0)
+    return _tristate(result, defined)
+
+
+def evaluate(v, bolo, scores, max_score):
+    return {
+        "pass_bolo":      pass_bolo(bolo),
+        "pass_ruim_var":  pass_var(v, scores["ruim"], max_score),
+        "pass_med_var":   pass_var(v, scores["med"], max_score),
+        "pass_max_var":   pass_var(v, scores["max"], max_score),
+        "pass_min_score": pass_min_score(v, scores["ruim"], max_score),
+        "pass_med_score": pass_med_score(v, scores["med"], max_score),
+        "pass_max_score": pass_max_score(v, scores["max"], max_score),
+    }
+
+
+def check_against_validator(v, bolo, scores, max_score, results, sample=100, seed=0):
+    """
+    Confere o resultado vetorizado com validator.Validator, questão a questão, numa amostra de `sample`
+    linhas (0 = todas). Retorna a lista de divergências (índice, critério, vetorizado, Validator).
+    """
+    def _values(row):
+        return [None if np.isnan(x) else float(x) for x in row]
+
+    def _scalar(x):
+        return None if np.isnan(x) else float(x)
+
+    total = len(bolo)
+    rows = range(total)
+    if sample and sample < total:
+        rows = sorted(np.random.default_rng(seed).choice(total, size=sample, replace=False))
+
+    mismatches = []
+    for q in rows:
+        ms = _scalar(max_score[q])
+        ruim, med, top = (_values(scores[tier][q]) for tier in TIERS)
+        expected = {
+            "pass_bolo":      v.pass_bolo(_scalar(bolo[q])),
+            "pass_ruim_var":  v.pass_var(ruim, ms),
+            "pass_med_var":   v.pass_var(med, ms),
+            "pass_max_var":   v.pass_var(top, ms),
+            "pass_min_score": v.pass_min_score(ruim, ms),
+            "pass_med_score": v.pass_med_score(med, ms),
+            "pass_max_score": v.pass_max_score(top, ms),
+        }
+        for column, want in expected.items():
+            got = _flag(results[column][q])
+            if (got if got != "" else None) != want:
+                mismatches.append((int(q), column, got, want))
+    return mismatches
+
+
+# --- Relatório ---
+
+def _cell(x):
+    return "" if np.isnan(x) else x
+
+
+def _flag(x):
+    return "" if np.isnan(x) else bool(x)
+
+
+def write_report(path, ids, bolo, scores, max_score, results):
+    reps = scores["ruim"].shape[1]
+    header = (["integration_id", "Receita de Bolo"]
+              + [f"{tier.capitalize()} {i}" for tier in TIERS for i in range(1, reps + 1)]
+              + ["Max Score", *PASS_COLUMNS, "all_pass"])
+    all_pass = np.all(np.stack([results[c] for c in PASS_COLUMNS]) == 1.0, axis=0)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for q, integration_id in enumerate(ids):
+            writer.writerow(
+                [integration_id, _cell(bolo[q])]
+                + [_cell(x) for tier in TIERS for x in scores[tier][q]]
+                + [_cell(max_score[q])]
+                + [_flag(results[c][q]) for c in PASS_COLUMNS]
+                + [bool(all_pass[q])]
+            )
+    return int(all_pass.sum())
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--from-store", nargs="?", const=os.environ.get("RESULTS_STORE_PATH", store.STORE_PATH),
+                        metavar="SQLITE", help="Lê a esteira_log gravada no armazenamento local.")
+    source.add_argument("--from-csv", metavar="CSV", help="Lê um export CSV da aba esteira_log.")
+    source.add_argument("--from-sheet", action="store_true", help="Lê a aba esteira_log direto da planilha.")
+    parser.add_argument("--tab", default=os.environ.get("GOOGLE_SHEET_TAB_LOG", "esteira_log"))
+    parser.add_argument("-o", "--output", default=REPORT_PATH)
+    parser.add_argument("--check-sample", type=int, default=100,
+                        help="Questões sorteadas para conferir o cálculo vetorizado com o Validator (0 = todas).")
+    # Limiares a testar; o padrão é o do Validator atual
+    for name in ("VAR_RATIO", "VAR_FLOOR", "MIN_SCORE_RATIO", "MED_SCORE_LO", "MED_SCORE_HI", "MAX_SCORE_RATIO"):
+        parser.add_argument(f"--{name.lower().replace('_', '-')}", type=float, default=getattr(validator.Validator, name))
+    args = parser.parse_args(argv)
+
+    v = validator.Validator()
+    for name in ("VAR_RATIO", "VAR_FLOOR", "MIN_SCORE_RATIO", "MED_SCORE_LO", "MED_SCORE_HI", "MAX_SCORE_RATIO"):
+        setattr(v, name, getattr(args, name.lower()))
+
+    if args.from_store:
+        if not os.path.exists(args.from_store):
+            parser.error(f"armazenamento local não encontrado: {args.from_store} (ajuste RESULTS_STORE_PATH ou informe o caminho)")
+        rows = load_from_store(args.from_store, args.tab)
+    elif args.from_csv:
+        rows = load_from_csv(args.from_csv)
+    else:
+        rows = load_from_sheet(args.tab)
+
+    ids, bolo, scores, max_score = build_matrices(rows)
+    if not ids:
+        print("[Revalidação] Nenhuma avaliação encontrada na fonte informada.")
+        return
+
+    results = evaluate(v, bolo, scores, max_score)
+    mismatches = check_against_validator(v, bolo, scores, max_score, results, sample=args.check_sample)
+    if mismatches:
+        print(f"[Revalidação] AVISO: {len(mismatches)} divergências entre o cálculo vetorizado e o Validator:")
+        for q, column, got, want in mismatches[:20]:
+            print(f"  {ids[q]} {column}: vetorizado={got!r} Validator={want!r}")
+    passed = write_report(args.output, ids, bolo, scores, max_score, results)
+
+    print(f"[Revalidação] {len(ids)} questões reavaliadas — {passed} aprovadas em todos os critérios.")
+    for column in PASS_COLUMNS:
+        col = results[column]
+        print(f"  {column:<16} True: {int(np.sum(col == 1.0)):>6}  False: {int(np.sum(col == 0.0)):>6}  "
+              f"None: {int(np.sum(np.isnan(col))):>6}")
+    print(f"[Revalidação] Relatório gravado em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
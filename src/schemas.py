@@ -0,0 +1,51 @@
+import json
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+
+class AnswerItem(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    answer: str = Field(min_length=1)
+
+    @field_validator("answer")
+    @classmethod
+    def _not_blank(cls, value):
+        if not value.strip():
+            raise ValueError("resposta em branco")
+        return value
+
+
+class AnswerPayload(BaseModel):
+    """Corpo enviado ao endpoint assess da MIIA: {"content": [{"answer": "..."}]}."""
+    model_config = ConfigDict(extra="ignore")
+
+    content: list[AnswerItem] = Field(min_length=1)
+
+
+def _strip_fences(text):
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").strip()
+        if text.lower().startswith("json"):
+            text = text[4:]
+    return text.strip()
+
+
+def parse_answer(raw):
+    """
+    Valida a saída do LLM para um tipo de resposta.
+    Retorna (payload normalizado em JSON, None) ou (None, motivo da rejeição).
+    """
+    if raw is None:
+        return None, "LLM não retornou conteúdo"
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(_strip_fences(raw), strict=False)
+        except json.JSONDecodeError as e:
+            return None, f"JSON inválido: {e}"
+    try:
+        payload = AnswerPayload.model_validate(raw)
+    except ValidationError as e:
+        reasons = "; ".join(f"{'.'.join(str(p) for p in err['loc']) or 'raiz'}: {err['msg']}" for err in e.errors())
+        return None, f"fora do schema: {reasons}"
+    return payload.model_dump_json(), None
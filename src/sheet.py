@@ -1,9 +1,16 @@
-import gspread
-from google.oauth2.service_account import Credentials
+import atexit
+import threading
+import metrics
 
 class SheetManager:
-    
-    def __init__(self, json_path, sheet_id, tab_name):
+    """
+    Uma aba da planilha de resultados. A autorização, a planilha e a aba só são abertas no primeiro
+    envio: execuções que gravam no store local (ou que terminam antes) não pagam o import do
+    gspread/google-auth nem as chamadas de abertura na partida.
+    """
+
+    def __init__(self, json_path, sheet_id, tab_name, planilha=None,
+                 buffered=False, flush_size=50, flush_interval=10, parent=None):
         self.caminho_json = json_path
         self.id_planilha = sheet_id
         self.nome_aba = tab_name
@@ -11,12 +18,116 @@ class SheetManager:
             "https://www.googleapis.com/auth/spreadsheets",
             "https://www.googleapis.com/auth/drive"
         ]
-        self.credenciais = Credentials.from_service_account_file(self.caminho_json, scopes=self.scopes)
-        self.cliente = gspread.authorize(self.credenciais)
-        self.planilha = self.cliente.open_by_key(self.id_planilha)
-        self.aba = self.planilha.worksheet(self.nome_aba)              
+        self._planilha = planilha
+        self._aba = None
+        self._parent = parent  # open_tab: a planilha (e o cliente autorizado) vêm da aba de origem
+        self._open_lock = threading.Lock()
+
+        # Modo bufferizado: linhas acumuladas e enviadas com um único append_rows
+        self.buffered = buffered
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._flusher = None
+        if self.buffered:
+            self._flusher = threading.Thread(target=self._flush_periodically, name=f"sheet-flush-{tab_name}", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+
+    @property
+    def planilha(self):
+        with self._open_lock:
+            if self._planilha is None:
+                if self._parent is not None:
+                    self._planilha = self._parent.planilha
+                else:
+                    import gspread
+                    from google.oauth2.service_account import Credentials
+
+                    self.credenciais = Credentials.from_service_account_file(self.caminho_json, scopes=self.scopes)
+                    self.cliente = gspread.authorize(self.credenciais)
+                    self._planilha = self.cliente.open_by_key(self.id_planilha)
+            return self._planilha
+
+
+    @property
+    def aba(self):
+        if self._aba is None:
+            planilha = self.planilha
+            with self._open_lock:
+                if self._aba is None:
+                    self._aba = planilha.worksheet(self.nome_aba)
+        return self._aba
+
+
+    def open_tab(self, tab_name, **kwargs):
+        """Outra aba da mesma planilha, reaproveitando o cliente já autorizado."""
+        return SheetManager(self.caminho_json, self.id_planilha, tab_name, planilha=self._planilha, parent=self, **kwargs)
 
 
     def insert_line(self, values):
         sanitized = [v if v is not None else "" for v in values]
-        self.aba.append_row(sanitized)
\ No newline at end of file
+        if not self.buffered:
+            with metrics.span("sheet.append_row"):
+                self.aba.append_row(sanitized)
+            return
+
+        with self._lock:
+            self._buffer.append(sanitized)
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            # O envio acontece na thread de flush; quem chamou segue sem esperar a API
+            self._wake.set()
+
+
+    def insert_lines(self, rows):
+        """Envia várias linhas numa única chamada à API, sem passar pelo buffer."""
+        sanitized = [[v if v is not None else "" for v in values] for values in rows]
+        if sanitized:
+            with metrics.span("sheet.append_rows"):
+                self.aba.append_rows(sanitized)
+
+
+    def flush(self):
+        # _flush_lock serializa os envios; _lock só protege o buffer, então quem chama
+        # insert_line não fica esperando a API do Sheets
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return
+            try:
+                with metrics.span("sheet.append_rows"):
+                    self.aba.append_rows(rows)
+            except Exception:
+                # Devolve as linhas ao buffer para a próxima tentativa
+                with self._lock:
+                    self._buffer = rows + self._buffer
+                raise
+        print(f"[Planilha] {len(rows)} linhas enviadas para a aba {self.nome_aba}.")
+
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        if self.buffered:
+            self.flush()
+
+
+    def _flush_periodically(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[Planilha] Falha ao enviar buffer da aba {self.nome_aba}, nova tentativa em {self.flush_interval}s: {e}")
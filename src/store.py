@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+STORE_PATH = os.path.join(os.path.dirname(__file__), '..', 'results.sqlite3')
+
+
+class ResultStore:
+    """
+    Armazenamento local e durável dos resultados (SQLite em modo WAL).
+    Cada linha destinada a uma aba da planilha é gravada aqui primeiro, com synced_at NULL,
+    e só é marcada como sincronizada depois que o SheetSyncer a envia com sucesso.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("RESULTS_STORE_PATH", STORE_PATH)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS sheet_rows (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tab TEXT NOT NULL,
+                row_json TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                synced_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sheet_rows_pending ON sheet_rows (tab, id) WHERE synced_at IS NULL")
+
+    def add_row(self, tab, values):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO sheet_rows (tab, row_json, created_at) VALUES (?, ?, ?)",
+                (tab, json.dumps(list(values), ensure_ascii=False), time.time()),
+            )
+
+    def pending(self, tab, limit=100):
+        """Linhas ainda não enviadas para a aba, na ordem de gravação: [(id, valores), ...]."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, row_json FROM sheet_rows WHERE tab = ? AND synced_at IS NULL ORDER BY id LIMIT ?",
+                (tab, limit),
+            ).fetchall()
+        return [(row_id, json.loads(row_json)) for row_id, row_json in rows]
+
+    def pending_count(self, tab=None):
+        query = "SELECT COUNT(*) FROM sheet_rows WHERE synced_at IS NULL"
+        params = ()
+        if tab is not None:
+            query += " AND tab = ?"
+            params = (tab,)
+        with self._lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+    def mark_synced(self, row_ids):
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE sheet_rows SET synced_at = ? WHERE id = ?",
+                [(time.time(), row_id) for row_id in row_ids],
+            )
+
+    def mark_failed(self, row_ids, error):
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE sheet_rows SET attempts = attempts + 1, last_error = ? WHERE id = ?",
+                [(str(error), row_id) for row_id in row_ids],
+            )
+
+    def sink(self, tab):
+        """Objeto com a mesma interface de SheetManager.insert_line, gravando no store."""
+        return StoreSink(self, tab)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class StoreSink:
+
+    def __init__(self, store, tab):
+        self.store = store
+        self.nome_aba = tab
+
+    def insert_line(self, values):
+        self.store.add_row(self.nome_aba, values)
+
+
+class SheetSyncer:
+    """
+    Envia em segundo plano as linhas pendentes do ResultStore para as abas da planilha.
+    Falhas (cota, indisponibilidade) não perdem nada: as linhas continuam pendentes e são
+    reenviadas com backoff até darem certo, inclusive em uma execução posterior.
+    """
+
+    def __init__(self, store, sheets_by_tab, interval=5, batch_size=100, max_backoff=300):
+        self.store = store
+        self.sheets_by_tab = sheets_by_tab
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="sheet-syncer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def sync_once(self):
+        """Uma passada por todas as abas. Retorna quantas linhas foram enviadas."""
+        sent = 0
+        for tab, sheet_manager in self.sheets_by_tab.items():
+            while True:
+                batch = self.store.pending(tab, self.batch_size)
+                if not batch:
+                    break
+                row_ids = [row_id for row_id, _ in batch]
+                try:
+                    sheet_manager.insert_lines([values for _, values in batch])
+                except Exception as e:
+                    self.store.mark_failed(row_ids, e)
+                    raise
+                self.store.mark_synced(row_ids)
+                sent += len(batch)
+        if sent:
+            print(f"[Sync] {sent} linhas sincronizadas com a planilha.")
+        return sent
+
+    def pending_count(self):
+        return sum(self.store.pending_count(tab) for tab in self.sheets_by_tab)
+
+    def _loop(self):
+        backoff = self.interval
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+                backoff = self.interval
+            except Exception as e:
+                backoff = min(backoff * 2, self.max_backoff)
+                print(f"[Sync] Falha ao enviar para a planilha, nova tentativa em {backoff}s: {e}")
+            self._stop.wait(backoff)
+
+    def close(self, timeout=60):
+        """Para a thread e tenta uma última sincronização; o que sobrar fica para a próxima execução."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        deadline = time.monotonic() + timeout
+        while self.pending_count() and time.monotonic() < deadline:
+            try:
+                self.sync_once()
+            except Exception as e:
+                print(f"[Sync] Falha na sincronização final: {e}")
+                time.sleep(min(self.interval, max(0, deadline - time.monotonic())))
+        remaining = self.pending_count()
+        if remaining:
+            print(f"[Sync] {remaining} linhas continuam pendentes em {self.store.path}; serão enviadas na próxima execução.")
+
+
+class RunLedger:
+    """
+    Registro por execução das etapas concluídas de cada questão, no mesmo arquivo SQLite
+    do ResultStore. Etapas: structure, answers, jobs (com os job_ids), assessments, row.
+    """
+
+    STAGES = ("structure", "answers", "jobs", "assessments", "row")
+
+    def __init__(self, resume=False, path=None):
+        self.path = path or os.environ.get("RESULTS_STORE_PATH", STORE_PATH)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS run_stages (
+                run_id INTEGER NOT NULL,
+                integration_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                payload_json TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (run_id, integration_id, stage)
+            )
+        """)
+        # resume=True continua a execução mais recente que chegou a registrar alguma etapa (uma que caiu
+        # ainda na inicialização não tem o que retomar); senão, ou se não houver nenhuma, abre uma nova
+        run_id = None
+        if resume:
+            run_id = self.conn.execute("SELECT MAX(run_id) FROM run_stages").fetchone()[0]
+        if run_id is None:
+            run_id = self.conn.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),)).lastrowid
+        self.run_id = run_id
+
+    def record(self, integration_id, stage, payload=None):
+        if stage not in self.STAGES:
+            raise ValueError(f"Etapa desconhecida: {stage}")
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO run_stages (run_id, integration_id, stage, payload_json, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.run_id, str(integration_id), stage,
+                 json.dumps(payload, ensure_ascii=False) if payload is not None else None, time.time()),
+            )
+
+    def load(self, integration_id):
+        """{etapa: payload} das etapas já concluídas pela questão nesta execução."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT stage, payload_json FROM run_stages WHERE run_id = ? AND integration_id = ?",
+                (self.run_id, str(integration_id)),
+            ).fetchall()
+        return {stage: json.loads(payload) if payload is not None else None for stage, payload in rows}
+
+    def stage_ids(self, stage):
+        """IDs que já concluíram `stage` nesta execução."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT integration_id FROM run_stages WHERE run_id = ? AND stage = ?",
+                (self.run_id, stage),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def finished_ids(self):
+        return self.stage_ids("row")
+
+    def row_results(self):
+        """{integration_id: payload da etapa row} ({"passed", "fingerprint"}) das questões concluídas nesta execução."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT integration_id, payload_json FROM run_stages WHERE run_id = ? AND stage = 'row'",
+                (self.run_id,),
+            ).fetchall()
+        return {integration_id: json.loads(payload) if payload is not None else {} for integration_id, payload in rows}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class ValidationHistory:
+    """
+    Último resultado de cada questão — impressão digital (belt.question_fingerprint), aprovação e
+    data —, no mesmo arquivo SQLite do ResultStore. É o que a validação incremental (main --incremental)
+    compara para decidir quem precisa rodar de novo.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("RESULTS_STORE_PATH", STORE_PATH)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS validations (
+                integration_id TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                passed INTEGER NOT NULL,
+                validated_at REAL NOT NULL
+            )
+        """)
+
+    def last_results(self, integration_ids, chunk_size=500):
+        """{integration_id: {"fingerprint", "passed", "validated_at"}} das questões que já têm histórico."""
+        integration_ids = [str(i) for i in integration_ids]
+        results = {}
+        with self._lock:
+            for start in range(0, len(integration_ids), chunk_size):
+                chunk = integration_ids[start:start + chunk_size]
+                rows = self.conn.execute(
+                    "SELECT integration_id, fingerprint, passed, validated_at FROM validations "
+                    f"WHERE integration_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for integration_id, fingerprint, passed, validated_at in rows:
+                    results[integration_id] = {"fingerprint": fingerprint, "passed": bool(passed),
+                                               "validated_at": validated_at}
+        return results
+
+    def record_many(self, results):
+        """Grava [(integration_id, fingerprint, passed), ...] com a data de agora."""
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO validations (integration_id, fingerprint, passed, validated_at) VALUES (?, ?, ?, ?)",
+                [(str(integration_id), fingerprint, int(bool(passed)), now) for integration_id, fingerprint, passed in results],
+            )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -4,6 +4,20 @@ from datetime import datetime
 
 class Validator:
 
+    # Versão das regras de validação (faixas abaixo, prompts de geração). Entra na impressão digital
+    # da validação incremental: subir a versão faz todo o banco ser validado de novo.
+    VERSION = "1"
+
+    # Faixas de aprovação (frações de max_score)
+    VAR_RATIO = 0.20        # desvio padrão máximo
+    VAR_FLOOR = 0.5         # piso absoluto do desvio padrão, para questões de escala pequena
+    MIN_SCORE_RATIO = 0.35  # média das ruins abaixo disso
+    MED_SCORE_LO = 0.25     # faixa aceita para as médias
+    MED_SCORE_HI = 0.85
+    MAX_SCORE_RATIO = 0.80  # média das máximas acima disso
+    ROW_REPS = 3            # colunas por tipo de resposta na planilha
+    ADAPTIVE_MARGIN = 0.20  # amostragem adaptativa: notas novas supostas até ±20% de max_score das já vistas
+
     def _safe_mean(self, scores):
         valid = [s for s in scores if s is not None]
         return statistics.mean(valid) if valid else None
@@ -19,6 +33,10 @@ class Validator:
         return statistics.stdev(valid) if len(valid) >= 2 else None
 
 
+    def _var_threshold(self, max_score):
+        return max(self.VAR_RATIO * max_score, self.VAR_FLOOR)
+
+
     def pass_bolo(self, bolo_score):
         if bolo_score is None:
             return None
@@ -32,7 +50,7 @@ class Validator:
         std = self._safe_stdev(scores)
         if std is None:
             return None
-        return std < max(0.20 * max_score, 0.5)
+        return std < self._var_threshold(max_score)
 
 
     def pass_min_score(self, ruim_scores, max_score):
@@ -40,7 +58,7 @@ class Validator:
         mean = self._safe_mean(ruim_scores)
         if mean is None or not max_score:
             return None
-        return mean < 0.35 * max_score
+        return mean < self.MIN_SCORE_RATIO * max_score
 
 
     def pass_med_score(self, med_scores, max_score):
@@ -55,7 +73,7 @@ class Validator:
         # Escape hatch: all samples hit max_score — structurally no median space exists
         if all(s == max_score for s in valid):
             return True
-        lo, hi = 0.25 * max_score, 0.85 * max_score
+        lo, hi = self.MED_SCORE_LO * max_score, self.MED_SCORE_HI * max_score
         mean = self._safe_mean(med_scores)
         if mean is not None and lo <= mean <= hi:
             return True
@@ -72,7 +90,90 @@ class Validator:
         mean = self._safe_mean(max_scores)
         if mean is None or not max_score:
             return None
-        return mean > 0.80 * max_score
+        return mean > self.MAX_SCORE_RATIO * max_score
+
+
+    # --- Amostragem adaptativa: o resultado de um critério ainda pode mudar com mais `remaining` notas? ---
+
+    def _plausible_range(self, valid, max_score, margin):
+        """Faixa em que as próximas notas devem cair: as já vistas ± margin * max_score, dentro de [0, max_score]."""
+        if not valid:
+            return 0, max_score
+        return max(0, min(valid) - margin * max_score), min(max_score, max(valid) + margin * max_score)
+
+
+    def _mean_bounds(self, valid, remaining, low, high):
+        """Menor e maior média possíveis acrescentando `remaining` notas em [low, high]."""
+        n = len(valid) + remaining
+        total = sum(valid)
+        return (total + remaining * low) / n, (total + remaining * high) / n
+
+
+    def _stdev_bounds(self, valid, remaining, low, high):
+        """Menor e maior desvio padrão possíveis acrescentando `remaining` notas em [low, high]."""
+        # Mínimo: novas notas iguais à média atual. Máximo: novas notas nos extremos da faixa.
+        lowest = statistics.stdev(valid + [statistics.mean(valid)] * remaining)
+        highest = max(
+            statistics.stdev(valid + [low] * j + [high] * (remaining - j))
+            for j in range(remaining + 1)
+        )
+        return lowest, highest
+
+
+    def is_decided(self, check, scores, max_score, remaining, margin=None):
+        """
+        True se o critério `check` ('var', 'min_score', 'med_score', 'max_score') não pode mais mudar
+        de resultado com até `remaining` notas adicionais dentro da faixa plausível.
+        margin=1 considera qualquer nota em [0, max_score] (decisão estrita, pior caso).
+        """
+        if remaining <= 0:
+            return True
+        if not max_score:
+            return False
+        margin = self.ADAPTIVE_MARGIN if margin is None else margin
+        valid = [s for s in scores if s is not None]
+        low, high = self._plausible_range(valid, max_score, margin)
+
+        if check == "var":
+            if len(valid) + remaining < 2:
+                return True
+            if len(valid) < 2:
+                return False
+            threshold = self._var_threshold(max_score)
+            lowest, highest = self._stdev_bounds(valid, remaining, low, high)
+            return (highest < threshold) or (lowest >= threshold)
+
+        if check == "min_score":
+            if not valid:
+                return False
+            lowest, highest = self._mean_bounds(valid, remaining, low, high)
+            threshold = self.MIN_SCORE_RATIO * max_score
+            return (highest < threshold) or (lowest >= threshold)
+
+        if check == "max_score":
+            if not valid:
+                return False
+            lowest, highest = self._mean_bounds(valid, remaining, low, high)
+            threshold = self.MAX_SCORE_RATIO * max_score
+            return (lowest > threshold) or (highest <= threshold)
+
+        if check == "med_score":
+            # Uma nota individual dentro da faixa já garante aprovação; fora disso, qualquer nota nova pode mudar
+            lo, hi = self.MED_SCORE_LO * max_score, self.MED_SCORE_HI * max_score
+            return any(lo <= s <= hi for s in valid)
+
+        raise ValueError(f"Critério desconhecido: {check}")
+
+
+    def tier_decided(self, tier, scores, max_score, remaining, margin=None):
+        """Todos os critérios que dependem das notas do tipo de resposta `tier` estão decididos?"""
+        checks = {"ruim": ("var", "min_score"), "med": ("var", "med_score"), "max": ("var", "max_score")}
+        return all(self.is_decided(check, scores, max_score, remaining, margin) for check in checks[tier])
+
+
+    def _row_scores(self, scores):
+        scores = list(scores)[:self.ROW_REPS]
+        return scores + [None] * (self.ROW_REPS - len(scores))
 
 
     def build_row(self, question_id, integration_id, bolo_score,
@@ -81,9 +182,9 @@ class Validator:
             question_id,                                         # question_id DEV
             integration_id,                                      # Questão (integration_id)
             bolo_score,                                          # Receita de Bolo
-            *ruim_scores,                                        # Ruim 1, Ruim 2, Ruim 3
-            *med_scores,                                         # Med 1, Med 2, Med 3
-            *max_scores,                                         # Max 1, Max 2, Max 3
+            *self._row_scores(ruim_scores),                      # Ruim 1, Ruim 2, Ruim 3
+            *self._row_scores(med_scores),                       # Med 1, Med 2, Med 3
+            *self._row_scores(max_scores),                       # Max 1, Max 2, Max 3
             max_score,                                           # Max Score
             "",                                                  # question_id PRD
             "",                                                  # validada_por
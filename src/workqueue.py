@@ -0,0 +1,187 @@
+import os
+import re
+import uuid
+import socket
+import threading
+from contextlib import contextmanager
+import metrics
+
+_TABLE_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$")
+
+# status: pending -> running (com lease) -> done | failed. Um item running cujo lease venceu
+# (worker morto ou travado) volta a ser reivindicável; depois de max_attempts vira failed.
+_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id bigserial PRIMARY KEY,
+    integration_id text NOT NULL,
+    status text NOT NULL DEFAULT 'pending',
+    attempts int NOT NULL DEFAULT 0,
+    worker_id text,
+    lease_until timestamptz,
+    heartbeat_at timestamptz,
+    enqueued_at timestamptz NOT NULL DEFAULT NOW(),
+    started_at timestamptz,
+    finished_at timestamptz,
+    last_error text
+);
+CREATE UNIQUE INDEX IF NOT EXISTS {index}_active ON {table} (integration_id) WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS {index}_claim ON {table} (id) WHERE status IN ('pending', 'running');
+"""
+
+_ENQUEUE = """
+    INSERT INTO {table} (integration_id)
+    SELECT DISTINCT unnest(%s::text[])
+    ON CONFLICT (integration_id) WHERE status IN ('pending', 'running') DO NOTHING
+"""
+
+# Itens de workers que sumiram e já usaram todas as tentativas não voltam para a fila
+_EXPIRE = """
+    UPDATE {table}
+    SET status = 'failed', finished_at = NOW(),
+        last_error = 'lease expirou após ' || attempts || ' tentativas (worker ' || coalesce(worker_id, '?') || ')'
+    WHERE status = 'running' AND lease_until < NOW() AND attempts >= %s
+"""
+
+# SKIP LOCKED: workers concorrentes nunca esperam nem pegam a mesma linha
+_CLAIM = """
+    UPDATE {table} q
+    SET status = 'running', worker_id = %s, attempts = q.attempts + 1,
+        lease_until = NOW() + make_interval(secs => %s), heartbeat_at = NOW(), started_at = NOW()
+    WHERE q.id IN (
+        SELECT id FROM {table}
+        WHERE status = 'pending' OR (status = 'running' AND lease_until < NOW())
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING q.integration_id, q.attempts
+"""
+
+_HEARTBEAT = """
+    UPDATE {table}
+    SET lease_until = NOW() + make_interval(secs => %s), heartbeat_at = NOW()
+    WHERE worker_id = %s AND status = 'running'
+"""
+
+# Só o dono do lease conclui o item: se o lease venceu e outro worker o pegou, a conclusão é ignorada
+_COMPLETE = """
+    UPDATE {table}
+    SET status = %s, finished_at = NOW(), lease_until = NULL, last_error = %s
+    WHERE integration_id = ANY(%s::text[]) AND worker_id = %s AND status = 'running'
+    RETURNING integration_id
+"""
+
+_STATS = "SELECT status, count(*) FROM {table} GROUP BY status"
+
+# Workers que sobem juntos não disputam o CREATE TABLE/INDEX: o lock dura até o fim da transação do DDL
+_DDL_LOCK = "SELECT pg_advisory_xact_lock(hashtext(%s))"
+
+
+class WorkQueue:
+    """
+    Fila de integration_ids numa tabela do próprio PostgreSQL (mesma conexão de db.Database),
+    para vários processos/máquinas dividirem uma validação:
+
+    - enqueue: insere IDs como pending (um ID já pendente ou em andamento não é duplicado);
+    - claim: reivindica até N itens com FOR UPDATE SKIP LOCKED e um lease de `lease_s` segundos;
+    - heartbeat: thread que renova o lease dos itens do worker enquanto ele trabalha;
+    - complete: marca done/failed. Se o worker morrer, o lease vence e o item volta a ser reivindicável.
+    """
+
+    def __init__(self, database, table=None, lease_s=None, max_attempts=None, worker_id=None):
+        self.database = database
+        self.table = table or os.environ.get("WORK_QUEUE_TABLE", "validation_queue")
+        if not _TABLE_NAME.match(self.table):
+            raise ValueError(f"ERROR: nome de tabela inválido para a fila: {self.table!r}")
+        self.lease_s = lease_s or float(os.environ.get("WORK_QUEUE_LEASE_S", "300"))
+        self.max_attempts = max_attempts or int(os.environ.get("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+        self.poll_interval = float(os.environ.get("WORK_QUEUE_POLL_S", "10"))
+        # O sufixo aleatório distingue um processo reiniciado (mesmo hostname, muitas vezes o mesmo pid num
+        # container) do anterior: senão o heartbeat do novo renovaria os leases órfãos do processo morto
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._sql = {}
+
+    def _query(self, template):
+        if template not in self._sql:
+            self._sql[template] = template.format(table=self.table, index=self.table.replace(".", "_"))
+        return self._sql[template]
+
+    def ensure_table(self):
+        with self.database.connect() as conn:
+            conn.execute(_DDL_LOCK, (f"workqueue:{self.table}",))
+            conn.execute(self._query(_DDL))
+
+    def enqueue(self, integration_ids, chunk_size=1000):
+        """Enfileira os IDs (qualquer iterável). Retorna quantos entraram de fato."""
+        inserted = 0
+        chunk = []
+        with self.database.connect() as conn:
+            for integration_id in integration_ids:
+                chunk.append(str(integration_id))
+                if len(chunk) >= chunk_size:
+                    inserted += conn.execute(self._query(_ENQUEUE), (chunk,)).rowcount
+                    conn.commit()
+                    chunk = []
+            if chunk:
+                inserted += conn.execute(self._query(_ENQUEUE), (chunk,)).rowcount
+        return inserted
+
+    def claim(self, limit):
+        """Reivindica até `limit` itens para este worker. Retorna a lista de integration_ids."""
+        with metrics.span("queue.claim"), self.database.connect() as conn:
+            expired = conn.execute(self._query(_EXPIRE), (self.max_attempts,)).rowcount
+            rows = conn.execute(self._query(_CLAIM), (self.worker_id, self.lease_s, limit)).fetchall()
+        if expired:
+            metrics.incr("queue.expired", expired)
+            print(f"[Fila] {expired} itens esgotaram {self.max_attempts} tentativas sem conclusão e foram marcados como failed.")
+        reclaimed = sum(1 for _, attempts in rows if attempts > 1)
+        if reclaimed:
+            metrics.incr("queue.reclaimed", reclaimed)
+            print(f"[Fila] {reclaimed} itens com lease vencido retomados de outro worker.")
+        metrics.incr("queue.claimed", len(rows))
+        return [integration_id for integration_id, _ in rows]
+
+    def renew(self):
+        with self.database.connect() as conn:
+            return conn.execute(self._query(_HEARTBEAT), (self.lease_s, self.worker_id)).rowcount
+
+    @contextmanager
+    def heartbeat(self, interval=None):
+        """Renova os leases deste worker a cada `interval` segundos (padrão: um terço do lease) enquanto o bloco roda."""
+        interval = interval or self.lease_s / 3
+        stop = threading.Event()
+
+        def _beat():
+            while not stop.wait(interval):
+                try:
+                    self.renew()
+                except Exception as e:
+                    print(f"[Fila] Falha ao renovar leases de {self.worker_id}: {e}")
+
+        thread = threading.Thread(target=_beat, name="queue-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, integration_ids, ok=True, error=None):
+        """Marca os itens como done (ou failed, com `error`). Retorna os que este worker ainda detinha."""
+        integration_ids = [str(i) for i in integration_ids]
+        if not integration_ids:
+            return []
+        with self.database.connect() as conn:
+            rows = conn.execute(self._query(_COMPLETE),
+                                ("done" if ok else "failed", error, integration_ids, self.worker_id)).fetchall()
+        completed = [row[0] for row in rows]
+        lost = len(integration_ids) - len(completed)
+        if lost:
+            metrics.incr("queue.lost_leases", lost)
+            print(f"[Fila] AVISO: {lost} itens não estavam mais com {self.worker_id} (lease vencido); conclusão ignorada.")
+        return completed
+
+    def stats(self):
+        """{status: quantidade} da fila inteira."""
+        with self.database.connect() as conn:
+            return dict(conn.execute(self._query(_STATS)).fetchall())